@@ -251,7 +251,7 @@ class _StaffDashboardPageState extends State<StaffDashboardPage>
                           child: Hero(
                             tag: 'completion_image_${task.id}',
                             child: Image.network(
-                              taskData['completionImageUrl'] as String,
+                              '${taskData['completionImageUrl']}?size=thumb',
                               fit: BoxFit.cover,
                               errorBuilder: (context, error, stackTrace) => const CircleAvatar(
                                 backgroundColor: Colors.green,
@@ -224,21 +224,63 @@ async function loadCharts() {
 }
 
 // Tasks Management
-async function loadAllTasks() {
+// Only the columns the task table and CSV export use
+const TASK_LIST_FIELDS = 'aiCaption,studentName,registerNumber,location,assignedTo,createdAt,status';
+const TASKS_PAGE_SIZE = 100;
+const MAX_TASKS_PAGE_SIZE = 500;
+let tasksNextCursor = null;
+let tasksTotal = null;
+let taskSearchTimer = null;
+
+// Status filter and search are applied by the server, so they cover every task, not just loaded pages
+function taskListParams(limit, cursor) {
+    const params = new URLSearchParams({ limit: limit, fields: TASK_LIST_FIELDS });
+    const status = document.getElementById('taskStatusFilter').value;
+    const search = document.getElementById('taskSearch').value.trim();
+    if (status !== 'all') {
+        params.set('status', status);
+    }
+    if (search) {
+        params.set('search', search);
+    }
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    return params;
+}
+
+// append: load the next page; keepLoaded: re-read as many tasks as are already shown (auto refresh)
+async function loadAllTasks(append = false, keepLoaded = false) {
     try {
         const adminURL = getAdminURL();
-        const response = await fetch(`${adminURL}/admin/all_tasks`);
-        if (response.ok) {
-            const data = await response.json();
-            allTasks = data.tasks;
-            displayTasks(allTasks);
-        }
+        const wanted = keepLoaded ? Math.max(allTasks.length, TASKS_PAGE_SIZE) : TASKS_PAGE_SIZE;
+        let tasks = append ? allTasks : [];
+        let cursor = append ? tasksNextCursor : null;
+        let data = null;
+        do {
+            const limit = Math.min(wanted - (append ? 0 : tasks.length), MAX_TASKS_PAGE_SIZE);
+            const response = await fetch(`${adminURL}/admin/all_tasks?${taskListParams(limit, cursor)}`);
+            if (!response.ok) {
+                return;
+            }
+            data = await response.json();
+            tasks = tasks.concat(data.tasks);
+            cursor = data.nextCursor || null;
+        } while (!append && cursor && tasks.length < wanted);
+        allTasks = tasks;
+        tasksNextCursor = cursor;
+        tasksTotal = data.total;
+        displayTasks(allTasks);
     } catch (error) {
         console.error('Error loading tasks:', error);
         document.getElementById('tasksList').innerHTML = '<div class="error">Failed to load tasks</div>';
     }
 }
 
+function loadMoreTasks() {
+    return loadAllTasks(true);
+}
+
 function displayTasks(tasks) {
     const container = document.getElementById('tasksList');
     if (!tasks || tasks.length === 0) {
@@ -259,23 +301,21 @@ function displayTasks(tasks) {
                 <span class="status-badge status-${task.status}">${task.status}</span>
             </div>
         </div>
-    `).join('');
+    `).join('') + (tasksNextCursor ? `
+        <div style="text-align: center; margin-top: 15px;">
+            <button class="btn" onclick="loadMoreTasks()">Load more (${allTasks.length}${tasksTotal != null ? ` of ${tasksTotal}` : ''})</button>
+        </div>
+    ` : '');
 }
 
 function filterTasks() {
-    const status = document.getElementById('taskStatusFilter').value;
-    const filtered = status === 'all' ? allTasks : allTasks.filter(t => t.status === status);
-    displayTasks(filtered);
+    return loadAllTasks();
 }
 
 function searchTasks() {
-    const query = document.getElementById('taskSearch').value.toLowerCase();
-    const filtered = allTasks.filter(t => 
-        t.aiCaption.toLowerCase().includes(query) ||
-        t.studentName.toLowerCase().includes(query) ||
-        t.location.toLowerCase().includes(query)
-    );
-    displayTasks(filtered);
+    // Wait for a pause in typing before asking the server
+    clearTimeout(taskSearchTimer);
+    taskSearchTimer = setTimeout(() => loadAllTasks(), 300);
 }
 
 async function showTaskDetail(taskId) {
@@ -313,33 +353,12 @@ function displayTaskDetailModal(task) {
 }
 
 function exportTasks() {
-    const csv = convertTasksToCSV(allTasks);
-    downloadCSV(csv, 'tasks_export.csv');
-}
-
-function convertTasksToCSV(tasks) {
-    const headers = ['Task ID', 'Student Name', 'Register Number', 'Caption', 'Location', 'Status', 'Assigned To', 'Created At'];
-    const rows = tasks.map(t => [
-        t.taskId,
-        t.studentName,
-        t.registerNumber,
-        t.aiCaption,
-        t.location,
-        t.status,
-        t.assignedTo,
-        new Date(t.createdAt).toLocaleString()
-    ]);
-    
-    return [headers, ...rows].map(row => row.join(',')).join('\n');
-}
-
-function downloadCSV(csv, filename) {
-    const blob = new Blob([csv], { type: 'text/csv' });
-    const url = window.URL.createObjectURL(blob);
-    const a = document.createElement('a');
-    a.href = url;
-    a.download = filename;
-    a.click();
+    // Streamed by the admin server from Firestore, so the file has every task, not just loaded pages
+    if (!useAdminServer) {
+        alert('CSV export needs the admin server');
+        return;
+    }
+    window.location.href = `${ADMIN_SERVER_URL}/admin/export_data?type=tasks`;
 }
 
 // Staff Management
@@ -485,8 +504,9 @@ function displayStaffTasks(tasks, staffId, staffName) {
             <div style="display: flex; gap: 20px;">
                 <div style="flex-shrink: 0;">
                     ${task.imageUrl ? `
-                        <img src="${task.imageUrl}" 
+                        <img src="${task.imageUrl}?size=thumb" 
                              alt="Task image" 
+                             loading="lazy" 
                              style="width: 200px; height: 150px; object-fit: cover; border-radius: 8px; cursor: pointer;"
                              onclick="openImageModal('${task.imageUrl}')">
                     ` : '<div style="width: 200px; height: 150px; background: #f0f0f0; border-radius: 8px; display: flex; align-items: center; justify-content: center;">No Image</div>'}
@@ -519,8 +539,9 @@ function displayStaffTasks(tasks, staffId, staffName) {
                     ${task.completionImageUrl ? `
                         <div style="margin-top: 10px;">
                             <p style="margin: 5px 0;"><strong>Completion Photo:</strong></p>
-                            <img src="${task.completionImageUrl}" 
+                            <img src="${task.completionImageUrl}?size=thumb" 
                                  alt="Completion image" 
+                                 loading="lazy" 
                                  style="width: 150px; height: 100px; object-fit: cover; border-radius: 4px; cursor: pointer;"
                                  onclick="openImageModal('${task.completionImageUrl}')">
                         </div>
@@ -665,12 +686,28 @@ function searchStudents() {
 }
 
 // Media Gallery
-async function loadMediaGallery() {
+// Paged from the server's media catalog; type filter and sort are applied server-side
+const MEDIA_PAGE_SIZE = 60;
+let mediaNextOffset = null;
+let mediaTotal = null;
+
+async function loadMediaGallery(append = false) {
     try {
-        const response = await fetch(`${SERVER_URL}/admin/media_gallery`);
+        const type = document.getElementById('mediaTypeFilter').value;
+        const [sort, order] = document.getElementById('mediaSort').value.split(':');
+        const params = new URLSearchParams({ limit: MEDIA_PAGE_SIZE, sort, order });
+        if (type !== 'all') {
+            params.set('type', type);
+        }
+        if (append && mediaNextOffset != null) {
+            params.set('offset', mediaNextOffset);
+        }
+        const response = await fetch(`${getAdminURL()}/admin/media_gallery?${params}`);
         if (response.ok) {
             const data = await response.json();
-            allMedia = data.media;
+            allMedia = append ? allMedia.concat(data.media) : data.media;
+            mediaNextOffset = data.nextOffset != null ? data.nextOffset : null;
+            mediaTotal = data.total;
             displayMediaGallery(allMedia);
         }
     } catch (error) {
@@ -679,6 +716,10 @@ async function loadMediaGallery() {
     }
 }
 
+function loadMoreMedia() {
+    return loadMediaGallery(true);
+}
+
 function displayMediaGallery(media) {
     const container = document.getElementById('mediaGallery');
     if (!media || media.length === 0) {
@@ -689,21 +730,23 @@ function displayMediaGallery(media) {
     container.innerHTML = media.map(item => `
         <div class="media-item" onclick="viewMedia('${item.url}', '${item.type}')">
             ${item.type === 'video' ? 
-                `<video src="${item.url}" muted></video>` :
-                `<img src="${item.url}" alt="Media">`
+                `<video src="${item.url}" poster="${item.url}?size=poster" preload="none" muted></video>` :
+                `<img src="${item.url}?size=thumb" alt="Media" loading="lazy">`
             }
             <div class="media-overlay">
                 <div>${item.type === 'video' ? '🎥' : '📷'} ${item.filename}</div>
                 <div>${(item.size / 1024).toFixed(2)} KB</div>
             </div>
         </div>
-    `).join('');
+    `).join('') + (mediaNextOffset != null ? `
+        <div style="grid-column: 1 / -1; text-align: center; margin-top: 15px;">
+            <button class="btn" onclick="loadMoreMedia()">Load more (${allMedia.length}${mediaTotal != null ? ` of ${mediaTotal}` : ''})</button>
+        </div>
+    ` : '');
 }
 
 function filterMedia() {
-    const type = document.getElementById('mediaTypeFilter').value;
-    const filtered = type === 'all' ? allMedia : allMedia.filter(m => m.type === type);
-    displayMediaGallery(filtered);
+    return loadMediaGallery();
 }
 
 function viewMedia(url, type) {
@@ -716,7 +759,7 @@ async function cleanupOldMedia() {
     }
     
     try {
-        const response = await fetch(`${SERVER_URL}/admin/cleanup_media`, {
+        const response = await fetch(`${getAdminURL()}/admin/cleanup_media`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' }
         });
@@ -881,7 +924,10 @@ async function refreshAll() {
     console.log('🔄 Refreshing all data...');
     try {
         const activeSection = document.querySelector('.section.active');
-        if (activeSection) {
+        if (activeSection && activeSection.id === 'tasks') {
+            // Keep the pages the admin has loaded instead of going back to page one
+            await loadAllTasks(false, true);
+        } else if (activeSection) {
             await loadSectionData(activeSection.id);
         }
         await loadStats();
@@ -1166,7 +1212,11 @@ function addReassignButtonToTasks() {
                     </div>
                 </div>
             </div>
-        `).join('');
+        `).join('') + (tasksNextCursor ? `
+            <div style="text-align: center; margin-top: 15px;">
+                <button class="btn" onclick="loadMoreTasks()">Load more (${allTasks.length}${tasksTotal != null ? ` of ${tasksTotal}` : ''})</button>
+            </div>
+        ` : '');
     };
 }
 
@@ -1181,7 +1231,9 @@ document.addEventListener('DOMContentLoaded', function() {
 
 // Also load unassigned tasks when viewing tasks section
 const originalLoadAllTasks = loadAllTasks;
-loadAllTasks = async function() {
-    await originalLoadAllTasks();
-    await loadUnassignedTasks();
+loadAllTasks = async function(append = false, keepLoaded = false) {
+    await originalLoadAllTasks(append, keepLoaded);
+    if (!append) {
+        await loadUnassignedTasks();
+    }
 };
@@ -4,17 +4,26 @@ Admin Server - Separate server for admin panel operations
 Integrates with main app.py server via API calls and direct database access
 """
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 import firebase_admin
 from firebase_admin import credentials, firestore
 from datetime import datetime, timedelta
 import os
 import json
+import threading
 from collections import defaultdict
 import io
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
+import task_stats
+import csv_export
+import backup
+import derivatives
+import media_catalog
+import media_store
+from conditional import conditional
+from firestore_helpers import fs_filter, fs_count, fs_task_page, parse_fields, parse_page_size
 
 app = Flask(__name__)
 CORS(app)
@@ -45,6 +54,8 @@ MAIN_SERVER_URL = os.environ.get('MAIN_SERVER_URL', 'http://localhost:5000')
 UPLOAD_FOLDER = 'uploads'
 PROCESSED_FOLDER = 'processed'
 COMPLETED_FOLDER = 'completed'
+# One backup at a time; a second one would share the .partial directory name within the same second
+_backup_lock = threading.Lock()
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -61,10 +72,20 @@ def health_check():
 
 @app.route('/admin/all_tasks', methods=['GET'])
 def get_all_tasks():
-    """Get all tasks from database"""
+    """Get one page of tasks from database (newest first).
+
+    Query params: limit, cursor (nextCursor of the previous page), fields (comma-separated projection),
+    status, search (case-insensitive match on caption, student, register number and location)
+    """
     try:
-        tasks_ref = db.collection('tasks')
-        tasks_docs = tasks_ref.stream()
+        limit = parse_page_size(request.args.get('limit'))
+        fields = parse_fields(request.args.get('fields'), required=['createdAt'])
+        try:
+            status = request.args.get('status') if request.args.get('status') not in (None, '', 'all') else None
+            search = request.args.get('search', '').strip()
+            tasks_docs, next_cursor = fs_task_page(db, limit, request.args.get('cursor'), fields, status, search)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         tasks = []
         for doc in tasks_docs:
@@ -79,12 +100,17 @@ def get_all_tasks():
             
             tasks.append(task_data)
         
-        # Sort by creation date (newest first)
-        tasks.sort(key=lambda x: x.get('createdAt', ''), reverse=True)
+        # Total from the maintained counter document (None until it has been built, or when searching)
+        stats = task_stats.read_task_stats(db, rebuild_if_missing=False)
+        total = None
+        if stats and not search:
+            total = stats['byStatus'].get(status, 0) if status else stats['total']
         
         return jsonify({
             'tasks': tasks,
-            'total': len(tasks),
+            'count': len(tasks),
+            'total': total,
+            'nextCursor': next_cursor,
             'timestamp': datetime.now().isoformat()
         }), 200
         
@@ -120,25 +146,26 @@ def get_task_detail(task_id):
 # ============================================================================
 
 @app.route('/admin/all_students', methods=['GET'])
+@conditional('tasks', 'students')
 def get_all_students():
     """Get all students with their activity statistics"""
     try:
         students_ref = db.collection('students')
         students_docs = students_ref.stream()
         
+        # Report counts for every student in one read instead of one query per student
+        task_stats.read_task_stats(db)  # backfills student_stats on first use
+        report_counts = {s['registerNumber']: s.get('totalReports', 0) for s in task_stats.read_student_stats(db)}
+        
         students = []
         for doc in students_docs:
             student_data = doc.to_dict()
             student_id = doc.id
             
-            # Get task count for this student
-            tasks_query = db.collection('tasks').where('registerNumber', '==', student_id)
-            tasks_count = len(list(tasks_query.stream()))
-            
             students.append({
                 'registerNumber': student_id,
                 'name': student_data.get('name', 'Unknown'),
-                'totalReports': tasks_count,
+                'totalReports': report_counts.get(student_id, 0),
                 'lastActive': student_data.get('lastActive', None),
                 'fcmToken': 'Yes' if student_data.get('fcmToken') else 'No'
             })
@@ -183,45 +210,9 @@ def get_student_detail(student_id):
 
 @app.route('/admin/media_gallery', methods=['GET'])
 def get_media_gallery():
-    """Get all media files from upload folders"""
+    """One page of media files from the media catalog (folder, type, sort, order, limit, offset)"""
     try:
-        media_files = []
-        
-        # Scan all media folders
-        folders = [
-            ('uploads', UPLOAD_FOLDER),
-            ('processed', PROCESSED_FOLDER),
-            ('completed', COMPLETED_FOLDER)
-        ]
-        
-        for folder_name, folder_path in folders:
-            if os.path.exists(folder_path):
-                for filename in os.listdir(folder_path):
-                    file_path = os.path.join(folder_path, filename)
-                    if os.path.isfile(file_path):
-                        file_size = os.path.getsize(file_path)
-                        file_ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-                        
-                        media_type = 'video' if file_ext in ['mp4', 'mov', 'avi', 'mkv'] else 'image'
-                        
-                        media_files.append({
-                            'filename': filename,
-                            'folder': folder_name,
-                            'url': f"{MAIN_SERVER_URL}/{folder_name}/{filename}",
-                            'size': file_size,
-                            'type': media_type,
-                            'extension': file_ext,
-                            'modified': datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat()
-                        })
-        
-        # Sort by modification date (newest first)
-        media_files.sort(key=lambda x: x['modified'], reverse=True)
-        
-        return jsonify({
-            'media': media_files,
-            'total': len(media_files),
-            'totalSize': sum(m['size'] for m in media_files)
-        }), 200
+        return jsonify(media_catalog.gallery(request.args, MAIN_SERVER_URL)), 200
         
     except Exception as e:
         print(f"Error fetching media gallery: {e}")
@@ -237,20 +228,27 @@ def cleanup_old_media():
         files_deleted = 0
         space_freed = 0
         
-        folders = [UPLOAD_FOLDER, PROCESSED_FOLDER, COMPLETED_FOLDER]
-        
-        for folder_path in folders:
-            if os.path.exists(folder_path):
-                for filename in os.listdir(folder_path):
-                    file_path = os.path.join(folder_path, filename)
-                    if os.path.isfile(file_path):
-                        file_mtime = datetime.fromtimestamp(os.path.getmtime(file_path))
-                        
-                        if file_mtime < cutoff_date:
-                            file_size = os.path.getsize(file_path)
-                            os.remove(file_path)
-                            files_deleted += 1
-                            space_freed += file_size
+        folders = {'uploads': UPLOAD_FOLDER, 'processed': PROCESSED_FOLDER, 'completed': COMPLETED_FOLDER}
+        
+        # Ages are the catalog's per-file write times: a deduplicated file shares its
+        # blob's inode, so its mtime can be that of a much older upload
+        for folder_name, filename in media_catalog.older_than(cutoff_date.timestamp()):
+            file_path = os.path.join(folders[folder_name], filename)
+            try:
+                file_stat = os.stat(file_path)
+            except FileNotFoundError:
+                media_catalog.remove(folder_name, filename)
+                continue
+            os.remove(file_path)
+            media_catalog.remove(folder_name, filename)
+            derivatives.remove(folder_name, filename)
+            files_deleted += 1
+            # Files in the media store only free space once their blob is unreferenced
+            if file_stat.st_nlink == 1:
+                space_freed += file_stat.st_size
+        
+        # Blobs whose last logical file was just deleted
+        space_freed += media_store.gc()[1]
         
         return jsonify({
             'filesDeleted': files_deleted,
@@ -271,28 +269,16 @@ def get_analytics():
     """Get analytics data for specified time range"""
     try:
         range_param = request.args.get('range', 'all')
-        
-        # Calculate date range
         now = datetime.now()
-        if range_param == 'today':
-            start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        elif range_param == 'week':
-            start_date = now - timedelta(days=7)
-        elif range_param == 'month':
-            start_date = now - timedelta(days=30)
-        else:
-            start_date = datetime.min
-        
-        # Get tasks in range
-        tasks_ref = db.collection('tasks')
-        all_tasks = list(tasks_ref.stream())
-        
-        filtered_tasks = []
-        for doc in all_tasks:
-            task_data = doc.to_dict()
-            created_at = task_data.get('createdAt')
-            if created_at and created_at >= start_date:
-                filtered_tasks.append(task_data)
+        start_date = _range_start(range_param, now)
+        if start_date is None:
+            # All time: read the maintained counters instead of scanning tasks
+            return jsonify(_analytics_from_counters(range_param, now)), 200
+        
+        # Get tasks in range (filtered by Firestore, only the fields used below)
+        fields = ['status', 'createdAt', 'completedAt', 'registerNumber', 'assignedTo']
+        tasks_query = fs_filter(db.collection('tasks'), 'createdAt', '>=', start_date).select(fields)
+        filtered_tasks = [doc.to_dict() for doc in tasks_query.stream()]
         
         # Calculate metrics
         total_tasks = len(filtered_tasks)
@@ -335,6 +321,55 @@ def get_analytics():
         print(f"Error generating analytics: {e}")
         return jsonify({'error': str(e)}), 500
 
+def _range_start(range_param, now):
+    """Start of an analytics range (today, week, month); None for all time."""
+    if range_param == 'today':
+        return now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if range_param == 'week':
+        return now - timedelta(days=7)
+    if range_param == 'month':
+        return now - timedelta(days=30)
+    return None
+
+def _analytics_from_counters(range_param, now):
+    """All-time analytics from the materialized counters (no task scan)."""
+    stats = task_stats.read_task_stats(db)
+    total_tasks = stats['total']
+    completed_tasks = stats['byStatus'].get('completed', 0)
+    pending_tasks = stats['byStatus'].get('pending', 0)
+    completion_rate = (completed_tasks / total_tasks * 100) if total_tasks > 0 else 0
+    active_students = len(task_stats.read_student_stats(db))
+    active_staff = len([sid for sid, counts in stats['byAssignee'].items() if counts.get('total', 0) > 0])
+    return {
+        'totalTasks': total_tasks,
+        'completedTasks': completed_tasks,
+        'pendingTasks': pending_tasks,
+        'completionRate': round(completion_rate, 2),
+        'avgResponseTime': round(task_stats.average_response_minutes(stats), 2),
+        'activeUsers': active_students + active_staff,
+        'activeStudents': active_students,
+        'activeStaff': active_staff,
+        'range': range_param,
+        'startDate': datetime.min.isoformat(),
+        'endDate': now.isoformat()
+    }
+
+@app.route('/admin/stats/rebuild', methods=['POST'])
+def rebuild_task_stats():
+    """Recompute the materialized task counters from the tasks collection"""
+    try:
+        stats = task_stats.rebuild(db)
+        return jsonify({
+            'success': True,
+            'total': stats['total'],
+            'byStatus': stats['byStatus'],
+            'staff': len(stats['byAssignee']),
+            'timestamp': datetime.now().isoformat()
+        }), 200
+    except Exception as e:
+        print(f"Error rebuilding task stats: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/admin/recent_activity', methods=['GET'])
 def get_recent_activity():
     """Get recent system activity"""
@@ -520,22 +555,14 @@ def get_system_stats():
     """Get system statistics"""
     try:
         # Database stats
-        total_tasks = len(list(db.collection('tasks').stream()))
-        total_students = len(list(db.collection('students').stream()))
-        total_staff = len(list(db.collection('staff').stream()))
-        
-        # Storage stats
-        total_storage = 0
-        file_count = 0
-        
-        folders = [UPLOAD_FOLDER, PROCESSED_FOLDER, COMPLETED_FOLDER]
-        for folder in folders:
-            if os.path.exists(folder):
-                for filename in os.listdir(folder):
-                    file_path = os.path.join(folder, filename)
-                    if os.path.isfile(file_path):
-                        total_storage += os.path.getsize(file_path)
-                        file_count += 1
+        total_tasks = task_stats.read_task_stats(db)['total']
+        total_students = fs_count(db.collection('students'))
+        total_staff = fs_count(db.collection('staff'))
+        
+        # Storage stats (trigger-maintained totals, no folder scan)
+        storage = media_catalog.totals()
+        total_storage = storage['bytes']
+        file_count = storage['files']
         
         return jsonify({
             'database': {
@@ -546,7 +573,8 @@ def get_system_stats():
             'storage': {
                 'totalFiles': file_count,
                 'totalSize': total_storage,
-                'totalSizeMB': round(total_storage / 1024 / 1024, 2)
+                'totalSizeMB': round(total_storage / 1024 / 1024, 2),
+                'byFolder': storage['byFolder']
             },
             'timestamp': datetime.now().isoformat()
         }), 200
@@ -556,86 +584,73 @@ def get_system_stats():
 
 @app.route('/admin/backup_database', methods=['POST'])
 def backup_database():
-    """Create database backup"""
+    """Create database backup (compressed NDJSON chunks + manifest)
+
+    JSON body (optional): {"incremental": true} to store only documents changed since the last backup
+    """
+    if not _backup_lock.acquire(blocking=False):
+        return jsonify({'error': 'A backup is already running'}), 409
     try:
-        backup_data = {
-            'timestamp': datetime.now().isoformat(),
-            'tasks': [],
-            'students': [],
-            'staff': []
-        }
-        
-        # Backup tasks
-        for doc in db.collection('tasks').stream():
-            task_data = doc.to_dict()
-            task_data['id'] = doc.id
-            backup_data['tasks'].append(task_data)
-        
-        # Backup students
-        for doc in db.collection('students').stream():
-            student_data = doc.to_dict()
-            student_data['id'] = doc.id
-            backup_data['students'].append(student_data)
-        
-        # Backup staff
-        for doc in db.collection('staff').stream():
-            staff_data = doc.to_dict()
-            staff_data['id'] = doc.id
-            backup_data['staff'].append(staff_data)
-        
-        # Save to file
-        backup_filename = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        backup_path = os.path.join('backups', backup_filename)
-        
-        os.makedirs('backups', exist_ok=True)
-        
-        with open(backup_path, 'w') as f:
-            json.dump(backup_data, f, indent=2, default=str)
+        data = request.get_json(silent=True) or {}
+        manifest = backup.create_backup(db, incremental=bool(data.get('incremental')))
         
         return jsonify({
             'message': 'Backup created successfully',
-            'filename': backup_filename,
-            'path': backup_path,
-            'size': os.path.getsize(backup_path)
+            'filename': manifest['id'],
+            'path': os.path.join(backup.BACKUP_DIR, manifest['id']),
+            'size': manifest['bytes'],
+            'type': manifest['type'],
+            'base': manifest['base'],
+            'documents': manifest['documents'],
+            'durationSeconds': manifest['durationSeconds'],
+            'docsPerSecond': manifest['docsPerSecond']
         }), 200
         
     except Exception as e:
         print(f"Error creating backup: {e}")
         return jsonify({'error': str(e)}), 500
+    finally:
+        _backup_lock.release()
+
+@app.route('/admin/backups', methods=['GET'])
+def list_backups():
+    """List completed backups (newest first)"""
+    try:
+        manifests = backup.list_backups()
+        return jsonify({
+            'backups': [{k: m.get(k) for k in ('id', 'type', 'base', 'startedAt', 'documents', 'bytes', 'docsPerSecond')}
+                        for m in reversed(manifests)],
+            'total': len(manifests)
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/admin/export_data', methods=['GET'])
 def export_data():
-    """Export data as CSV"""
+    """Export data as CSV, streamed row by row.
+
+    Query params: type (tasks, students, staff, notifications), start/end (ISO dates),
+    gzip=true for a .csv.gz download
+    """
     try:
         data_type = request.args.get('type', 'tasks')
-        
-        if data_type == 'tasks':
-            tasks = list(db.collection('tasks').stream())
-            csv_data = "Task ID,Student Name,Register Number,Caption,Location,Status,Assigned To,Created At\n"
-            
-            for doc in tasks:
-                task = doc.to_dict()
-                csv_data += f"{doc.id},{task.get('studentName','')},{task.get('registerNumber','')},{task.get('aiCaption','')},{task.get('location','')},{task.get('status','')},{task.get('assignedTo','')},{task.get('createdAt','')}\n"
-        
-        elif data_type == 'students':
-            students = list(db.collection('students').stream())
-            csv_data = "Register Number,Name,Total Reports\n"
-            
-            for doc in students:
-                student = doc.to_dict()
-                tasks_count = len(list(db.collection('tasks').where('registerNumber', '==', doc.id).stream()))
-                csv_data += f"{doc.id},{student.get('name','')},{tasks_count}\n"
-        
-        else:
+        if data_type not in csv_export.ROW_GENERATORS:
             return jsonify({'error': 'Invalid data type'}), 400
         
-        # Create response
-        output = io.BytesIO()
-        output.write(csv_data.encode('utf-8'))
-        output.seek(0)
+        try:
+            start, end = csv_export.parse_date_range(request.args.get('start'), request.args.get('end'))
+        except ValueError:
+            return jsonify({'error': 'Invalid date, use YYYY-MM-DD or ISO 8601'}), 400
+        
+        compress = request.args.get('gzip', 'false').lower() == 'true'
+        rows = csv_export.start_rows(csv_export.ROW_GENERATORS[data_type](db, start, end))
+        filename = f'{data_type}_export_{datetime.now().strftime("%Y%m%d")}.csv' + ('.gz' if compress else '')
         
-        return send_file(output, mimetype='text/csv', as_attachment=True,
-                        download_name=f'{data_type}_export_{datetime.now().strftime("%Y%m%d")}.csv')
+        return Response(
+            stream_with_context(csv_export.stream_csv(rows, compress=compress)),
+            mimetype='application/gzip' if compress else 'text/csv',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
         
     except Exception as e:
         print(f"Error exporting data: {e}")
@@ -648,4 +663,8 @@ if __name__ == '__main__':
     print(f"Main Server URL: {MAIN_SERVER_URL}")
     print(f"Admin Server starting on port 5001...")
     print("="*60)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Leftovers of backups interrupted by a previous run (never while requests may be writing one)
+        backup.remove_partial_backups()
+        media_catalog.start_reconcile({'uploads': UPLOAD_FOLDER, 'processed': PROCESSED_FOLDER, 'completed': COMPLETED_FOLDER})
     app.run(host='0.0.0.0', port=5001, debug=True)
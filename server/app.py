@@ -1,19 +1,40 @@
 # app.py
-from flask import Flask, request, jsonify, send_from_directory, url_for, make_response, send_file
+from flask import Flask, request, jsonify, send_from_directory, url_for, send_file
 import os
 from PIL import Image
 from werkzeug.utils import secure_filename
 import blip_processor
+import caption_cache
+import caption_queue
+import derivatives
+import ingest
+import media_catalog
+import media_store
+import media_serving
+import model_server
+from staff_load import staff_load_index
+from profile_cache import profile_cache, PROFILE_CACHE_LISTENERS
+from task_replica import task_replica, TASK_REPLICA_ENABLED
+import orphan_tasks
+import bulk_writes
+import student_notifications
+import task_stats
+from conditional import conditional, register_version_source, get_stats as conditional_stats
 import uuid
 import firebase_admin
 from firebase_admin import credentials, firestore, messaging
 from datetime import datetime
-from google.cloud.firestore import FieldFilter
+from firestore_helpers import fs_filter, fs_count, fs_top, fs_task_page, parse_fields, parse_page_size
 import requests
 import io
 import json
+import time
 
 app = Flask(__name__)
+# Uploads are streamed to disk with hashing, type sniffing and size limits (see ingest.py)
+app.request_class = ingest.IngestRequest
+app.config['MAX_CONTENT_LENGTH'] = ingest.MAX_CONTENT_LENGTH
+media_serving.configure(app)
 
 # Configure server base URL - IMPORTANT: Set this to your actual server IP/domain
 SERVER_BASE_URL = os.environ.get('SERVER_BASE_URL', 'https://zhgkq02n-5000.inc1.devtunnels.ms')
@@ -21,7 +42,11 @@ print(f"🌐 Server configured with base URL: {SERVER_BASE_URL}")
 print(f"🔧 Server will be accessible at: {SERVER_BASE_URL}")
 print(f"📱 Ensure Flutter app ServerConfig matches this URL")
 
+# Startup phase durations in seconds (model/font phases are filled in by the background loader)
+STARTUP_TIMINGS = {}
+
 # --- Initialize Firebase Admin SDK ---
+_phase_started = time.perf_counter()
 try:
     # This key file must be in the same directory as app.py
     cred = credentials.Certificate("serviceAccountKey.json")
@@ -29,6 +54,7 @@ try:
     print("✅ Firebase Admin SDK initialized successfully.")
 except Exception as e:
     print(f"❌ ERROR: Failed to initialize Firebase Admin SDK: {e}")
+STARTUP_TIMINGS['firebaseInit'] = round(time.perf_counter() - _phase_started, 2)
 
 # --- Folder and Extension Configuration ---
 UPLOAD_FOLDER, PROCESSED_FOLDER, COMPLETED_FOLDER = 'uploads', 'processed', 'completed'
@@ -37,24 +63,21 @@ os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 os.makedirs(COMPLETED_FOLDER, exist_ok=True)
 app.config.update(UPLOAD_FOLDER=UPLOAD_FOLDER, PROCESSED_FOLDER=PROCESSED_FOLDER, COMPLETED_FOLDER=COMPLETED_FOLDER)
 
-def allowed_file(filename):
-    """Checks if a file has an allowed extension."""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'mp4', 'mov', 'avi', 'mkv'}
+# --- Caption backend: in-process model, or a shared model server (see model_server.py) ---
+MODEL_SERVER_ADDRESS = os.environ.get('MODEL_SERVER_ADDRESS', '')
+if MODEL_SERVER_ADDRESS:
+    caption_service = model_server.ModelServerClient(MODEL_SERVER_ADDRESS)
+    print(f"🧠 Captions served by model server at {MODEL_SERVER_ADDRESS}")
+else:
+    caption_service = blip_processor
 
-def is_video_file(filename):
-    """Check if file is a video."""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'mp4', 'mov', 'avi', 'mkv'}
+# Placeholder stored in aiCaption until a caption worker fills it in
+CAPTION_PENDING = 'AI caption pending'
 
-# --- Firestore compatibility helper (filter vs where) ---
-def fs_filter(query, field, op, value):
-    """Use modern .filter(FieldFilter) if available, else fall back to .where()."""
-    if hasattr(query, 'filter'):
-        try:
-            return query.filter(FieldFilter(field, op, value))
-        except Exception:
-            # In case the installed SDK exposes attribute but not compatible
-            return query.where(field, op, value)
-    return query.where(field, op, value)
+# Change versions for conditional GETs, fed by the snapshot listeners (None while not live)
+register_version_source('tasks', task_replica.version)
+register_version_source('staff', lambda: profile_cache.version('staff'))
+register_version_source('students', lambda: profile_cache.version('students'))
 
 def test_fcm_token(token, student_id):
     """Test if FCM token is valid without sending actual notification"""
@@ -81,13 +104,12 @@ def send_completion_notification(student_id, completed_image_url, caption, staff
     """Sends a push notification to a student when their task is completed with enhanced data."""
     db = firestore.client()
     try:
-        student_ref = db.collection('students').document(student_id)
-        student_doc = student_ref.get()
-        if not student_doc.exists:
+        student_data = profile_cache.get(db, 'students', student_id)
+        if student_data is None:
             print(f"Error: Student document for ID '{student_id}' not found.")
             return
 
-        token = student_doc.to_dict().get('fcmToken')
+        token = student_data.get('fcmToken')
         if not token:
             print(f"Error: FCM token not found for student '{student_id}'.")
             return
@@ -197,7 +219,7 @@ def send_completion_notification(student_id, completed_image_url, caption, staff
             }
             print(f'📝 DEBUG: Saving notification with imageUrl: {completed_image_url}')
             print(f'📝 DEBUG: Full notification data: {notification_data}')
-            db.collection('notifications').document(student_id).collection('user_notifications').add(notification_data)
+            student_notifications.add(db, student_id, notification_data)
             print(f'✅ Notification saved to database for student {student_id}')
         except Exception as save_error:
             print(f'⚠️ Error saving notification to database: {save_error}')
@@ -209,12 +231,11 @@ def send_thank_you_notification_internal(student_id, task_id, staff_name='Garden
     """Internal function to send thank you notification to student."""
     db = firestore.client()
     try:
-        student_doc = db.collection('students').document(student_id).get()
-        if not student_doc.exists:
+        student_data = profile_cache.get(db, 'students', student_id)
+        if student_data is None:
             print(f"⚠️ Student {student_id} not found for thank you notification")
             return
 
-        student_data = student_doc.to_dict()
         fcm_token = student_data.get('fcmToken')
 
         if fcm_token:
@@ -246,8 +267,7 @@ def send_thank_you_notification_internal(student_id, task_id, staff_name='Garden
                 print(f'⚠️ FCM error for thank you notification: {fcm_error}')
 
         # Save to database regardless of FCM success
-        notification_ref = db.collection('notifications').document(student_id).collection('user_notifications')
-        notification_ref.add({
+        student_notifications.add(db, student_id, {
             'id': f'thank_you_{task_id}_{datetime.now().microsecond}',
             'title': 'Thank You for Your Report!',
             'message': f'Thank you for helping us maintain our garden. Your report has been addressed by {staff_name}.',
@@ -306,6 +326,13 @@ def send_new_task_notification_to_staff(caption, location):
         print("   Continuing with upload despite notification failure.")
 
 
+@app.errorhandler(413)
+@app.errorhandler(415)
+def upload_rejected(error):
+    """JSON instead of Flask's HTML page when an upload is refused while it is being received."""
+    return jsonify({'error': error.description}), error.code
+
+
 @app.route('/upload/image', methods=['POST'])
 def upload_image():
     """Handles image uploads from students."""
@@ -340,89 +367,25 @@ def upload_image():
     else:
         print("📍 No GPS data provided with upload")
     
-    if file and allowed_file(file.filename):
-        # Check if file is a video
-        is_video = is_video_file(file.filename)
-        
-        # Use appropriate extension
-        if is_video:
-            file_ext = file.filename.rsplit('.', 1)[1].lower()
-            unique_filename = f"{uuid.uuid4()}.{file_ext}"
-        else:
-            unique_filename = f"{uuid.uuid4()}.jpg"
-            
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(filepath)
+    if file:
+        # A full caption queue refuses the upload before anything is stored or a task exists
+        if not caption_queue.reserve():
+            print("⚠️ Caption queue full, upload refused")
+            return jsonify({'error': 'Too many uploads are being processed, please try again shortly'}), 503, {'Retry-After': '10'}
         
+        # Type and extension come from the file's magic bytes, not its name
+        try:
+            upload = ingest.finish(file, app.config['UPLOAD_FOLDER'])
+        except ingest.IngestError as e:
+            caption_queue.release()
+            return jsonify({'error': str(e)}), e.status
+        media_catalog.record('uploads', upload.path)
+        is_video = upload.is_video
+        unique_filename = upload.filename
+        filepath = upload.path
+        
+        submitted = False
         try:
-            if is_video:
-                # For videos, extract frame and generate AI caption
-                print(f"✅ Video uploaded: {unique_filename}")
-                
-                # Copy video to processed folder
-                import shutil
-                processed_path = os.path.join(app.config['PROCESSED_FOLDER'], unique_filename)
-                shutil.copy(filepath, processed_path)
-                print(f"✅ Video copied to processed folder")
-                
-                # Extract first frame from video for AI caption generation
-                try:
-                    import cv2
-                    video_capture = cv2.VideoCapture(filepath)
-                    success, frame = video_capture.read()
-                    video_capture.release()
-                    
-                    if success:
-                        # Convert frame to PIL Image
-                        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                        frame_image = Image.fromarray(frame_rgb)
-                        
-                        # Generate AI caption from video frame
-                        try:
-                            caption = blip_processor.generate_caption(frame_image)
-                            print(f"✅ AI Caption generated from video frame: {caption}")
-                            
-                            # Add user location details if provided
-                            if user_caption:
-                                caption = f"{caption} ({user_caption})"
-                                print(f"✅ Combined caption with location details: {caption}")
-                        except Exception as caption_error:
-                            print(f"⚠️ AI Caption generation failed: {caption_error}")
-                            caption = user_caption if user_caption else "Video upload - maintenance required"
-                    else:
-                        print(f"⚠️ Could not extract frame from video")
-                        caption = user_caption if user_caption else "Video upload - maintenance required"
-                        
-                except ImportError:
-                    print(f"⚠️ OpenCV not installed, cannot extract video frame")
-                    caption = user_caption if user_caption else "Video upload - maintenance required"
-                except Exception as video_error:
-                    print(f"⚠️ Video frame extraction failed: {video_error}")
-                    caption = user_caption if user_caption else "Video upload - maintenance required"
-                
-            else:
-                # Process images with AI
-                image = Image.open(filepath).convert("RGB")
-                
-                # Try to generate caption with error handling
-                try:
-                    caption = blip_processor.generate_caption(image)
-                    print(f"✅ AI Caption generated: {caption}")
-                except Exception as caption_error:
-                    print(f"⚠️ AI Caption generation failed: {caption_error}")
-                    caption = "Garden maintenance required - AI processing unavailable"
-                
-                # Try to create captioned image with error handling
-                try:
-                    captioned_image = blip_processor.add_text_to_image(image.copy(), f"Caption: {caption}")
-                    captioned_image.save(os.path.join(app.config['PROCESSED_FOLDER'], unique_filename))
-                    print(f"✅ Captioned image saved")
-                except Exception as image_error:
-                    print(f"⚠️ Image captioning failed: {image_error}")
-                    # Save original image if captioning fails
-                    image.save(os.path.join(app.config['PROCESSED_FOLDER'], unique_filename))
-                    print(f"✅ Original image saved as fallback")
-            
             # Use configured base URL instead of request.url_root to avoid localhost issues
             image_url = f"{SERVER_BASE_URL}/processed/{unique_filename}"
             print(f"Generated media_url: {image_url}")
@@ -442,7 +405,8 @@ def upload_image():
                 'studentName': student_name,
                 'registerNumber': register_number,
                 'studentCaption': user_caption,
-                'aiCaption': caption,
+                'aiCaption': CAPTION_PENDING,
+                'captionStatus': 'pending',
                 'imageUrl': image_url,
                 'location': location,
                 'status': 'pending',
@@ -450,17 +414,35 @@ def upload_image():
                 'createdAt': firestore.SERVER_TIMESTAMP,
                 'completedAt': None,
                 'completionImageUrl': None,
-                'gpsData': gps_data
+                'mediaSha256': upload.sha256,
+                'gpsData': gps_data,
+                # e.g. the 'staff1' fallback when no staff member could be picked
+                **orphan_tasks.assignment_fields(db, assigned_staff_id, new_task=True)
             }
             
-            db.collection('tasks').document(task_id).set(task_data)
+            batch = db.batch()
+            batch.set(db.collection('tasks').document(task_id), task_data)
+            task_stats.record(batch, db, None, task_data)
+            batch.commit()
             print(f"✅ Task {task_id} created and assigned to staff: {assigned_staff_id}")
             
-            send_notification_to_assigned_staff(assigned_staff_id, caption, location, task_id)
+            # BLIP captioning, the processed copy and the staff notification run on a caption worker
+            caption_job = {
+                'filepath': filepath,
+                'unique_filename': unique_filename,
+                'is_video': is_video,
+                'user_caption': user_caption,
+                'location': location,
+                'assigned_staff_id': assigned_staff_id
+            }
+            caption_queue.submit(task_id, caption_job)
+            submitted = True
             
             response_data = {
-                'aiCaption': caption if caption else 'No caption generated',
-                'caption': caption if caption else 'No caption generated',
+                'aiCaption': CAPTION_PENDING,
+                'caption': CAPTION_PENDING,
+                'captionStatus': 'pending',
+                'statusUrl': f"{SERVER_BASE_URL}/upload/status/{task_id}",
                 'image_url': image_url if image_url else '',  # Keep original for compatibility
                 'imageUrl': image_url if image_url else '',   # Add Flutter-expected field
                 'taskId': task_id if task_id else '',
@@ -478,37 +460,197 @@ def upload_image():
         except Exception as e:
             print(f"❌ Error processing upload: {e}")
             return jsonify({'error': str(e)}), 500
+        finally:
+            if not submitted:
+                caption_queue.release()
             
     return jsonify({'error': 'Invalid file'}), 400
 
 
-def assign_task_to_staff(db):
-    """Assigns task to staff member using round-robin or least-loaded strategy."""
+def _caption_video_upload(filepath, unique_filename, user_caption):
+    """Links an uploaded video into the processed folder and captions its first frame.
+
+    Returns (caption, captionStatus): 'completed', or 'fallback' when a default caption was used.
+    """
+    print(f"✅ Video uploaded: {unique_filename}")
+    
+    # Same bytes under the processed name (hard link, no copy)
+    processed_path = os.path.join(app.config['PROCESSED_FOLDER'], unique_filename)
+    media_store.link(filepath, processed_path)
+    media_catalog.record('processed', processed_path)
+    print(f"✅ Video linked into processed folder")
+    
+    # Extract first frame from video for AI caption generation
     try:
-        staff_collection = db.collection('staff').stream()
-        staff_list = []
-        
-        for staff_doc in staff_collection:
-            staff_data = staff_doc.to_dict()
-            staff_id = staff_doc.id
+        import cv2
+        video_capture = cv2.VideoCapture(filepath)
+        success, frame = video_capture.read()
+        video_capture.release()
+        
+        if success:
+            # Convert frame to PIL Image
+            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            frame_image = Image.fromarray(frame_rgb)
             
-            pending_tasks = db.collection('tasks').filter(FieldFilter('assignedTo', '==', staff_id)).filter(FieldFilter('status', '==', 'pending')).stream()
-            task_count = sum(1 for _ in pending_tasks)
+            # Generate AI caption from video frame
+            try:
+                caption = caption_cache.get_or_generate(frame_image, caption_service.generate_caption)
+                print(f"✅ AI Caption generated from video frame: {caption}")
+                
+                # Add user location details if provided
+                if user_caption:
+                    caption = f"{caption} ({user_caption})"
+                    print(f"✅ Combined caption with location details: {caption}")
+                return caption, 'completed'
+            except Exception as caption_error:
+                print(f"⚠️ AI Caption generation failed: {caption_error}")
+                caption = user_caption if user_caption else "Video upload - maintenance required"
+        else:
+            print(f"⚠️ Could not extract frame from video")
+            caption = user_caption if user_caption else "Video upload - maintenance required"
             
-            staff_list.append({
-                'id': staff_id,
-                'taskCount': task_count,
-                'hasToken': 'fcmToken' in staff_data
-            })
+    except ImportError:
+        print(f"⚠️ OpenCV not installed, cannot extract video frame")
+        caption = user_caption if user_caption else "Video upload - maintenance required"
+    except Exception as video_error:
+        print(f"⚠️ Video frame extraction failed: {video_error}")
+        caption = user_caption if user_caption else "Video upload - maintenance required"
+    
+    return caption, 'fallback'
+
+
+def _caption_image_upload(filepath, unique_filename):
+    """Captions an uploaded image and saves the processed copy.
+
+    Returns (caption, captionStatus): 'completed', or 'fallback' when a default caption was used.
+    """
+    image = Image.open(filepath).convert("RGB")
+    
+    # Try to generate caption with error handling
+    try:
+        caption = caption_cache.get_or_generate(image, caption_service.generate_caption)
+        caption_status = 'completed'
+        print(f"✅ AI Caption generated: {caption}")
+    except Exception as caption_error:
+        print(f"⚠️ AI Caption generation failed: {caption_error}")
+        caption = "Garden maintenance required - AI processing unavailable"
+        caption_status = 'fallback'
+    
+    # Nothing is drawn on the processed copy, so it is the upload itself (hard link, no re-encode)
+    processed_path = os.path.join(app.config['PROCESSED_FOLDER'], unique_filename)
+    try:
+        media_store.link(filepath, processed_path)
+    except Exception as link_error:
+        print(f"⚠️ Could not link processed image ({link_error}), re-encoding")
+        # processed_path may already be a link to a shared blob: never write it in place
+        media_store.write_new(processed_path, image.save)
+    media_catalog.record('processed', processed_path)
+    
+    return caption, caption_status
+
+
+def process_caption_job(task_id, job):
+    """Caption worker handler: captions the upload, fills in the task and notifies the assigned staff."""
+    db = firestore.client()
+    try:
+        if job['is_video']:
+            caption, caption_status = _caption_video_upload(job['filepath'], job['unique_filename'], job['user_caption'])
+        else:
+            caption, caption_status = _caption_image_upload(job['filepath'], job['unique_filename'])
+    except Exception:
+        db.collection('tasks').document(task_id).update({'captionStatus': 'failed'})
+        raise
+    
+    db.collection('tasks').document(task_id).update({
+        'aiCaption': caption,
+        # 'fallback' means the model was unavailable or failed and a default caption was used
+        'captionStatus': caption_status,
+        'captionedAt': firestore.SERVER_TIMESTAMP
+    })
+    print(f"✅ Task {task_id} caption updated: {caption}")
+    
+    # Thumbnails/previews of the processed copy (still on this worker, off the request path)
+    derivatives.schedule('processed', os.path.join(app.config['PROCESSED_FOLDER'], job['unique_filename']))
+    
+    send_notification_to_assigned_staff(job['assigned_staff_id'], caption, job['location'], task_id)
+    return {'aiCaption': caption, 'captionStatus': caption_status}
+
+
+@app.route('/debug/captioning', methods=['GET'])
+def debug_captioning():
+    """Caption worker queue and BLIP micro-batching stats for load tuning."""
+    return jsonify({
+        'queue': caption_queue.get_queue_stats(),
+        'batching': caption_service.get_batch_stats(),
+        'cache': caption_cache.get_stats(),
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
+
+@app.route('/debug/derivatives', methods=['GET'])
+def debug_derivatives():
+    """Thumbnail/preview generation counters and queue depth."""
+    return jsonify({
+        'stats': derivatives.get_stats(),
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
+
+@app.route('/debug/media_store', methods=['GET'])
+def debug_media_store():
+    """Blob count, stored bytes and deduplication counters of the media store."""
+    return jsonify({
+        'stats': media_store.get_stats(),
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
+
+@app.route('/debug/media_catalog', methods=['GET'])
+def debug_media_catalog():
+    """File counts and bytes per media folder, as recorded in the media catalog."""
+    return jsonify({
+        'totals': media_catalog.totals(),
+        'database': media_catalog.MEDIA_CATALOG_DB,
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
+
+@app.route('/upload/status/<string:task_id>', methods=['GET'])
+def get_upload_status(task_id):
+    """Reports caption progress for an upload so clients can poll after /upload/image returns."""
+    try:
+        job = caption_queue.get_job_status(task_id)
+        if job:
+            job.setdefault('aiCaption', CAPTION_PENDING)
+            return jsonify(job), 200
         
-        if not staff_list:
-            return 'staff1'
+        # Job not tracked by this process (e.g. after a restart) - fall back to the task document
+        db = firestore.client()
+        task_doc = db.collection('tasks').document(task_id).get()
+        if not task_doc.exists:
+            return jsonify({'error': 'Task not found'}), 404
         
-        staff_list.sort(key=lambda x: (x['taskCount'], not x['hasToken']))
+        task_data = task_doc.to_dict()
+        return jsonify({
+            'taskId': task_id,
+            'status': task_data.get('captionStatus', 'completed'),
+            'aiCaption': task_data.get('aiCaption', '')
+        }), 200
         
-        assigned_staff = staff_list[0]['id']
-        print(f"📋 Assigning task to {assigned_staff} (current load: {staff_list[0]['taskCount']} tasks)")
-        return assigned_staff
+    except Exception as e:
+        print(f"Error getting upload status for {task_id}: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+def assign_task_to_staff(db):
+    """Assigns task to the least-loaded staff member (ties go to staff with an FCM token).
+    
+    Uses the in-memory load index from staff_load.py, so this is a heap pop rather than
+    a scan of every staff member's pending tasks. The caller must create the task as pending.
+    """
+    try:
+        assigned_staff = staff_load_index.assign(db)
+        return assigned_staff if assigned_staff else 'staff1'
         
     except Exception as e:
         print(f"⚠️ Error in task assignment: {e}. Defaulting to staff1")
@@ -518,13 +660,12 @@ def send_notification_to_assigned_staff(staff_id, caption, location, task_id):
     """Sends notification to the specific staff member assigned to the task."""
     db = firestore.client()
     try:
-        staff_doc = db.collection('staff').document(staff_id).get()
+        staff_data = profile_cache.get(db, 'staff', staff_id)
         
-        if not staff_doc.exists:
+        if staff_data is None:
             print(f"⚠️ Staff member {staff_id} not found in database")
             return
             
-        staff_data = staff_doc.to_dict()
         token = staff_data.get('fcmToken')
         
         if not token:
@@ -578,108 +719,43 @@ def send_notification_to_assigned_staff(staff_id, caption, location, task_id):
 
 @app.route('/uploads/<filename>')
 def serve_uploaded_file(filename):
-    """Serve uploaded files from the uploads directory with mobile compatibility."""
-    try:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        if not os.path.exists(file_path):
-            return jsonify({'error': 'File not found'}), 404
-        
-        response = make_response(send_from_directory(app.config['UPLOAD_FOLDER'], filename))
-        
-        # Set headers for mobile compatibility
-        response.headers['Content-Type'] = _get_content_type(filename)
-        response.headers['Cache-Control'] = 'public, max-age=3600'
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
-        
-        print(f"✅ Serving uploaded file: {filename} with content-type: {response.headers['Content-Type']}")
-        return response
-        
-    except Exception as e:
-        print(f"❌ Error serving uploaded file {filename}: {e}")
-        return jsonify({'error': str(e)}), 500
+    """Serve uploaded files (?size= for previews, Range for video seeking)."""
+    return media_serving.send_media('uploads', app.config['UPLOAD_FOLDER'], filename)
 
 @app.route('/processed/<filename>')
 def serve_processed_file(filename):
-    """Serve processed files from the processed directory with mobile compatibility."""
-    try:
-        file_path = os.path.join(app.config['PROCESSED_FOLDER'], filename)
-        
-        if not os.path.exists(file_path):
-            return jsonify({'error': 'File not found'}), 404
-        
-        response = make_response(send_from_directory(app.config['PROCESSED_FOLDER'], filename))
-        
-        # Set headers for mobile compatibility
-        response.headers['Content-Type'] = _get_content_type(filename)
-        response.headers['Cache-Control'] = 'public, max-age=3600'
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
-        
-        print(f"✅ Serving processed file: {filename} with content-type: {response.headers['Content-Type']}")
-        return response
-        
-    except Exception as e:
-        print(f"❌ Error serving processed file {filename}: {e}")
-        return jsonify({'error': str(e)}), 500
+    """Serve processed files (?size= for previews, Range for video seeking)."""
+    return media_serving.send_media('processed', app.config['PROCESSED_FOLDER'], filename)
 
 @app.route('/completed/<filename>')
 def serve_completed_file(filename):
-    """Serve completed files from the completed directory with mobile compatibility."""
-    try:
-        file_path = os.path.join(app.config['COMPLETED_FOLDER'], filename)
-        
-        if not os.path.exists(file_path):
-            return jsonify({'error': 'File not found'}), 404
-        
-        response = make_response(send_from_directory(app.config['COMPLETED_FOLDER'], filename))
-        
-        # Set headers for mobile compatibility
-        response.headers['Content-Type'] = _get_content_type(filename)
-        response.headers['Cache-Control'] = 'public, max-age=3600'
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
-        
-        print(f"✅ Serving completed file: {filename} with content-type: {response.headers['Content-Type']}")
-        return response
-        
-    except Exception as e:
-        print(f"❌ Error serving completed file {filename}: {e}")
-        return jsonify({'error': str(e)}), 500
-
-def _get_content_type(filename):
-    """Determine content type for image files."""
-    import mimetypes
-    content_type, _ = mimetypes.guess_type(filename)
-    
-    if content_type is None:
-        # Default content types for common image formats
-        if filename.lower().endswith(('.jpg', '.jpeg')):
-            content_type = 'image/jpeg'
-        elif filename.lower().endswith('.png'):
-            content_type = 'image/png'
-        elif filename.lower().endswith('.gif'):
-            content_type = 'image/gif'
-        elif filename.lower().endswith('.webp'):
-            content_type = 'image/webp'
-        else:
-            content_type = 'application/octet-stream'
-    
-    return content_type
+    """Serve completion photos/videos (?size= for previews, Range for video seeking)."""
+    return media_serving.send_media('completed', app.config['COMPLETED_FOLDER'], filename)
 
 @app.route('/health', methods=['GET'])
 def health_check():
+    """Liveness: answers as soon as the server is up. Model readiness is reported separately."""
     return jsonify({
         'status': 'healthy',
         'message': 'Garden App Server is running',
         'timestamp': datetime.now().isoformat(),
-        'server_url': SERVER_BASE_URL
+        'server_url': SERVER_BASE_URL,
+        'ready': caption_service.is_model_ready(),
+        'model': caption_service.get_model_status(),
+        'startupTimings': STARTUP_TIMINGS,
+        'captionQueue': caption_queue.get_queue_stats()
     }), 200
 
+@app.route('/health/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: 200 once the caption model is loaded, 503 while loading or after a failed load."""
+    model_status = caption_service.get_model_status()
+    return jsonify({
+        'ready': model_status['ready'],
+        'model': model_status,
+        'timestamp': datetime.now().isoformat()
+    }), 200 if model_status['ready'] else 503
+
 # ============================================================================
 # ADMIN PANEL ROUTES - Serve admin panel files
 # ============================================================================
@@ -738,6 +814,7 @@ def redirect_to_admin_panel():
 # ============================================================================
 
 @app.route('/staff/workload', methods=['GET'])
+@conditional('tasks', 'staff')
 def get_staff_workload():
     """Get workload for all staff members"""
     try:
@@ -748,11 +825,11 @@ def get_staff_workload():
         total_staff = 0
         active_staff = 0
         
-        # Get ALL tasks first to calculate totals
-        all_tasks_in_db = list(db.collection('tasks').stream())
-        total_tasks_count = len(all_tasks_in_db)
-        total_pending_count = len([t for t in all_tasks_in_db if t.to_dict().get('status') == 'pending'])
-        total_completed_count = len([t for t in all_tasks_in_db if t.to_dict().get('status') == 'completed'])
+        # Totals come from the materialized counters (one document read)
+        stats = task_stats.read_task_stats(db)
+        total_tasks_count = stats['total']
+        total_pending_count = stats['byStatus'].get('pending', 0)
+        total_completed_count = stats['byStatus'].get('completed', 0)
         
         for staff_doc in staff_docs:
             total_staff += 1
@@ -765,16 +842,14 @@ def get_staff_workload():
                 active_staff += 1
             
             # Count tasks for this staff member
-            staff_tasks = [t for t in all_tasks_in_db if t.to_dict().get('assignedTo') == staff_id]
-            pending_tasks = len([t for t in staff_tasks if t.to_dict().get('status') == 'pending'])
-            completed_tasks = len([t for t in staff_tasks if t.to_dict().get('status') == 'completed'])
+            counts = task_stats.staff_counts(stats, staff_id)
             
             workload.append({
                 'staffId': staff_id,
                 'name': staff_data.get('name', staff_id),
-                'totalTasks': len(staff_tasks),
-                'pendingTasks': pending_tasks,
-                'completedTasks': completed_tasks,
+                'totalTasks': counts['total'],
+                'pendingTasks': counts['pending'],
+                'completedTasks': counts['completed'],
                 'active': is_active,
                 'hasToken': bool(staff_data.get('fcmToken'))
             })
@@ -802,18 +877,25 @@ def get_staff_workload():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/queue/status', methods=['GET'])
+@conditional('tasks', refresh_seconds=60)
 def get_queue_status():
     """Get status of task queue"""
     try:
         db = firestore.client()
         
-        # Get tasks without assigned staff (queued)
-        all_tasks = list(db.collection('tasks').stream())
-        queued_tasks = [t for t in all_tasks if not t.to_dict().get('assignedTo') or t.to_dict().get('status') == 'queued']
+        # Get tasks without assigned staff (queued), from the in-memory replica when it is live
+        replica_unassigned = task_replica.unassigned()
+        replica_queued = task_replica.query(status='queued')
+        if replica_unassigned is not None and replica_queued is not None:
+            queued_tasks = dict(replica_unassigned)
+            queued_tasks.update(replica_queued)
+            queued_tasks = list(queued_tasks.items())
+        else:
+            all_tasks = db.collection('tasks').stream()
+            queued_tasks = [(t.id, t.to_dict()) for t in all_tasks if not t.to_dict().get('assignedTo') or t.to_dict().get('status') == 'queued']
         
         queue_data = []
-        for task_doc in queued_tasks:
-            task_data = task_doc.to_dict()
+        for task_id, task_data in queued_tasks:
             created_at = task_data.get('createdAt')
             
             # Calculate wait time
@@ -823,7 +905,7 @@ def get_queue_status():
                     wait_time = (datetime.now().timestamp() - created_at.timestamp()) / 60
             
             queue_data.append({
-                'taskId': task_doc.id,
+                'taskId': task_id,
                 'studentName': task_data.get('studentName', 'Unknown'),
                 'aiCaption': task_data.get('aiCaption', 'No caption'),
                 'location': task_data.get('location', 'Unknown'),
@@ -848,10 +930,21 @@ def get_queue_status():
 
 @app.route('/admin/all_tasks', methods=['GET'])
 def get_all_tasks_admin():
-    """Get all tasks for admin panel"""
+    """Get one page of tasks for admin panel (newest first).
+
+    Query params: limit, cursor (nextCursor of the previous page), fields (comma-separated projection),
+    status, search (case-insensitive match on caption, student, register number and location)
+    """
     try:
         db = firestore.client()
-        tasks_docs = db.collection('tasks').stream()
+        limit = parse_page_size(request.args.get('limit'))
+        fields = parse_fields(request.args.get('fields'), required=['createdAt'])
+        try:
+            status = request.args.get('status') if request.args.get('status') not in (None, '', 'all') else None
+            search = request.args.get('search', '').strip()
+            tasks_docs, next_cursor = fs_task_page(db, limit, request.args.get('cursor'), fields, status, search)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         tasks = []
         for doc in tasks_docs:
@@ -865,7 +958,18 @@ def get_all_tasks_admin():
             
             tasks.append(task_data)
         
-        return jsonify({'tasks': tasks, 'total': len(tasks)}), 200
+        # Total from the maintained counter document (None until it has been built, or when searching)
+        stats = task_stats.read_task_stats(db, rebuild_if_missing=False)
+        total = None
+        if stats and not search:
+            total = stats['byStatus'].get(status, 0) if status else stats['total']
+        
+        return jsonify({
+            'tasks': tasks,
+            'count': len(tasks),
+            'total': total,
+            'nextCursor': next_cursor
+        }), 200
         
     except Exception as e:
         print(f"Error getting all tasks: {e}")
@@ -901,40 +1005,20 @@ def get_recent_activity_admin():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/admin/all_students', methods=['GET'])
+@conditional('tasks')
 def get_all_students_admin():
     """Get all students for admin panel"""
     try:
         db = firestore.client()
         
-        # Get all tasks to find unique students
-        all_tasks = list(db.collection('tasks').stream())
-        
-        # Group tasks by student
-        students_map = {}
-        for task_doc in all_tasks:
-            task_data = task_doc.to_dict()
-            register_number = task_data.get('registerNumber')
-            student_name = task_data.get('studentName')
-            
-            if register_number:
-                if register_number not in students_map:
-                    students_map[register_number] = {
-                        'registerNumber': register_number,
-                        'name': student_name or 'Unknown',
-                        'totalReports': 0,
-                        'lastActive': None
-                    }
-                
-                students_map[register_number]['totalReports'] += 1
-                
-                # Update last active time
-                created_at = task_data.get('createdAt')
-                if created_at:
-                    if not students_map[register_number]['lastActive'] or created_at > students_map[register_number]['lastActive']:
-                        students_map[register_number]['lastActive'] = created_at
-        
-        # Convert to list
-        students = list(students_map.values())
+        # Per-student counters maintained alongside task writes
+        task_stats.read_task_stats(db)  # backfills student_stats on first use
+        students = [{
+            'registerNumber': s.get('registerNumber'),
+            'name': s.get('name') or 'Unknown',
+            'totalReports': s.get('totalReports', 0),
+            'lastActive': s.get('lastActive')
+        } for s in task_stats.read_student_stats(db)]
         
         # Format timestamps
         for student in students:
@@ -962,30 +1046,20 @@ def get_all_staff_admin():
         # Get all staff
         staff_docs = db.collection('staff').stream()
         staff_list = []
+        # Per-staff counts come from the materialized counters: one document read in total
+        stats = task_stats.read_task_stats(db)
         
         for staff_doc in staff_docs:
             staff_data = staff_doc.to_dict()
             staff_id = staff_doc.id
             
-            # Count tasks for this staff member
-            all_tasks = db.collection('tasks').where('assignedTo', '==', staff_id).stream()
-            tasks = list(all_tasks)
-            
-            pending_count = len([t for t in tasks if t.to_dict().get('status') == 'pending'])
-            completed_count = len([t for t in tasks if t.to_dict().get('status') == 'completed'])
-            total_count = len(tasks)
-            
             staff_info = {
                 'staffId': staff_id,
                 'name': staff_data.get('name', 'Unknown'),
                 'active': staff_data.get('active', True),
                 'createdAt': staff_data.get('createdAt').isoformat() if staff_data.get('createdAt') else None,
                 'lastLogin': staff_data.get('lastLogin').isoformat() if staff_data.get('lastLogin') else None,
-                'taskCounts': {
-                    'total': total_count,
-                    'pending': pending_count,
-                    'completed': completed_count
-                }
+                'taskCounts': task_stats.staff_counts(stats, staff_id)
             }
             
             staff_list.append(staff_info)
@@ -1006,11 +1080,10 @@ def get_staff_tasks_admin(staff_id):
         db = firestore.client()
         
         # Get staff info
-        staff_doc = db.collection('staff').document(staff_id).get()
-        if not staff_doc.exists:
+        staff_data = profile_cache.get(db, 'staff', staff_id)
+        if staff_data is None:
             return jsonify({'error': 'Staff member not found'}), 404
         
-        staff_data = staff_doc.to_dict()
         
         # Get filter parameter (default to 'pending')
         status_filter = request.args.get('status', 'pending')
@@ -1070,36 +1143,9 @@ def get_staff_tasks_admin(staff_id):
 
 @app.route('/admin/media_gallery', methods=['GET'])
 def get_media_gallery_admin():
-    """Get all media files"""
+    """One page of media files from the media catalog (see media_catalog.gallery for the parameters)"""
     try:
-        media_files = []
-        
-        folders = [
-            ('uploads', UPLOAD_FOLDER),
-            ('processed', PROCESSED_FOLDER),
-            ('completed', COMPLETED_FOLDER)
-        ]
-        
-        for folder_name, folder_path in folders:
-            if os.path.exists(folder_path):
-                for filename in os.listdir(folder_path):
-                    file_path = os.path.join(folder_path, filename)
-                    if os.path.isfile(file_path):
-                        file_size = os.path.getsize(file_path)
-                        file_ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-                        
-                        media_type = 'video' if file_ext in ['mp4', 'mov', 'avi', 'mkv'] else 'image'
-                        
-                        media_files.append({
-                            'filename': filename,
-                            'folder': folder_name,
-                            'url': f"{SERVER_BASE_URL}/{folder_name}/{filename}",
-                            'size': file_size,
-                            'type': media_type,
-                            'modified': datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat()
-                        })
-        
-        return jsonify({'media': media_files, 'total': len(media_files)}), 200
+        return jsonify(media_catalog.gallery(request.args, SERVER_BASE_URL)), 200
         
     except Exception as e:
         print(f"Error getting media gallery: {e}")
@@ -1110,11 +1156,11 @@ def get_analytics_admin():
     """Get analytics data"""
     try:
         db = firestore.client()
-        all_tasks = list(db.collection('tasks').stream())
+        stats = task_stats.read_task_stats(db)
         
-        total_tasks = len(all_tasks)
-        completed_tasks = len([t for t in all_tasks if t.to_dict().get('status') == 'completed'])
-        pending_tasks = len([t for t in all_tasks if t.to_dict().get('status') == 'pending'])
+        total_tasks = stats['total']
+        completed_tasks = stats['byStatus'].get('completed', 0)
+        pending_tasks = stats['byStatus'].get('pending', 0)
         
         completion_rate = (completed_tasks / total_tasks * 100) if total_tasks > 0 else 0
         
@@ -1123,7 +1169,7 @@ def get_analytics_admin():
             'completedTasks': completed_tasks,
             'pendingTasks': pending_tasks,
             'completionRate': round(completion_rate, 2),
-            'avgResponseTime': 0,
+            'avgResponseTime': round(task_stats.average_response_minutes(stats), 2),
             'activeUsers': 0
         }), 200
         
@@ -1131,6 +1177,22 @@ def get_analytics_admin():
         print(f"Error getting analytics: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/admin/stats/rebuild', methods=['POST'])
+def rebuild_task_stats():
+    """Recompute the materialized task counters from the tasks collection"""
+    try:
+        db = firestore.client()
+        stats = task_stats.rebuild(db)
+        return jsonify({
+            'success': True,
+            'total': stats['total'],
+            'byStatus': stats['byStatus'],
+            'staff': len(stats['byAssignee'])
+        }), 200
+    except Exception as e:
+        print(f"Error rebuilding task stats: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/admin/generate_report', methods=['GET'])
 def generate_report():
     """Generate PDF report"""
@@ -1146,16 +1208,16 @@ def generate_report():
         
         # Get analytics data
         db = firestore.client()
-        all_tasks = list(db.collection('tasks').stream())
+        stats = task_stats.read_task_stats(db)
         
-        total_tasks = len(all_tasks)
-        completed_tasks = len([t for t in all_tasks if t.to_dict().get('status') == 'completed'])
-        pending_tasks = len([t for t in all_tasks if t.to_dict().get('status') == 'pending'])
+        total_tasks = stats['total']
+        completed_tasks = stats['byStatus'].get('completed', 0)
+        pending_tasks = stats['byStatus'].get('pending', 0)
         completion_rate = (completed_tasks / total_tasks * 100) if total_tasks > 0 else 0
         
         # Get student and staff counts
-        students = list(db.collection('students').stream())
-        staff = list(db.collection('staff').stream())
+        total_students = fs_count(db.collection('students'))
+        total_staff = fs_count(db.collection('staff'))
         
         # Create PDF
         buffer = io.BytesIO()
@@ -1183,9 +1245,9 @@ def generate_report():
             f"Completed Tasks: {completed_tasks}",
             f"Pending Tasks: {pending_tasks}",
             f"Completion Rate: {round(completion_rate, 2)}%",
-            f"Total Students: {len(students)}",
-            f"Total Staff: {len(staff)}",
-            f"Active Users: {len(students) + len(staff)}"
+            f"Total Students: {total_students}",
+            f"Total Staff: {total_staff}",
+            f"Active Users: {total_students + total_staff}"
         ]
         
         for metric in metrics:
@@ -1199,10 +1261,7 @@ def generate_report():
         
         y_position -= 30
         p.setFont("Helvetica", 12)
-        status_counts = {}
-        for task in all_tasks:
-            status = task.to_dict().get('status', 'unknown')
-            status_counts[status] = status_counts.get(status, 0) + 1
+        status_counts = {s: n for s, n in stats['byStatus'].items() if n > 0}
         
         for status, count in status_counts.items():
             p.drawString(120, y_position, f"{status.title()}: {count}")
@@ -1240,13 +1299,12 @@ def create_staff():
         db = firestore.client()
         
         # Check if this ID is already registered as student
-        student_doc = db.collection('students').document(staff_id).get()
-        if student_doc.exists:
+        if profile_cache.exists(db, 'students', staff_id):
             return jsonify({'error': 'This ID is already registered as a student'}), 400
         
         # Check if staff already exists
         staff_ref = db.collection('staff').document(staff_id)
-        if staff_ref.get().exists:
+        if profile_cache.exists(db, 'staff', staff_id):
             return jsonify({'error': 'Staff member already exists'}), 400
         
         # Create staff with password
@@ -1256,6 +1314,8 @@ def create_staff():
             'active': True,
             'createdAt': firestore.SERVER_TIMESTAMP
         })
+        profile_cache.invalidate('staff', staff_id)
+        staff_load_index.staff_updated(staff_id, has_token=False)
         
         return jsonify({
             'message': 'Staff created successfully',
@@ -1277,10 +1337,11 @@ def activate_staff(staff_id):
         db = firestore.client()
         staff_ref = db.collection('staff').document(staff_id)
         
-        if not staff_ref.get().exists:
+        if not profile_cache.exists(db, 'staff', staff_id):
             return jsonify({'error': 'Staff not found'}), 404
         
         staff_ref.update({'active': active})
+        profile_cache.invalidate('staff', staff_id)
         
         return jsonify({'message': 'Staff status updated', 'active': active}), 200
         
@@ -1290,28 +1351,63 @@ def activate_staff(staff_id):
 
 @app.route('/queue/process', methods=['POST'])
 def process_queue():
-    """Process queued tasks and assign to staff"""
+    """Process queued tasks and assign to staff in one planned batch"""
     try:
         db = firestore.client()
+        started = time.perf_counter()
+        
+        # Get queued tasks (only the field needed to spot them)
+        all_tasks = db.collection('tasks').select(['assignedTo']).stream()
+        queued_ids = [t.id for t in all_tasks if not t.to_dict().get('assignedTo')]
+        read_ms = (time.perf_counter() - started) * 1000
+        
+        # Plan every assignment in memory against one read of staff load
+        plan = staff_load_index.plan(db, queued_ids)
+        plan_ms = (time.perf_counter() - started) * 1000 - read_ms
+        orphan_flags = {staff_id: orphan_tasks.assignment_fields(db, staff_id) for staff_id in set(plan.values())}
+        
+        # Commit in transactional chunks that re-read each task, so a task assigned or
+        # deleted since the scan is skipped and the counters see its current state;
+        # one slot per chunk is kept for the stats counter document
+        def add_assignment(transaction, item, task_data):
+            task_id, staff_id = item
+            if task_data is None:
+                return 'Task not found'
+            if task_data.get('assignedTo'):
+                return 'Task already assigned'
+            updates = dict({'assignedTo': staff_id, 'status': 'pending'}, **orphan_flags[staff_id])
+            transaction.update(db.collection('tasks').document(task_id), updates)
+        
+        def add_counters(transaction, written):
+            delta = task_stats.StatsDelta()
+            for (_, staff_id), task_data in written:
+                delta.add(task_data, {'assignedTo': staff_id, 'status': 'pending'})
+            delta.apply(transaction, db)
+        
+        result = bulk_writes.run_transactional(db, plan.items(), lambda item: db.collection('tasks').document(item[0]),
+                                               add_assignment, add_counters, reserved_writes=1)
+        staff_load_index.commit_plan([staff_id for (_, staff_id), _ in result['succeeded']])
+        
+        tasks_assigned = len(result['succeeded'])
+        per_staff = {}
+        for (_, staff_id), _ in result['succeeded']:
+            per_staff[staff_id] = per_staff.get(staff_id, 0) + 1
+        duration_ms = (time.perf_counter() - started) * 1000
+        print(f"📋 Queue processed: {tasks_assigned} tasks to {len(per_staff)} staff in {result['batches']} batches ({duration_ms:.0f} ms)")
         
-        # Get queued tasks
-        all_tasks = list(db.collection('tasks').stream())
-        queued_tasks = [t for t in all_tasks if not t.to_dict().get('assignedTo')]
-        
-        tasks_assigned = 0
-        
-        for task_doc in queued_tasks:
-            # Assign to staff using round-robin
-            assigned_staff = assign_task_to_staff(db)
-            
-            db.collection('tasks').document(task_doc.id).update({
-                'assignedTo': assigned_staff,
-                'status': 'pending'
-            })
-            
-            tasks_assigned += 1
-        
-        return jsonify({'message': f'Assigned {tasks_assigned} tasks', 'tasksAssigned': tasks_assigned}), 200
+        return jsonify({
+            'message': f'Assigned {tasks_assigned} tasks',
+            'tasksAssigned': tasks_assigned,
+            'unassignable': len(queued_ids) - len(plan),
+            'failedTasks': [{'taskId': task_id, 'reason': reason} for (task_id, _), reason in result['failed']],
+            'plan': per_staff,
+            'batches': result['batches'],
+            'timings': {
+                'readMs': round(read_ms, 1),
+                'planMs': round(plan_ms, 1),
+                'totalMs': round(duration_ms, 1)
+            }
+        }), 200
         
     except Exception as e:
         print(f"Error processing queue: {e}")
@@ -1323,17 +1419,35 @@ def clear_queue():
     try:
         db = firestore.client()
         
-        # Get queued tasks
-        all_tasks = list(db.collection('tasks').stream())
-        queued_tasks = [t for t in all_tasks if not t.to_dict().get('assignedTo')]
-        
-        tasks_cleared = 0
-        
-        for task_doc in queued_tasks:
-            db.collection('tasks').document(task_doc.id).delete()
-            tasks_cleared += 1
+        # Get queued task ids; each chunk re-reads its tasks in a transaction before deleting them
+        all_tasks = db.collection('tasks').select(['assignedTo']).stream()
+        queued_ids = [t.id for t in all_tasks if not t.to_dict().get('assignedTo')]
+        
+        def delete_queued(transaction, task_id, task_data):
+            if task_data is None:
+                return 'Task not found'
+            if task_data.get('assignedTo'):
+                return 'Task was assigned'
+            transaction.delete(db.collection('tasks').document(task_id))
+        
+        def add_counters(transaction, written):
+            delta = task_stats.StatsDelta()
+            for _, task_data in written:
+                delta.add(task_data, None)
+            delta.apply(transaction, db)
+        
+        # Each delete may also touch one student_stats document, plus one stats document per chunk
+        result = bulk_writes.run_transactional(
+            db, queued_ids, lambda task_id: db.collection('tasks').document(task_id),
+            delete_queued, add_counters, writes_per_item=2, reserved_writes=1
+        )
+        tasks_cleared = len(result['succeeded'])
         
-        return jsonify({'message': f'Cleared {tasks_cleared} tasks', 'tasksCleared': tasks_cleared}), 200
+        return jsonify({
+            'message': f'Cleared {tasks_cleared} tasks',
+            'tasksCleared': tasks_cleared,
+            'failedTasks': [{'taskId': task_id, 'reason': reason} for task_id, reason in result['failed']]
+        }), 200
         
     except Exception as e:
         print(f"Error clearing queue: {e}")
@@ -1356,30 +1470,25 @@ def reassign_task_admin():
         
         db = firestore.client()
         
-        # Verify task exists
-        task_ref = db.collection('tasks').document(task_id)
-        task_doc = task_ref.get()
-        
-        if not task_doc.exists:
-            return jsonify({'error': 'Task not found'}), 404
-        
-        task_data = task_doc.to_dict()
-        old_staff_id = task_data.get('assignedTo', 'unassigned')
-        
         # Verify new staff exists
-        staff_doc = db.collection('staff').document(new_staff_id).get()
-        if not staff_doc.exists:
+        staff_data = profile_cache.get(db, 'staff', new_staff_id)
+        if staff_data is None:
             return jsonify({'error': f'Staff member {new_staff_id} not found'}), 404
         
-        staff_data = staff_doc.to_dict()
-        
-        # Update task assignment
-        task_ref.update({
+        # Update task assignment and the per-staff counters in one transaction
+        orphan_flags = orphan_tasks.assignment_fields(db, new_staff_id)
+        task_data = task_stats.update_task(db, db.collection('tasks').document(task_id), lambda current: {
             'assignedTo': new_staff_id,
             'reassignedAt': firestore.SERVER_TIMESTAMP,
-            'reassignedFrom': old_staff_id,
-            'reassignedBy': 'admin'
+            'reassignedFrom': current.get('assignedTo', 'unassigned'),
+            'reassignedBy': 'admin',
+            **orphan_flags
         })
+        if task_data is None:
+            return jsonify({'error': 'Task not found'}), 404
+        old_staff_id = task_data.get('assignedTo', 'unassigned')
+        if task_data.get('status') == 'pending':
+            staff_load_index.task_reassigned(old_staff_id, new_staff_id)
         
         print(f"📋 Task {task_id} reassigned from {old_staff_id} to {new_staff_id} by admin")
         
@@ -1415,33 +1524,44 @@ def bulk_reassign_tasks_admin():
         db = firestore.client()
         
         # Verify staff exists
-        staff_doc = db.collection('staff').document(new_staff_id).get()
-        if not staff_doc.exists:
+        staff_data = profile_cache.get(db, 'staff', new_staff_id)
+        if staff_data is None:
             return jsonify({'error': f'Staff member {new_staff_id} not found'}), 404
         
-        staff_data = staff_doc.to_dict()
         
-        success_count = 0
-        failed_tasks = []
+        # One transactional get_all() per chunk of tasks instead of a get() per task
+        tasks_ref = db.collection('tasks')
+        orphan_flags = orphan_tasks.assignment_fields(db, new_staff_id)
         
-        for task_id in task_ids:
-            try:
-                task_ref = db.collection('tasks').document(task_id)
-                task_doc = task_ref.get()
-                
-                if task_doc.exists:
-                    old_staff = task_doc.to_dict().get('assignedTo', 'unassigned')
-                    task_ref.update({
-                        'assignedTo': new_staff_id,
-                        'reassignedAt': firestore.SERVER_TIMESTAMP,
-                        'reassignedFrom': old_staff,
-                        'reassignedBy': 'admin'
-                    })
-                    success_count += 1
-                else:
-                    failed_tasks.append({'taskId': task_id, 'reason': 'Task not found'})
-            except Exception as task_error:
-                failed_tasks.append({'taskId': task_id, 'reason': str(task_error)})
+        def add_reassignment(transaction, task_id, old_task_data):
+            if old_task_data is None:
+                return 'Task not found'
+            transaction.update(tasks_ref.document(task_id), {
+                'assignedTo': new_staff_id,
+                'reassignedAt': firestore.SERVER_TIMESTAMP,
+                'reassignedFrom': old_task_data.get('assignedTo', 'unassigned'),
+                'reassignedBy': 'admin',
+                **orphan_flags
+            })
+        
+        def add_counters(transaction, written):
+            delta = task_stats.StatsDelta()
+            for _, old_task_data in written:
+                delta.add(old_task_data, {'assignedTo': new_staff_id})
+            delta.apply(transaction, db)
+        
+        result = bulk_writes.run_transactional(db, dict.fromkeys(task_ids), tasks_ref.document,
+                                               add_reassignment, add_counters, reserved_writes=1)
+        failed_tasks = [{'taskId': task_id, 'reason': reason} for task_id, reason in result['failed']]
+        success_count = len(result['succeeded'])
+        
+        moved_pending = {}
+        for _, old_task_data in result['succeeded']:
+            if old_task_data.get('status') == 'pending':
+                old_staff = old_task_data.get('assignedTo', 'unassigned')
+                moved_pending[old_staff] = moved_pending.get(old_staff, 0) + 1
+        for old_staff, count in moved_pending.items():
+            staff_load_index.task_reassigned(old_staff, new_staff_id, count)
         
         print(f"📋 Bulk reassign: {success_count} tasks reassigned to {new_staff_id}")
         
@@ -1463,49 +1583,36 @@ def get_unassigned_tasks_admin():
     try:
         db = firestore.client()
         
-        # Get all tasks
-        all_tasks = list(db.collection('tasks').stream())
-        
-        # Get all valid staff IDs
-        staff_docs = list(db.collection('staff').stream())
-        valid_staff_ids = [doc.id for doc in staff_docs]
+        if orphan_tasks.ORPHAN_TRACKING == 'incremental':
+            # Flags are maintained by the staff listener: one indexed query
+            orphans = orphan_tasks.flagged_orphans(db)
+            valid_staff_ids = orphan_tasks.active_staff_ids(orphan_tasks.staff_active(db))
+        else:
+            # One pass over open tasks (from the in-memory replica when it is live)
+            orphans, valid_staff_ids = orphan_tasks.find_orphans(db, tasks=task_replica.query())
         
         unassigned_tasks = []
-        
-        for task_doc in all_tasks:
-            task_data = task_doc.to_dict()
+        for task_id, task_data, reason in orphans:
             assigned_to = task_data.get('assignedTo')
-            
-            # Task is unassigned if:
-            # 1. No assignedTo field
-            # 2. assignedTo is empty
-            # 3. assignedTo is a staff that doesn't exist
-            is_unassigned = (
-                not assigned_to or 
-                assigned_to == '' or 
-                assigned_to not in valid_staff_ids
-            )
-            
-            if is_unassigned and task_data.get('status') != 'completed':
-                created_at = task_data.get('createdAt')
-                unassigned_tasks.append({
-                    'taskId': task_doc.id,
-                    'studentName': task_data.get('studentName', 'Unknown'),
-                    'registerNumber': task_data.get('registerNumber', 'Unknown'),
-                    'aiCaption': task_data.get('aiCaption', ''),
-                    'studentCaption': task_data.get('studentCaption', ''),
-                    'location': task_data.get('location', 'Unknown'),
-                    'imageUrl': task_data.get('imageUrl', ''),
-                    'status': task_data.get('status', 'pending'),
-                    'assignedTo': assigned_to or 'unassigned',
-                    'createdAt': created_at.isoformat() if hasattr(created_at, 'isoformat') else str(created_at),
-                    'reason': 'No assignment' if not assigned_to else f'Staff {assigned_to} not found'
-                })
+            created_at = task_data.get('createdAt')
+            unassigned_tasks.append({
+                'taskId': task_id,
+                'studentName': task_data.get('studentName', 'Unknown'),
+                'registerNumber': task_data.get('registerNumber', 'Unknown'),
+                'aiCaption': task_data.get('aiCaption', ''),
+                'studentCaption': task_data.get('studentCaption', ''),
+                'location': task_data.get('location', 'Unknown'),
+                'imageUrl': task_data.get('imageUrl', ''),
+                'status': task_data.get('status', 'pending'),
+                'assignedTo': assigned_to or 'unassigned',
+                'createdAt': created_at.isoformat() if hasattr(created_at, 'isoformat') else str(created_at),
+                'reason': reason
+            })
         
         return jsonify({
             'unassignedTasks': unassigned_tasks,
             'total': len(unassigned_tasks),
-            'validStaffIds': valid_staff_ids
+            'validStaffIds': sorted(valid_staff_ids)
         }), 200
         
     except Exception as e:
@@ -1536,11 +1643,11 @@ def send_broadcast_notification_admin():
             tokens = [doc.to_dict().get('fcmToken') for doc in student_docs if doc.to_dict().get('fcmToken')]
         elif target == 'specific' and user_id:
             # Try both collections
-            user_doc = db.collection('students').document(user_id).get()
-            if not user_doc.exists:
-                user_doc = db.collection('staff').document(user_id).get()
-            if user_doc.exists:
-                token = user_doc.to_dict().get('fcmToken')
+            user_data = profile_cache.get(db, 'students', user_id)
+            if user_data is None:
+                user_data = profile_cache.get(db, 'staff', user_id)
+            if user_data is not None:
+                token = user_data.get('fcmToken')
                 if token:
                     tokens = [token]
         
@@ -1602,8 +1709,7 @@ def student_login():
         db = firestore.client()
         
         # Check if this ID is registered as staff
-        staff_doc = db.collection('staff').document(register_number).get()
-        if staff_doc.exists:
+        if profile_cache.exists(db, 'staff', register_number):
             return jsonify({
                 'error': 'This ID is registered as staff. Please login through the Staff Portal.',
                 'errorCode': 'CROSS_LOGIN_PREVENTED'
@@ -1611,11 +1717,10 @@ def student_login():
         
         # Check if student exists
         student_ref = db.collection('students').document(register_number)
-        student_doc = student_ref.get()
+        student_data = profile_cache.get(db, 'students', register_number)
         
-        if student_doc.exists:
+        if student_data is not None:
             # Existing student - update name if changed
-            student_data = student_doc.to_dict()
             if student_data.get('name') != name:
                 student_ref.update({
                     'name': name,
@@ -1625,6 +1730,7 @@ def student_login():
                 student_ref.update({
                     'lastLogin': firestore.SERVER_TIMESTAMP
                 })
+            profile_cache.invalidate('students', register_number)
             
             return jsonify({
                 'success': True,
@@ -1644,6 +1750,7 @@ def student_login():
                 'lastLogin': firestore.SERVER_TIMESTAMP,
                 'active': True
             })
+            profile_cache.invalidate('students', register_number)
             
             return jsonify({
                 'success': True,
@@ -1673,8 +1780,7 @@ def staff_login():
         db = firestore.client()
         
         # Check if this ID is registered as student
-        student_doc = db.collection('students').document(staff_id).get()
-        if student_doc.exists:
+        if profile_cache.exists(db, 'students', staff_id):
             return jsonify({
                 'error': 'This ID is registered as a student. Please login through the Student Portal.',
                 'errorCode': 'CROSS_LOGIN_PREVENTED'
@@ -1682,15 +1788,14 @@ def staff_login():
         
         # Check if staff exists (must be created by admin)
         staff_ref = db.collection('staff').document(staff_id)
-        staff_doc = staff_ref.get()
+        staff_data = profile_cache.get(db, 'staff', staff_id)
         
-        if not staff_doc.exists:
+        if staff_data is None:
             return jsonify({
                 'error': 'Staff account not found. Please contact admin to create your account.',
                 'errorCode': 'ACCOUNT_NOT_FOUND'
             }), 404
         
-        staff_data = staff_doc.to_dict()
         
         # Check if account is active
         if not staff_data.get('active', True):
@@ -1711,6 +1816,7 @@ def staff_login():
         staff_ref.update({
             'lastLogin': firestore.SERVER_TIMESTAMP
         })
+        profile_cache.invalidate('staff', staff_id)
         
         return jsonify({
             'success': True,
@@ -1757,6 +1863,9 @@ def update_fcm_token():
             'lastTokenUpdate': firestore.SERVER_TIMESTAMP,
             'tokenUpdatedAt': datetime.now().isoformat()
         }, merge=True)
+        profile_cache.invalidate(collection_name, user_id)
+        if user_type == 'staff':
+            staff_load_index.staff_updated(user_id, has_token=True)
         
         print(f"✅ FCM token updated for {user_type} {user_id}: {token[:20]}...")
         
@@ -1824,6 +1933,7 @@ def test_upload():
     }), 200
 
 @app.route('/history', methods=['GET'])
+@conditional('tasks')
 def get_history():
     """Get task history for a specific student with both original and completion images."""
     try:
@@ -1871,64 +1981,77 @@ def get_history():
 
 @app.route('/notifications', methods=['GET'])
 def get_notifications():
-    """Get notifications for students from staff."""
+    """Get notifications for students from staff (newest first).
+
+    Query params: register_number, type (comma-separated, default excludes thank-you notes),
+    unread_only, limit, cursor. The list is the response body; the cursor for the
+    next page is sent in the X-Next-Cursor header.
+    """
     try:
         register_number = request.args.get('register_number')
         if not register_number:
             return jsonify({'error': 'register_number parameter is required'}), 400
         
         db = firestore.client()
-        notifications = []
-        
         try:
-            notifications_ref = db.collection('notifications').document(register_number).collection('user_notifications')
-            notifications_docs = notifications_ref.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(50).stream()
-            
-            for doc in notifications_docs:
-                notification_data = doc.to_dict()
-                
-                # Filter out only old "Thank You" notifications, keep all others
-                title = notification_data.get('title', '')
-                message = notification_data.get('message', '')
-                notification_type = notification_data.get('type', '')
-                
-                # Skip only old "Thank You" notifications
-                if ('Thank You' in title and 
-                    'Thank you for helping us maintain' in message):
-                    continue
-                
-                # Include all other notifications (task_completed, test notifications, etc.)
-                if True:  # Keep all non-filtered notifications
-                    if 'timestamp' in notification_data and notification_data['timestamp']:
-                        try:
-                            timestamp = notification_data['timestamp']
-                            if hasattr(timestamp, 'isoformat'):
-                                notification_data['timestamp'] = timestamp.isoformat() + 'Z'
-                            else:
-                                notification_data['timestamp'] = datetime.now().isoformat() + 'Z'
-                        except:
-                            notification_data['timestamp'] = datetime.now().isoformat() + 'Z'
-                    
-                    # Debug: Log notification data being returned
-                    if notification_data.get('type') == 'task_completed':
-                        print(f'📤 DEBUG: Returning task_completed notification:')
-                        print(f'   - imageUrl: {notification_data.get("imageUrl")}')
-                        print(f'   - type: {notification_data.get("type")}')
-                        print(f'   - title: {notification_data.get("title")}')
-                    
-                    notifications.append(notification_data)
-        except Exception as db_error:
-            print(f"Database error: {db_error}")
-        
-        # Don't add sample notifications - let it be empty if no real notifications exist
-        # This prevents showing welcome messages that cause errors
-        
-        return jsonify(notifications), 200
+            types = student_notifications.parse_types(request.args.get('type'))
+            notifications, next_cursor = student_notifications.list_page(
+                db, register_number,
+                types=types,
+                unread_only=request.args.get('unread_only', 'false').lower() == 'true',
+                limit=parse_page_size(request.args.get('limit'), default=student_notifications.DEFAULT_LIMIT),
+                cursor=request.args.get('cursor')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        response = jsonify(notifications)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response, 200
         
     except Exception as e:
         print(f"Error fetching notifications: {e}")
         return jsonify({'error': f'Failed to fetch notifications: {str(e)}'}), 500
 
+@app.route('/notifications/unread_count', methods=['GET'])
+def get_unread_notification_count():
+    """Unread notification count for the app badge (one counter document read)."""
+    try:
+        register_number = request.args.get('register_number')
+        if not register_number:
+            return jsonify({'error': 'register_number parameter is required'}), 400
+        
+        db = firestore.client()
+        return jsonify({'unreadCount': student_notifications.unread_count(db, register_number)}), 200
+        
+    except Exception as e:
+        print(f"Error fetching unread notification count: {e}")
+        return jsonify({'error': f'Failed to fetch unread count: {str(e)}'}), 500
+
+@app.route('/notifications/mark_read', methods=['POST'])
+def mark_notifications_read():
+    """Marks notifications as read. Body: registerNumber, notificationIds (omit to mark all)."""
+    try:
+        data = request.get_json() or {}
+        register_number = data.get('registerNumber')
+        if not register_number:
+            return jsonify({'error': 'registerNumber is required'}), 400
+        notification_ids = data.get('notificationIds')
+        if notification_ids is not None and not isinstance(notification_ids, list):
+            return jsonify({'error': 'notificationIds must be a list'}), 400
+        
+        db = firestore.client()
+        marked = student_notifications.mark_read(db, register_number, notification_ids)
+        return jsonify({
+            'marked': marked,
+            'unreadCount': student_notifications.unread_count(db, register_number)
+        }), 200
+        
+    except Exception as e:
+        print(f"Error marking notifications read: {e}")
+        return jsonify({'error': f'Failed to mark notifications read: {str(e)}'}), 500
+
 @app.route('/complete_task', methods=['POST'])
 def complete_task():
     """Handles completion photo/video uploads from staff and updates task status."""
@@ -1940,34 +2063,28 @@ def complete_task():
     file = request.files['file']
     if file.filename == '': return jsonify({'error': 'No selected file'}), 400
 
-    if file and allowed_file(file.filename):
-        # Check if file is a video
-        is_video = is_video_file(file.filename)
-        
-        # Use appropriate extension
-        if is_video:
-            file_ext = file.filename.rsplit('.', 1)[1].lower()
-            unique_filename = f"completed_{uuid.uuid4()}.{file_ext}"
-        else:
-            unique_filename = f"completed_{uuid.uuid4()}.jpg"
-            
-        filepath = os.path.join(app.config['COMPLETED_FOLDER'], unique_filename)
-        file.save(filepath)
+    if file:
+        try:
+            upload = ingest.finish(file, app.config['COMPLETED_FOLDER'], name_prefix='completed_')
+        except ingest.IngestError as e:
+            return jsonify({'error': str(e)}), e.status
+        unique_filename = upload.filename
+        media_catalog.record('completed', upload.path)
+        derivatives.schedule('completed', upload.path)
         
         completed_image_url = f"{SERVER_BASE_URL}/completed/{unique_filename}"
 
         db = firestore.client()
         task_ref = db.collection('tasks').document(task_id)
-        task_doc = task_ref.get()
+        task_data = task_stats.update_task(db, task_ref, {
+            'status': 'completed',
+            'completedAt': firestore.SERVER_TIMESTAMP,
+            'completionImageUrl': completed_image_url
+        })
         
-        if task_doc.exists:
-            task_data = task_doc.to_dict()
-            
-            task_ref.update({
-                'status': 'completed',
-                'completedAt': firestore.SERVER_TIMESTAMP,
-                'completionImageUrl': completed_image_url
-            })
+        if task_data is not None:
+            if task_data.get('status') == 'pending':
+                staff_load_index.task_completed(task_data.get('assignedTo'))
             
             register_number = task_data.get('registerNumber')
             ai_caption = task_data.get('aiCaption', 'Task completed')
@@ -2008,18 +2125,17 @@ def mark_task_completed():
         
         db = firestore.client()
         task_ref = db.collection('tasks').document(task_id)
-        task_doc = task_ref.get()
-        
-        if not task_doc.exists:
-            return jsonify({'error': 'Task not found'}), 404
-        
-        task_data = task_doc.to_dict()
-        
-        task_ref.update({
+        task_data = task_stats.update_task(db, task_ref, {
             'status': 'completed',
             'completedAt': firestore.SERVER_TIMESTAMP
         })
         
+        if task_data is None:
+            return jsonify({'error': 'Task not found'}), 404
+        
+        if task_data.get('status') == 'pending':
+            staff_load_index.task_completed(task_data.get('assignedTo'))
+        
         register_number = task_data.get('registerNumber')
         ai_caption = task_data.get('aiCaption', 'Your reported issue has been resolved')
         
@@ -2046,6 +2162,7 @@ def mark_task_completed():
         return jsonify({'error': f'Failed to mark task completed: {str(e)}'}), 500
 
 @app.route('/staff/tasks/<string:staff_id>', methods=['GET'])
+@conditional('tasks')
 def get_staff_tasks(staff_id):
     """Get all tasks assigned to a specific staff member with both original and completion images."""
     try:
@@ -2055,32 +2172,24 @@ def get_staff_tasks(staff_id):
         status_filter = request.args.get('status')  # 'pending', 'completed', or None for all
         limit = request.args.get('limit', 50)
         
-        # First, get ALL tasks for accurate statistics calculation
-        all_tasks_query = fs_filter(db.collection('tasks'), 'assignedTo', '==', staff_id)
-        all_tasks_docs = list(all_tasks_query.stream())
-        
-        # Calculate accurate statistics from ALL tasks
-        total_tasks = len(all_tasks_docs)
-        completed_tasks = len([doc for doc in all_tasks_docs if doc.to_dict().get('status') == 'completed'])
-        pending_tasks = len([doc for doc in all_tasks_docs if doc.to_dict().get('status') == 'pending'])
+        # Accurate statistics over ALL tasks from the maintained counters (one document read)
+        counts = task_stats.staff_counts(task_stats.read_task_stats(db), staff_id)
+        total_tasks = counts['total']
+        completed_tasks = counts['completed']
+        pending_tasks = counts['pending']
         
         print(f"📊 Staff {staff_id} statistics: Total={total_tasks}, Completed={completed_tasks}, Pending={pending_tasks}")
         
-        # Build the limited query for task details (avoid composite index requirement)
-        # Get all tasks first, then sort and limit in Python to avoid Firestore index issues
+        # Newest tasks first, sorted and limited by Firestore (composite index on
+        # assignedTo[+status]+createdAt; falls back to a Python sort if it is missing)
         tasks_query = fs_filter(db.collection('tasks'), 'assignedTo', '==', staff_id)
+        index_name = 'tasks: assignedTo+createdAt'
         
         if status_filter:
             tasks_query = fs_filter(tasks_query, 'status', '==', status_filter)
+            index_name = 'tasks: assignedTo+status+createdAt'
         
-        # Get all matching tasks and sort in Python to avoid index requirement
-        all_matching_tasks = list(tasks_query.stream())
-        
-        # Sort by createdAt in Python (most recent first)
-        all_matching_tasks.sort(key=lambda doc: doc.to_dict().get('createdAt', datetime.min), reverse=True)
-        
-        # Apply limit in Python
-        tasks_docs = all_matching_tasks[:int(limit)]
+        tasks_docs = fs_top(tasks_query, 'createdAt', int(limit), index_name)
         
         tasks = []
         for doc in tasks_docs:
@@ -2215,6 +2324,7 @@ def update_location():
         }
 
         db.collection(collection).document(user_id).set({'location': location_data}, merge=True)
+        profile_cache.invalidate(collection, user_id)
         
         print(f"✅ Location updated for {user_type} {user_id}: {address}")
         return jsonify({'message': 'Location updated successfully', 'address': address}), 200
@@ -2273,12 +2383,11 @@ def test_student_notification():
         # Instead, send a direct FCM notification without completion image
         db = firestore.client()
         try:
-            student_ref = db.collection('students').document(student_id)
-            student_doc = student_ref.get()
-            if not student_doc.exists:
+            student_data = profile_cache.get(db, 'students', student_id)
+            if student_data is None:
                 return jsonify({'error': f'Student document for ID {student_id} not found'}), 404
 
-            token = student_doc.to_dict().get('fcmToken')
+            token = student_data.get('fcmToken')
             if not token:
                 return jsonify({'error': f'FCM token not found for student {student_id}'}), 400
 
@@ -2331,7 +2440,7 @@ def test_student_notification():
                 'read': False,
                 'sender': 'System Test'
             }
-            db.collection('notifications').document(student_id).collection('user_notifications').add(notification_data)
+            student_notifications.add(db, student_id, notification_data)
             
         except Exception as e:
             print(f'❌ Error sending test notification: {e}')
@@ -2432,11 +2541,10 @@ def complete_refresh_request():
             .where('status', '==', 'pending')\
             .stream()
         
-        for request_doc in refresh_requests:
-            request_doc.reference.update({
-                'status': 'completed',
-                'completedAt': firestore.SERVER_TIMESTAMP
-            })
+        bulk_writes.run_batched(db, [doc.reference for doc in refresh_requests], lambda batch, ref: batch.update(ref, {
+            'status': 'completed',
+            'completedAt': firestore.SERVER_TIMESTAMP
+        }))
         
         print(f"✅ Token refresh requests marked as completed for student {student_id}")
         
@@ -2518,12 +2626,14 @@ def debug_staff_stats(staff_id):
     try:
         db = firestore.client()
         
-        # Get all tasks for this staff member
+        # Counts come from aggregations; only a small sample of documents is read
         tasks_query = fs_filter(db.collection('tasks'), 'assignedTo', '==', staff_id)
-        tasks_docs = list(tasks_query.stream())
+        total_tasks = fs_count(tasks_query)
+        completed_tasks = fs_count(fs_filter(tasks_query, 'status', '==', 'completed'))
+        pending_tasks = fs_count(fs_filter(tasks_query, 'status', '==', 'pending'))
         
         tasks_data = []
-        for doc in tasks_docs:
+        for doc in tasks_query.limit(5).stream():
             task_data = doc.to_dict()
             tasks_data.append({
                 'taskId': doc.id,
@@ -2533,17 +2643,12 @@ def debug_staff_stats(staff_id):
                 'assignedTo': task_data.get('assignedTo', 'Unknown')
             })
         
-        # Calculate stats
-        total_tasks = len(tasks_data)
-        completed_tasks = len([t for t in tasks_data if t['status'] == 'completed'])
-        pending_tasks = len([t for t in tasks_data if t['status'] == 'pending'])
-        
         return jsonify({
             'staff_id': staff_id,
             'total_tasks': total_tasks,
             'completed_tasks': completed_tasks,
             'pending_tasks': pending_tasks,
-            'tasks_sample': tasks_data[:5],  # Show first 5 tasks as sample
+            'tasks_sample': tasks_data,  # Show first 5 tasks as sample
             'debug_info': {
                 'collection_exists': True,
                 'query_successful': True,
@@ -2563,6 +2668,45 @@ def debug_staff_stats(staff_id):
             }
         }), 500
 
+@app.route('/debug/staff_load', methods=['GET'])
+def debug_staff_load():
+    """Debug endpoint showing the in-memory pending-task load index used for assignment."""
+    try:
+        staff_load_index.ensure_loaded(firestore.client())
+        return jsonify({
+            'loads': [{'staffId': sid, 'pendingTasks': n, 'hasToken': t} for sid, n, t in staff_load_index.peek_loads()],
+            'stats': staff_load_index.get_stats(),
+            'timestamp': datetime.now().isoformat()
+        }), 200
+    except Exception as e:
+        print(f"❌ Error in debug staff load: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/debug/task_replica', methods=['GET'])
+def debug_task_replica():
+    """Debug endpoint showing state, size and lag of the in-memory tasks replica."""
+    return jsonify({
+        'enabled': TASK_REPLICA_ENABLED,
+        'stats': task_replica.get_stats(),
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
+@app.route('/debug/conditional', methods=['GET'])
+def debug_conditional():
+    """Debug endpoint showing how many polls were answered with 304 Not Modified."""
+    return jsonify({
+        'stats': conditional_stats(),
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
+@app.route('/debug/profile_cache', methods=['GET'])
+def debug_profile_cache():
+    """Debug endpoint showing per-collection hit rates of the staff/student profile cache."""
+    return jsonify({
+        'stats': profile_cache.get_stats(),
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
 @app.route('/send_thank_you_notification', methods=['POST'])
 def send_thank_you_notification():
     """Sends a thank you notification to a student when staff completes their task."""
@@ -2577,11 +2721,10 @@ def send_thank_you_notification():
 
         db = firestore.client()
         
-        student_doc = db.collection('students').document(student_id).get()
-        if not student_doc.exists:
+        student_data = profile_cache.get(db, 'students', student_id)
+        if student_data is None:
             return jsonify({'error': 'Student not found'}), 404
             
-        student_data = student_doc.to_dict()
         fcm_token = student_data.get('fcmToken')
         
         if not fcm_token:
@@ -2603,8 +2746,7 @@ def send_thank_you_notification():
         
         response = messaging.send(message)
         
-        notification_ref = db.collection('notifications').document(student_id).collection('user_notifications')
-        notification_ref.add({
+        student_notifications.add(db, student_id, {
             'title': 'Thank You for Your Report!',
             'message': f'Thank you for helping us maintain our garden. Your report has been addressed by {staff_name}.',
             'type': 'thank_you',
@@ -2626,8 +2768,8 @@ def get_completed_tasks_count(staff_id):
     try:
         db = firestore.client()
         # Query Firestore for tasks assigned to the staff_id and marked as completed
-        completed_tasks_ref = fs_filter(db.collection('tasks'), 'assignedTo', '==', staff_id).filter(FieldFilter('status', '==', 'completed')).stream()
-        completed_tasks_count = len(list(completed_tasks_ref))
+        completed_tasks_query = fs_filter(fs_filter(db.collection('tasks'), 'assignedTo', '==', staff_id), 'status', '==', 'completed')
+        completed_tasks_count = fs_count(completed_tasks_query)
         return jsonify({'completed_tasks_count': completed_tasks_count}), 200
     except Exception as e:
         print(f"Error fetching completed tasks count for staff {staff_id}: {e}")
@@ -2637,9 +2779,9 @@ def get_completed_tasks_count(staff_id):
 def get_student_details(student_id):
     try:
         db = firestore.client()
-        student_ref = db.collection('students').document(student_id).get()
-        if student_ref.exists:
-            return jsonify(student_ref.to_dict()), 200
+        student_data = profile_cache.get(db, 'students', student_id)
+        if student_data is not None:
+            return jsonify(student_data), 200
         else:
             return jsonify({'error': 'Student not found'}), 404
     except Exception as e:
@@ -2650,9 +2792,9 @@ def get_student_details(student_id):
 def get_staff_details(staff_id):
     try:
         db = firestore.client()
-        staff_ref = db.collection('staff').document(staff_id).get()
-        if staff_ref.exists:
-            return jsonify(staff_ref.to_dict()), 200
+        staff_data = profile_cache.get(db, 'staff', staff_id)
+        if staff_data is not None:
+            return jsonify(staff_data), 200
         else:
             return jsonify({'error': 'Staff not found'}), 404
     except Exception as e:
@@ -2662,6 +2804,46 @@ def get_staff_details(staff_id):
 # Note: File serving routes are already defined above with proper headers and error handling
 # Removed duplicate route definitions to prevent conflicts
 
+def _log_model_startup(ok):
+    """Logs the startup-time breakdown once the background model load finishes."""
+    STARTUP_TIMINGS.update(caption_service.get_model_status().get('timings', {}))
+    phases = ', '.join(f"{phase} {seconds}s" for phase, seconds in STARTUP_TIMINGS.items())
+    print(f"⏱️ Startup phases ({'model ready' if ok else 'model unavailable'}): {phases}")
+
+def _is_serving_process():
+    """False in the Werkzeug reloader's parent process, which never serves requests."""
+    return __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+
+# --- Start caption workers and the background model load (after all handlers are defined) ---
+if _is_serving_process():
+    try:
+        # Counter increments are skipped until the counters are seeded (task_stats.py)
+        task_stats.ensure_seeded(firestore.client())
+    except Exception as e:
+        print(f"⚠️ Task stats not seeded at startup, retried on first stats read: {e}")
+    caption_queue.start_workers(process_caption_job)
+    caption_service.start_background_load(on_loaded=_log_model_startup)
+    derivatives.start_worker()
+    media_catalog.start_reconcile({'uploads': UPLOAD_FOLDER, 'processed': PROCESSED_FOLDER, 'completed': COMPLETED_FOLDER})
+    stale_parts = ingest.remove_stale_parts()
+    if stale_parts:
+        print(f"🧹 Removed {stale_parts} unfinished uploads from {ingest.INCOMING_DIR}")
+    if TASK_REPLICA_ENABLED:
+        try:
+            task_replica.start(firestore.client())
+        except Exception as e:
+            print(f"⚠️ Task replica not started, admin reads go to Firestore: {e}")
+    if orphan_tasks.ORPHAN_TRACKING == 'incremental':
+        try:
+            orphan_tasks.staff_orphan_watcher.start(firestore.client())
+        except Exception as e:
+            print(f"⚠️ Orphan tracking listener not started: {e}")
+    if PROFILE_CACHE_LISTENERS:
+        try:
+            profile_cache.start_listeners(firestore.client())
+        except Exception as e:
+            print(f"⚠️ Profile cache listeners not started, relying on TTL: {e}")
+
 if __name__ == '__main__':
     import subprocess
     import sys
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Database backup and restore
+
+Each collection is streamed to gzip-compressed NDJSON chunk files
+(one document per line) and a manifest.json records document counts and
+sha256 checksums. Every backup also lists the ids present when it ran
+(<collection>.ids.gz), so an incremental backup, which only stores documents
+whose update_time is newer than the previous backup, can record the ids
+deleted since then. Restore replays a backup (and, for an incremental one, the
+chain of backups it builds on) with batched writes and applies those
+deletions. The materialized task counters (task_stats.py) are not backed
+up; they are rebuilt from the restored tasks.
+
+Usage:
+    python backup.py backup [--incremental] [--collections tasks,students,staff]
+    python backup.py restore <backup_id> [--verify-only] [--collections ...]
+    python backup.py list
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime, timezone
+
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+BACKUP_COLLECTIONS = ['tasks', 'students', 'staff']
+DOCS_PER_CHUNK = int(os.environ.get('BACKUP_DOCS_PER_CHUNK', 10000))
+FIRESTORE_BATCH_LIMIT = 500
+MANIFEST_NAME = 'manifest.json'
+
+
+# ============================================================================
+# VALUE ENCODING (Firestore types <-> JSON)
+# ============================================================================
+
+def encode_value(value):
+    if isinstance(value, dict):
+        return {k: encode_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(v) for v in value]
+    if isinstance(value, datetime):
+        return {'__type': 'timestamp', 'value': value.isoformat()}
+    if isinstance(value, bytes):
+        return {'__type': 'bytes', 'value': base64.b64encode(value).decode()}
+    if hasattr(value, 'latitude') and hasattr(value, 'longitude'):
+        return {'__type': 'geopoint', 'latitude': value.latitude, 'longitude': value.longitude}
+    if hasattr(value, 'path') and hasattr(value, 'collection'):
+        return {'__type': 'reference', 'path': value.path}
+    return value
+
+
+def decode_value(value, db):
+    if isinstance(value, list):
+        return [decode_value(v, db) for v in value]
+    if not isinstance(value, dict):
+        return value
+    kind = value.get('__type')
+    if kind == 'timestamp':
+        return datetime.fromisoformat(value['value'])
+    if kind == 'bytes':
+        return base64.b64decode(value['value'])
+    if kind == 'geopoint':
+        from google.cloud.firestore import GeoPoint
+        return GeoPoint(value['latitude'], value['longitude'])
+    if kind == 'reference':
+        return db.document(value['path'])
+    return {k: decode_value(v, db) for k, v in value.items()}
+
+
+# ============================================================================
+# BACKUP
+# ============================================================================
+
+class _HashingWriter:
+    """File wrapper that hashes and counts the (compressed) bytes written through it."""
+
+    def __init__(self, f):
+        self._f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self._f.write(data)
+
+    def flush(self):
+        self._f.flush()
+
+
+class _ChunkWriter:
+    """Writes NDJSON lines into numbered .ndjson.gz files of DOCS_PER_CHUNK documents."""
+
+    def __init__(self, directory, collection, docs_per_chunk=None):
+        self.directory = directory
+        self.collection = collection
+        self.docs_per_chunk = docs_per_chunk or DOCS_PER_CHUNK
+        self.files = []
+        self._raw = self._hasher = self._gzip = None
+        self._count = 0
+
+    def _open(self):
+        name = f"{self.collection}-{len(self.files):05d}.ndjson.gz"
+        self._raw = open(os.path.join(self.directory, name), 'wb')
+        self._hasher = _HashingWriter(self._raw)
+        self._gzip = gzip.GzipFile(fileobj=self._hasher, mode='wb', mtime=0)
+        self.files.append({'name': name, 'documents': 0})
+        self._count = 0
+
+    def _close(self):
+        if self._gzip is None:
+            return
+        self._gzip.close()
+        self._raw.close()
+        self.files[-1].update(bytes=self._hasher.size, sha256=self._hasher.sha256.hexdigest())
+        self._raw = self._hasher = self._gzip = None
+
+    def write(self, doc_id, data):
+        if self._gzip is None or self._count >= self.docs_per_chunk:
+            self._close()
+            self._open()
+        line = json.dumps({'id': doc_id, 'data': encode_value(data)}, separators=(',', ':'), default=str)
+        self._gzip.write(line.encode('utf-8') + b'\n')
+        self._count += 1
+        self.files[-1]['documents'] += 1
+
+    def close(self):
+        self._close()
+        return self.files
+
+
+def _write_ids(directory, collection, ids):
+    """Writes the ids present at backup time (one per line, gzip) and returns their manifest entry."""
+    name = f"{collection}.ids.gz"
+    with open(os.path.join(directory, name), 'wb') as raw:
+        hasher = _HashingWriter(raw)
+        with gzip.GzipFile(fileobj=hasher, mode='wb', mtime=0) as f:
+            for doc_id in ids:
+                f.write(doc_id.encode('utf-8') + b'\n')
+    return {'name': name, 'count': len(ids), 'bytes': hasher.size, 'sha256': hasher.sha256.hexdigest()}
+
+
+def _read_ids(manifest, collection, backup_dir):
+    """Ids a backup saw in `collection`, or None for backups made before ids were recorded."""
+    info = manifest['collections'].get(collection, {}).get('ids')
+    if not info:
+        return None
+    with gzip.open(os.path.join(backup_dir, manifest['id'], info['name']), 'rt', encoding='utf-8') as f:
+        return {line.rstrip('\n') for line in f if line.strip()}
+
+
+def _changed_documents(db, collection, since, present_ids):
+    """Streams only documents updated after `since`: ids/update_time first, then get_all for the changed ones.
+
+    Every id in the collection is appended to present_ids.
+    """
+    changed = []
+    for doc in db.collection(collection).select([]).stream():
+        present_ids.append(doc.id)
+        if doc.update_time is not None and doc.update_time > since:
+            changed.append(doc.reference)
+    for i in range(0, len(changed), FIRESTORE_BATCH_LIMIT):
+        for doc in db.get_all(changed[i:i + FIRESTORE_BATCH_LIMIT]):
+            if doc.exists:
+                yield doc
+
+
+def list_backups(backup_dir=BACKUP_DIR):
+    """Manifests of all completed backups, oldest first."""
+    manifests = []
+    if not os.path.isdir(backup_dir):
+        return manifests
+    for name in sorted(os.listdir(backup_dir)):
+        path = os.path.join(backup_dir, name, MANIFEST_NAME)
+        if os.path.isfile(path):
+            with open(path) as f:
+                manifests.append(json.load(f))
+    return manifests
+
+
+def _covering_base(collections, backup_dir=BACKUP_DIR):
+    """Latest backup whose whole chain covers every one of `collections`, or None."""
+    for manifest in reversed(list_backups(backup_dir)):
+        if not all(c in manifest['collections'] for c in collections):
+            continue
+        try:
+            chain = backup_chain(manifest['id'], backup_dir)
+        except FileNotFoundError:
+            continue
+        if all(c in m['collections'] for m in chain for c in collections):
+            return manifest
+    return None
+
+
+def create_backup(db, incremental=False, collections=None, backup_dir=BACKUP_DIR):
+    """Writes a full or incremental backup and returns its manifest.
+
+    An incremental builds on the latest backup that covered all requested collections;
+    without one, a full backup is taken instead.
+    """
+    collections = collections or BACKUP_COLLECTIONS
+    base = None
+    if incremental:
+        base = _covering_base(collections, backup_dir)
+        if base is None:
+            print(f"⚠️ No previous backup covers {', '.join(collections)}, taking a full backup instead")
+            incremental = False
+
+    started_at = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    backup_id = f"backup_{started_at.strftime('%Y%m%d_%H%M%S')}" + ('_incr' if incremental else '')
+    final_dir = os.path.join(backup_dir, backup_id)
+    work_dir = final_dir + '.partial'
+    os.makedirs(work_dir, exist_ok=True)
+
+    manifest = {
+        'id': backup_id,
+        'type': 'incremental' if incremental else 'full',
+        'base': base['id'] if base else None,
+        'since': base['startedAt'] if base else None,
+        'startedAt': started_at.isoformat(),
+        'collections': {}
+    }
+    since = datetime.fromisoformat(base['startedAt']) if base else None
+
+    total_docs = total_bytes = 0
+    for collection in collections:
+        writer = _ChunkWriter(work_dir, collection)
+        present_ids = []
+        if incremental:
+            docs = _changed_documents(db, collection, since, present_ids)
+        else:
+            docs = db.collection(collection).stream()
+        count = 0
+        for doc in docs:
+            writer.write(doc.id, doc.to_dict())
+            if not incremental:
+                present_ids.append(doc.id)
+            count += 1
+        files = writer.close()
+        ids = _write_ids(work_dir, collection, present_ids)
+        size = sum(f['bytes'] for f in files) + ids['bytes']
+        manifest['collections'][collection] = {'documents': count, 'bytes': size, 'files': files, 'ids': ids}
+        if incremental:
+            base_ids = _read_ids(base, collection, backup_dir)
+            if base_ids is None:
+                print(f"⚠️ {base['id']} has no id list for {collection}; deletions since then are not recorded")
+            else:
+                # Tombstones: replaying the chain must not bring these back
+                manifest['collections'][collection]['deleted'] = sorted(base_ids.difference(present_ids))
+        total_docs += count
+        total_bytes += size
+        print(f"💾 {collection}: {count} documents, {size / 1024:.1f} KB")
+
+    elapsed = time.perf_counter() - started
+    manifest.update(
+        finishedAt=datetime.now(timezone.utc).isoformat(),
+        documents=total_docs,
+        bytes=total_bytes,
+        durationSeconds=round(elapsed, 2),
+        docsPerSecond=round(total_docs / elapsed, 1) if elapsed else None
+    )
+    with open(os.path.join(work_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    # Only completed backups get their final name (and count as a base for incrementals)
+    os.rename(work_dir, final_dir)
+    print(f"✅ Backup {backup_id}: {total_docs} documents, {total_bytes / 1024 / 1024:.2f} MB "
+          f"in {elapsed:.1f}s ({manifest['docsPerSecond']} docs/s)")
+    return manifest
+
+
+# ============================================================================
+# RESTORE
+# ============================================================================
+
+def _load_manifest(backup_id, backup_dir):
+    path = os.path.join(backup_dir, backup_id, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"No backup '{backup_id}' in {backup_dir}")
+    with open(path) as f:
+        return json.load(f)
+
+
+def backup_chain(backup_id, backup_dir=BACKUP_DIR):
+    """Manifests to replay for backup_id: the full backup it builds on, then each incremental."""
+    chain = [_load_manifest(backup_id, backup_dir)]
+    while chain[0].get('base'):
+        chain.insert(0, _load_manifest(chain[0]['base'], backup_dir))
+    return chain
+
+
+def verify_backup(manifest, backup_dir=BACKUP_DIR):
+    """Checks every chunk's sha256 against the manifest; returns a list of problems."""
+    problems = []
+    for collection, info in manifest['collections'].items():
+        for chunk in info['files'] + ([info['ids']] if info.get('ids') else []):
+            path = os.path.join(backup_dir, manifest['id'], chunk['name'])
+            if not os.path.isfile(path):
+                problems.append(f"{chunk['name']}: missing")
+                continue
+            sha256 = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    sha256.update(block)
+            if sha256.hexdigest() != chunk['sha256']:
+                problems.append(f"{chunk['name']}: checksum mismatch")
+    return problems
+
+
+def _read_chunk(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def restore_backup(db, backup_id, collections=None, verify_only=False, backup_dir=BACKUP_DIR):
+    """Verifies and replays a backup chain with batched writes; returns a summary."""
+    chain = backup_chain(backup_id, backup_dir)
+    for manifest in chain:
+        problems = verify_backup(manifest, backup_dir)
+        if problems:
+            raise ValueError(f"Backup {manifest['id']} failed verification: {'; '.join(problems)}")
+    print(f"✅ Verified {len(chain)} backup(s): {', '.join(m['id'] for m in chain)}")
+    if verify_only:
+        return {'verified': [m['id'] for m in chain], 'documents': 0}
+
+    started = time.perf_counter()
+    restored = deleted = 0
+    for manifest in chain:
+        for collection, info in manifest['collections'].items():
+            if collections and collection not in collections:
+                continue
+            batch, pending = db.batch(), 0
+            for chunk in info['files']:
+                for record in _read_chunk(os.path.join(backup_dir, manifest['id'], chunk['name'])):
+                    batch.set(db.collection(collection).document(record['id']), decode_value(record['data'], db))
+                    pending += 1
+                    if pending == FIRESTORE_BATCH_LIMIT:
+                        batch.commit()
+                        restored += pending
+                        batch, pending = db.batch(), 0
+            if pending:
+                batch.commit()
+                restored += pending
+            tombstones = info.get('deleted') or []
+            for i in range(0, len(tombstones), FIRESTORE_BATCH_LIMIT):
+                batch = db.batch()
+                for doc_id in tombstones[i:i + FIRESTORE_BATCH_LIMIT]:
+                    batch.delete(db.collection(collection).document(doc_id))
+                batch.commit()
+            deleted += len(tombstones)
+            print(f"♻️ {manifest['id']}/{collection}: restored" + (f", {len(tombstones)} deleted" if tombstones else ''))
+
+    if not collections or 'tasks' in collections:
+        # stats/ and student_stats/ describe the tasks that were just overwritten
+        import task_stats
+        task_stats.rebuild(db)
+
+    elapsed = time.perf_counter() - started
+    docs_per_second = round(restored / elapsed, 1) if elapsed else None
+    print(f"✅ Restored {restored} documents, deleted {deleted}, in {elapsed:.1f}s ({docs_per_second} docs/s)")
+    return {
+        'verified': [m['id'] for m in chain],
+        'documents': restored,
+        'deleted': deleted,
+        'durationSeconds': round(elapsed, 2),
+        'docsPerSecond': docs_per_second
+    }
+
+
+def remove_partial_backups(backup_dir=BACKUP_DIR):
+    """Deletes leftovers of interrupted backups."""
+    if os.path.isdir(backup_dir):
+        for name in os.listdir(backup_dir):
+            if name.endswith('.partial'):
+                shutil.rmtree(os.path.join(backup_dir, name), ignore_errors=True)
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def _init_db():
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate("serviceAccountKey.json"))
+    return firestore.client()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Back up or restore the Garden App Firestore collections.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    backup_parser = sub.add_parser('backup', help='Create a backup')
+    backup_parser.add_argument('--incremental', action='store_true', help='Only documents changed since the last backup')
+    backup_parser.add_argument('--collections', help='Comma-separated collections (default: tasks,students,staff)')
+    restore_parser = sub.add_parser('restore', help='Restore a backup (and the backups it builds on)')
+    restore_parser.add_argument('backup_id')
+    restore_parser.add_argument('--verify-only', action='store_true', help='Only check checksums')
+    restore_parser.add_argument('--collections', help='Comma-separated collections to restore')
+    sub.add_parser('list', help='List backups')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for m in list_backups():
+            print(f"{m['id']:<32} {m['type']:<12} {m['documents']:>8} docs  {m['bytes'] / 1024 / 1024:8.2f} MB  base={m['base'] or '-'}")
+        sys.exit(0)
+
+    selected = args.collections.split(',') if args.collections else None
+    if args.command == 'backup':
+        remove_partial_backups()
+        create_backup(_init_db(), incremental=args.incremental, collections=selected)
+    else:
+        try:
+            restore_backup(_init_db() if not args.verify_only else None, args.backup_id,
+                           collections=selected, verify_only=args.verify_only)
+        except (FileNotFoundError, ValueError) as e:
+            print(f"❌ {e}")
+            sys.exit(1)
@@ -1,34 +1,133 @@
 # blip_processor.py
-import torch
 from PIL import Image, ImageDraw, ImageFont
 import os
-import sys
-from transformers import AutoProcessor, BlipForConditionalGeneration
+import threading
+import time
 from geopy.geocoders import Nominatim
 from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+from caption_batcher import CaptionBatcher
+
+# torch and transformers are imported inside the functions that need them so that
+# importing this module stays cheap; the model itself is loaded by load_default_model().
 
 # --- Configuration ---
 CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 FINE_TUNED_MODEL_PATH = os.path.join(CURRENT_SCRIPT_DIR, "fine_tuned_blip_garden_monitor")
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+DEVICE = "cpu"  # resolved to "cuda" when available by load_default_model()
 MAX_NEW_TOKENS = 50
+# Inference backend: "fp32" (reference), "int8" (dynamic quantization of Linear layers, CPU only)
+# or "compile" (torch.compile of the vision encoder)
+INFERENCE_BACKEND = os.environ.get("BLIP_BACKEND", "fp32").lower()
+# Intra-op CPU threads for torch (0 keeps the torch default)
+NUM_THREADS = int(os.environ.get("BLIP_NUM_THREADS", 0))
+# Micro-batching: up to BATCH_SIZE images or BATCH_WAIT_MS of waiting per generate() call
+BATCH_SIZE = int(os.environ.get("BLIP_BATCH_SIZE", 4))
+BATCH_WAIT_MS = float(os.environ.get("BLIP_BATCH_WAIT_MS", 50))
+# How long a caption request waits for a model that is still loading
+MODEL_WAIT_SECONDS = float(os.environ.get("BLIP_MODEL_WAIT_SECONDS", 120))
+
+# --- Model state (filled in by load_default_model) ---
+ft_processor = None
+ft_model = None
+font = None
+_model_ready = threading.Event()
+_load_lock = threading.Lock()
+_model_status = {'status': 'not_loaded', 'backend': INFERENCE_BACKEND, 'error': None, 'timings': {}}
+
+
+class ModelNotReadyError(RuntimeError):
+    """Raised when a caption is requested but the model is not (yet) available."""
+
+
+def apply_backend(model, backend):
+    """Returns the model optimized for the requested inference backend."""
+    import torch
+    if backend == "int8":
+        if DEVICE != "cpu":
+            print(f"⚠️ WARNING: int8 dynamic quantization is CPU-only, keeping fp32 on {DEVICE}.")
+            return model
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if backend == "compile":
+        if not hasattr(torch, "compile"):
+            print("⚠️ WARNING: torch.compile needs PyTorch 2.x, keeping fp32.")
+            return model
+        # generate() calls the text decoder with a growing sequence, so only the
+        # fixed-shape vision encoder is compiled
+        model.vision_model = torch.compile(model.vision_model)
+        return model
+    if backend != "fp32":
+        print(f"⚠️ WARNING: Unknown BLIP_BACKEND '{backend}', using fp32.")
+    return model
+
+def load_model(backend=INFERENCE_BACKEND):
+    """Loads the fine-tuned processor and model prepared for the given backend."""
+    from transformers import AutoProcessor, BlipForConditionalGeneration
+    processor = AutoProcessor.from_pretrained(FINE_TUNED_MODEL_PATH)
+    model = BlipForConditionalGeneration.from_pretrained(FINE_TUNED_MODEL_PATH).to(DEVICE)
+    model.eval()
+    return processor, apply_backend(model, backend)
+
+def load_font():
+    """Loads the caption overlay font, falling back to PIL's default."""
+    global font
+    try:
+        font = ImageFont.truetype("C:/Windows/Fonts/arial.ttf", 28)
+    except IOError:
+        font = ImageFont.load_default()
+        print("⚠️ WARNING: Arial font not found. Using default font.")
+    return font
+
+def load_default_model():
+    """Loads the configured model and font once. Safe to call from several threads."""
+    global ft_processor, ft_model, DEVICE
+    with _load_lock:
+        if _model_ready.is_set() or _model_status['status'] == 'failed':
+            return _model_ready.is_set()
+        _model_status['status'] = 'loading'
+        timings = _model_status['timings']
+        try:
+            started = time.perf_counter()
+            import torch
+            timings['torchImport'] = round(time.perf_counter() - started, 2)
+
+            DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+            if NUM_THREADS > 0:
+                torch.set_num_threads(NUM_THREADS)
+
+            started = time.perf_counter()
+            ft_processor, ft_model = load_model(INFERENCE_BACKEND)
+            timings['modelLoad'] = round(time.perf_counter() - started, 2)
+            print(f"✅ SUCCESS: Fine-tuned model loaded ({INFERENCE_BACKEND} backend, {torch.get_num_threads()} threads).")
+        except Exception as e:
+            _model_status.update(status='failed', error=str(e))
+            print(f"❌ ERROR: Failed to load fine-tuned model from '{FINE_TUNED_MODEL_PATH}'. {e}")
+            print("   Uploads will be accepted with a fallback caption.")
+            return False
 
-# --- Load Fine-Tuned Model and Processor ---
-try:
-    ft_processor = AutoProcessor.from_pretrained(FINE_TUNED_MODEL_PATH)
-    ft_model = BlipForConditionalGeneration.from_pretrained(FINE_TUNED_MODEL_PATH).to(DEVICE)
-    ft_model.eval()
-    print("✅ SUCCESS: Fine-tuned model loaded.")
-except Exception as e:
-    print(f"❌ ERROR: Failed to load fine-tuned model from '{FINE_TUNED_MODEL_PATH}'. {e}")
-    sys.exit(1)
-
-# --- Font Loading ---
-try:
-    font = ImageFont.truetype("C:/Windows/Fonts/arial.ttf", 28)
-except IOError:
-    font = ImageFont.load_default()
-    print("⚠️ WARNING: Arial font not found. Using default font.")
+        started = time.perf_counter()
+        load_font()
+        timings['fontLoad'] = round(time.perf_counter() - started, 2)
+
+        _model_status['status'] = 'ready'
+        _model_ready.set()
+        return True
+
+def start_background_load(on_loaded=None):
+    """Loads the model on a daemon thread; `on_loaded(ok)` is called when it finishes."""
+    def _load():
+        ok = load_default_model()
+        if on_loaded:
+            on_loaded(ok)
+    threading.Thread(target=_load, name='blip-model-loader', daemon=True).start()
+
+def is_model_ready():
+    return _model_ready.is_set()
+
+def get_model_status():
+    status = dict(_model_status)
+    status['timings'] = dict(_model_status['timings'])
+    status['ready'] = _model_ready.is_set()
+    return status
 
 def get_address_from_coords(latitude, longitude):
     """Converts latitude and longitude to a human-readable address using Nominatim."""
@@ -52,14 +151,42 @@ def add_text_to_image(image_pil, text):
     draw = ImageDraw.Draw(image_pil, "RGBA")
     return image_pil
 
+def caption_with(processor, model, images_pil):
+    """Runs one batched generate() call with an explicit processor/model pair."""
+    import torch
+    inputs = processor(images=images_pil, return_tensors="pt").to(DEVICE)
+    with torch.no_grad():
+        generated_ids = model.generate(pixel_values=inputs.pixel_values, max_new_tokens=MAX_NEW_TOKENS)
+    captions = processor.batch_decode(generated_ids, skip_special_tokens=True)
+    return [caption.strip() for caption in captions]
+
+def generate_captions(images_pil):
+    """Generates captions for a list of images with one batched generate() call."""
+    return caption_with(ft_processor, ft_model, images_pil)
+
+# --- Batching front-end shared by all caption callers ---
+batcher = CaptionBatcher(generate_captions, max_batch_size=BATCH_SIZE, max_wait_ms=BATCH_WAIT_MS) if BATCH_SIZE > 1 else None
+
 # ## --- UPDATED: Simplified to one caption generation function --- ##
 def generate_caption(image_pil):
-    """Generates a single caption using the fine-tuned model."""
-    try:
-        inputs = ft_processor(images=image_pil, return_tensors="pt").to(DEVICE)
-        with torch.no_grad():
-            generated_ids = ft_model.generate(pixel_values=inputs.pixel_values, max_new_tokens=MAX_NEW_TOKENS)
-        caption = ft_processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
-        return caption.strip()
-    except Exception as e:
-        return f"Error in captioning: {e}"
+    """Generates a single caption using the fine-tuned model.
+
+    Loads the model on first use if no background load was started. Raises
+    ModelNotReadyError if the model is still loading after MODEL_WAIT_SECONDS or
+    failed to load, and passes inference errors on, so callers can fall back to
+    a default caption.
+    """
+    if _model_status['status'] == 'not_loaded':
+        # Nobody started a background load (e.g. scripts) - load on this thread
+        load_default_model()
+    elif _model_status['status'] == 'loading':
+        _model_ready.wait(timeout=MODEL_WAIT_SECONDS)
+    if not _model_ready.is_set():
+        raise ModelNotReadyError(f"Caption model not ready ({_model_status['status']})")
+    if batcher is not None:
+        return batcher.submit(image_pil)
+    return generate_captions([image_pil])[0]
+
+def get_batch_stats():
+    """Per-batch latency/occupancy stats, or None when batching is disabled."""
+    return batcher.get_stats() if batcher is not None else None
@@ -0,0 +1,177 @@
+# bulk_writes.py
+"""
+Multi-document reads and writes for bulk admin operations.
+
+get_many() reads documents with db.get_all() in chunks. run_batched() commits
+writes in WriteBatch chunks sized to Firestore's 500-writes-per-commit limit,
+retries a chunk on transient errors and, if a chunk still fails, replays its
+items one by one so failures are reported per document.
+
+Only errors that guarantee nothing was written (Aborted, ResourceExhausted)
+are retried or replayed. A timeout or server error may arrive after the batch
+committed, and the batches carry Increment counter writes that must not be
+applied twice, so such a chunk is reported as failed with an unknown outcome.
+
+WriteBatch is used rather than BulkWriter because task writes must commit
+atomically with their stats counter updates (see task_stats.StatsDelta).
+run_transactional() is the variant for writes whose counter changes depend on
+the documents' current data: each chunk is a transaction that reads its
+documents with get_all() before writing them.
+"""
+import time
+
+from firebase_admin import firestore
+from google.api_core import exceptions as gexc
+
+FIRESTORE_BATCH_LIMIT = 500
+GET_ALL_CHUNK = 500
+MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.5
+
+# The commit was rejected before anything was written
+RETRYABLE_ERRORS = (
+    gexc.Aborted,
+    gexc.ResourceExhausted,
+)
+# The commit may or may not have been applied
+AMBIGUOUS_ERRORS = (
+    gexc.DeadlineExceeded,
+    gexc.InternalServerError,
+    gexc.ServiceUnavailable,
+    gexc.Unknown,
+    gexc.RetryError,
+)
+
+
+def get_many(db, refs, field_paths=None):
+    """Reads many documents with get_all(); returns {doc_id: data or None if missing}."""
+    results = {}
+    refs = list(refs)
+    for i in range(0, len(refs), GET_ALL_CHUNK):
+        for snapshot in db.get_all(refs[i:i + GET_ALL_CHUNK], field_paths=field_paths):
+            results[snapshot.id] = snapshot.to_dict() if snapshot.exists else None
+    return results
+
+
+def _commit_with_retry(db, items, add_to_batch, finalize, retries):
+    """Builds and commits one batch; returns the number of retries used. Raises on final failure."""
+    for attempt in range(retries + 1):
+        batch = db.batch()
+        for item in items:
+            add_to_batch(batch, item)
+        if finalize:
+            finalize(batch, items)
+        try:
+            batch.commit()
+            return attempt
+        except RETRYABLE_ERRORS:
+            if attempt == retries:
+                raise
+            time.sleep(RETRY_BACKOFF_SECONDS * (2 ** attempt))
+
+
+def run_batched(db, items, add_to_batch, finalize=None, writes_per_item=1, reserved_writes=0, retries=MAX_RETRIES):
+    """Commits writes for `items` in as few WriteBatch commits as the limits allow.
+
+    add_to_batch(batch, item) adds one item's writes (at most `writes_per_item`).
+    finalize(batch, chunk_items), if given, adds per-chunk writes such as counter
+    updates (at most `reserved_writes`). Returns
+    {'succeeded': [items], 'failed': [(item, reason)], 'batches': n, 'retries': n}.
+    """
+    items = list(items)
+    chunk_size = max(1, (FIRESTORE_BATCH_LIMIT - reserved_writes) // writes_per_item)
+    result = {'succeeded': [], 'failed': [], 'batches': 0, 'retries': 0}
+    for i in range(0, len(items), chunk_size):
+        chunk = items[i:i + chunk_size]
+        try:
+            result['retries'] += _commit_with_retry(db, chunk, add_to_batch, finalize, retries)
+            result['batches'] += 1
+            result['succeeded'].extend(chunk)
+            continue
+        except AMBIGUOUS_ERRORS as e:
+            # Replaying could apply the chunk's counter increments twice
+            print(f"⚠️ Batch of {len(chunk)} writes has an unknown outcome ({e}), not retrying")
+            result['failed'].extend((item, f'Commit outcome unknown: {e}') for item in chunk)
+            continue
+        except Exception as e:
+            if len(chunk) == 1:
+                result['failed'].append((chunk[0], str(e)))
+                continue
+            print(f"⚠️ Batch of {len(chunk)} writes failed ({e}), retrying documents individually")
+        # Isolate the failing documents
+        for item in chunk:
+            try:
+                result['retries'] += _commit_with_retry(db, [item], add_to_batch, finalize, retries)
+                result['batches'] += 1
+                result['succeeded'].append(item)
+            except AMBIGUOUS_ERRORS as e:
+                result['failed'].append((item, f'Commit outcome unknown: {e}'))
+            except Exception as e:
+                result['failed'].append((item, str(e)))
+    return result
+
+
+def _commit_transaction(db, items, ref_for, add_to_transaction, finalize, retries):
+    """Runs one chunk as a transaction; returns ([(item, data)] written, [(item, reason)] skipped)."""
+    @firestore.transactional
+    def _run(transaction):
+        refs = [ref_for(item) for item in items]
+        current = {snapshot.reference.path: snapshot for snapshot in transaction.get_all(refs)}
+        written, skipped = [], []
+        for item, ref in zip(items, refs):
+            snapshot = current.get(ref.path)
+            data = snapshot.to_dict() if snapshot is not None and snapshot.exists else None
+            reason = add_to_transaction(transaction, item, data)
+            if reason:
+                skipped.append((item, reason))
+            else:
+                written.append((item, data))
+        if finalize and written:
+            finalize(transaction, written)
+        return written, skipped
+
+    # The transaction retries itself when the commit is aborted by contention
+    return _run(db.transaction(max_attempts=retries + 1))
+
+
+def run_transactional(db, items, ref_for, add_to_transaction, finalize=None, writes_per_item=1, reserved_writes=0, retries=MAX_RETRIES):
+    """Like run_batched(), but every chunk is a transaction over the chunk's current documents.
+
+    ref_for(item) is the document an item writes. add_to_transaction(transaction, item, data)
+    gets that document's data as read in the transaction (None if missing), adds the item's
+    writes and returns None, or returns a reason string to skip the item. finalize(transaction,
+    [(item, data)]) adds per-chunk writes for the written items. Returns
+    {'succeeded': [(item, data)], 'failed': [(item, reason)], 'batches': n}.
+    """
+    items = list(items)
+    chunk_size = max(1, (FIRESTORE_BATCH_LIMIT - reserved_writes) // writes_per_item)
+    result = {'succeeded': [], 'failed': [], 'batches': 0}
+
+    def _run_chunk(chunk):
+        written, skipped = _commit_transaction(db, chunk, ref_for, add_to_transaction, finalize, retries)
+        result['batches'] += 1
+        result['succeeded'].extend(written)
+        result['failed'].extend(skipped)
+
+    for i in range(0, len(items), chunk_size):
+        chunk = items[i:i + chunk_size]
+        try:
+            _run_chunk(chunk)
+            continue
+        except AMBIGUOUS_ERRORS as e:
+            print(f"⚠️ Transaction of {len(chunk)} writes has an unknown outcome ({e}), not retrying")
+            result['failed'].extend((item, f'Commit outcome unknown: {e}') for item in chunk)
+            continue
+        except Exception as e:
+            if len(chunk) == 1:
+                result['failed'].append((chunk[0], str(e)))
+                continue
+            print(f"⚠️ Transaction of {len(chunk)} writes failed ({e}), retrying documents individually")
+        for item in chunk:
+            try:
+                _run_chunk([item])
+            except AMBIGUOUS_ERRORS as e:
+                result['failed'].append((item, f'Commit outcome unknown: {e}'))
+            except Exception as e:
+                result['failed'].append((item, str(e)))
+    return result
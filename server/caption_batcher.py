@@ -0,0 +1,112 @@
+# caption_batcher.py
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+LATENCY_WINDOW = 200  # number of recent batches kept for latency percentiles
+SUBMIT_TIMEOUT = 120  # seconds a caller waits for its caption before giving up
+
+
+class CaptionBatcher:
+    """Collects concurrent caption requests into micro-batches for a single model call.
+
+    A request waits at most `max_wait_ms` for company; a batch is flushed as soon as
+    it holds `max_batch_size` images. `batch_fn(images)` must return one caption per image.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=4, max_wait_ms=50):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._stats = {'batches': 0, 'images': 0, 'fullBatches': 0, 'errors': 0}
+        self._thread = threading.Thread(target=self._run, name='caption-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, image, timeout=SUBMIT_TIMEOUT):
+        """Queues one image and blocks until its caption is ready (TimeoutError after `timeout` seconds)."""
+        future = Future()
+        self._queue.put((image, future))
+        return future.result(timeout=timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._process(batch)
+            except Exception as e:
+                # Never let the worker die: every later submit() would wait for nothing
+                print(f"⚠️ Caption batcher error: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _process(self, batch):
+        images = [image for image, _ in batch]
+        started = time.perf_counter()
+        try:
+            captions = list(self.batch_fn(images))
+            error = None
+        except Exception as e:
+            captions, error = [], e
+        latency_ms = (time.perf_counter() - started) * 1000
+        if error is None and len(captions) != len(batch):
+            error = ValueError(f'batch_fn returned {len(captions)} captions for {len(batch)} images')
+
+        for i, (_, future) in enumerate(batch):
+            if i < len(captions):
+                future.set_result(captions[i])
+            else:
+                future.set_exception(error)
+
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['images'] += len(batch)
+            if len(batch) == self.max_batch_size:
+                self._stats['fullBatches'] += 1
+            if error is not None:
+                self._stats['errors'] += 1
+            self._latencies.append((latency_ms, len(batch)))
+        print(f"🧮 Caption batch: {len(batch)}/{self.max_batch_size} images in {latency_ms:.0f} ms")
+
+    def get_stats(self):
+        """Returns batch counters plus latency/occupancy over the recent window."""
+        with self._lock:
+            stats = dict(self._stats)
+            recent = list(self._latencies)
+        latencies = sorted(latency for latency, _ in recent)
+        sizes = [size for _, size in recent]
+
+        def percentile(p):
+            if not latencies:
+                return 0
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 1)
+
+        stats.update({
+            'maxBatchSize': self.max_batch_size,
+            'maxWaitMs': round(self.max_wait * 1000, 1),
+            'pending': self._queue.qsize(),
+            'avgBatchSize': round(sum(sizes) / len(sizes), 2) if sizes else 0,
+            'avgOccupancy': round(sum(sizes) / (len(sizes) * self.max_batch_size), 3) if sizes else 0,
+            'latencyMsP50': percentile(0.5),
+            'latencyMsP95': percentile(0.95),
+            'lastLatencyMs': round(recent[-1][0], 1) if recent else 0
+        })
+        return stats
@@ -0,0 +1,128 @@
+# caption_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# --- Configuration ---
+CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_SIZE = int(os.environ.get('CAPTION_CACHE_SIZE', 1024))
+# 'exact' keys on the decoded pixels; 'perceptual' keys on a 64-bit difference hash so
+# re-encoded or slightly resized copies of the same photo share a caption
+CACHE_KEY_MODE = os.environ.get('CAPTION_CACHE_KEY', 'exact').lower()
+# Optional on-disk tier that survives restarts; empty disables it
+CACHE_DB_PATH = os.environ.get('CAPTION_CACHE_DB', os.path.join(CURRENT_SCRIPT_DIR, 'caption_cache.sqlite3'))
+
+_memory = OrderedDict()
+_lock = threading.Lock()
+_counters = {'memoryHits': 0, 'diskHits': 0, 'misses': 0, 'stores': 0}
+_db = None
+
+
+def _open_db():
+    global _db
+    if not CACHE_DB_PATH:
+        return None
+    if _db is None:
+        try:
+            _db = sqlite3.connect(CACHE_DB_PATH, check_same_thread=False)
+            _db.execute('PRAGMA journal_mode=WAL')
+            _db.execute('CREATE TABLE IF NOT EXISTS captions (key TEXT PRIMARY KEY, caption TEXT NOT NULL, created_at REAL NOT NULL)')
+            _db.commit()
+            print(f"✅ Caption cache disk tier: {CACHE_DB_PATH}")
+        except Exception as e:
+            print(f"⚠️ WARNING: Caption cache disk tier unavailable ({e}). Using memory only.")
+            _db = False
+    return _db or None
+
+
+def _dhash(image, hash_size=8):
+    """64-bit difference hash: robust to re-encoding and resizing."""
+    small = image.convert('L').resize((hash_size + 1, hash_size))
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f'{bits:016x}'
+
+
+def image_key(image):
+    """Cache key for a decoded PIL image."""
+    if CACHE_KEY_MODE == 'perceptual':
+        return 'p:' + _dhash(image)
+    rgb = image.convert('RGB')
+    digest = hashlib.sha256(f'{rgb.width}x{rgb.height}:'.encode())
+    digest.update(rgb.tobytes())
+    return 'x:' + digest.hexdigest()
+
+
+def _get(key):
+    with _lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            _counters['memoryHits'] += 1
+            return _memory[key]
+        db = _open_db()
+        row = None
+        if db:
+            row = db.execute('SELECT caption FROM captions WHERE key = ?', (key,)).fetchone()
+        if row:
+            _counters['diskHits'] += 1
+            _remember(key, row[0])
+            return row[0]
+        _counters['misses'] += 1
+        return None
+
+
+def _remember(key, caption):
+    _memory[key] = caption
+    _memory.move_to_end(key)
+    while len(_memory) > CACHE_SIZE:
+        _memory.popitem(last=False)
+
+
+def _put(key, caption):
+    with _lock:
+        _remember(key, caption)
+        _counters['stores'] += 1
+        db = _open_db()
+        if db:
+            try:
+                db.execute('INSERT OR REPLACE INTO captions (key, caption, created_at) VALUES (?, ?, ?)', (key, caption, time.time()))
+                db.commit()
+            except Exception as e:
+                print(f"⚠️ Caption cache write failed: {e}")
+
+
+def get_or_generate(image, generate_fn):
+    """Returns the cached caption for `image`, or runs `generate_fn(image)` and caches the result."""
+    key = image_key(image)
+    caption = _get(key)
+    if caption is not None:
+        print(f"♻️ Caption cache hit ({key[:12]}...)")
+        return caption
+
+    # A failed generation raises and caches nothing, so the next upload gets a real attempt
+    caption = generate_fn(image)
+    if caption:
+        _put(key, caption)
+    return caption
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_counters)
+        stats['memoryEntries'] = len(_memory)
+    lookups = stats['memoryHits'] + stats['diskHits'] + stats['misses']
+    stats.update({
+        'capacity': CACHE_SIZE,
+        'keyMode': CACHE_KEY_MODE,
+        'diskTier': bool(_db),
+        'hitRate': round((stats['memoryHits'] + stats['diskHits']) / lookups, 3) if lookups else 0
+    })
+    return stats
@@ -0,0 +1,120 @@
+# caption_queue.py
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+# --- Configuration ---
+CAPTION_WORKERS = int(os.environ.get('CAPTION_WORKERS', 4))
+CAPTION_QUEUE_SIZE = int(os.environ.get('CAPTION_QUEUE_SIZE', 100))
+JOB_HISTORY_LIMIT = 500
+
+# --- Job state ---
+# Uploads reserve a slot before their task is created, so a full queue is refused up front
+_slots = threading.BoundedSemaphore(CAPTION_QUEUE_SIZE)
+_job_queue = queue.Queue()
+_jobs = OrderedDict()  # task_id -> job status dict (bounded to JOB_HISTORY_LIMIT)
+_jobs_lock = threading.Lock()
+_workers = []
+_handler = None
+_counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+
+
+def _now():
+    return datetime.now().isoformat()
+
+
+def _remember(task_id, job):
+    """Stores job status, evicting the oldest finished jobs past the history limit."""
+    with _jobs_lock:
+        _jobs[task_id] = job
+        _jobs.move_to_end(task_id)
+        while len(_jobs) > JOB_HISTORY_LIMIT:
+            oldest_id, oldest = next(iter(_jobs.items()))
+            if oldest['status'] in ('queued', 'processing'):
+                break
+            _jobs.pop(oldest_id)
+
+
+def _update(task_id, **fields):
+    with _jobs_lock:
+        job = _jobs.get(task_id)
+        if job is not None:
+            job.update(fields)
+
+
+def _worker_loop(worker_name):
+    while True:
+        task_id, payload = _job_queue.get()
+        _slots.release()
+        try:
+            _update(task_id, status='processing', startedAt=_now(), worker=worker_name)
+            started = time.perf_counter()
+            result = _handler(task_id, payload) or {}
+            _update(task_id, status='completed', finishedAt=_now(),
+                    durationMs=round((time.perf_counter() - started) * 1000, 1), **result)
+            with _jobs_lock:
+                _counters['completed'] += 1
+        except Exception as e:
+            print(f"❌ Caption job {task_id} failed: {e}")
+            _update(task_id, status='failed', finishedAt=_now(), error=str(e))
+            with _jobs_lock:
+                _counters['failed'] += 1
+        finally:
+            _job_queue.task_done()
+
+
+def start_workers(handler, worker_count=None):
+    """Starts the caption worker pool. `handler(task_id, payload)` does the actual work."""
+    global _handler
+    if _workers:
+        return
+    _handler = handler
+    worker_count = worker_count or CAPTION_WORKERS
+    for i in range(worker_count):
+        worker = threading.Thread(target=_worker_loop, args=(f'caption-worker-{i + 1}',), daemon=True)
+        worker.start()
+        _workers.append(worker)
+    print(f"✅ Caption queue started with {worker_count} workers (queue size {CAPTION_QUEUE_SIZE})")
+
+
+def reserve():
+    """Reserves a queue slot for one job. Returns False when the queue is full."""
+    if _slots.acquire(blocking=False):
+        return True
+    with _jobs_lock:
+        _counters['rejected'] += 1
+    return False
+
+
+def release():
+    """Gives back a reserved slot that will not be used (the upload failed before submit)."""
+    _slots.release()
+
+
+def submit(task_id, payload):
+    """Queues a caption job in a slot taken with reserve()."""
+    _remember(task_id, {'taskId': task_id, 'status': 'queued', 'queuedAt': _now()})
+    _job_queue.put((task_id, payload))
+    with _jobs_lock:
+        _counters['submitted'] += 1
+
+
+def get_job_status(task_id):
+    """Returns a copy of the job status, or None if this process never saw the job."""
+    with _jobs_lock:
+        job = _jobs.get(task_id)
+        return dict(job) if job is not None else None
+
+
+def get_queue_stats():
+    with _jobs_lock:
+        counters = dict(_counters)
+    return {
+        'workers': len(_workers),
+        'queued': _job_queue.qsize(),
+        'capacity': CAPTION_QUEUE_SIZE,
+        **counters
+    }
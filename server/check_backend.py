@@ -0,0 +1,84 @@
+# check_backend.py
+import argparse
+import os
+import sys
+import time
+
+# The module-level model doubles as the fp32 baseline, and batching is not needed here
+os.environ["BLIP_BACKEND"] = "fp32"
+os.environ["BLIP_BATCH_SIZE"] = "1"
+
+from PIL import Image
+import blip_processor
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def load_samples(sample_dir, limit):
+    """Loads up to `limit` sample images from a directory."""
+    paths = sorted(
+        os.path.join(sample_dir, name) for name in os.listdir(sample_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )[:limit]
+    return [(os.path.basename(path), Image.open(path).convert("RGB")) for path in paths]
+
+
+def word_f1(reference, candidate):
+    """Token-overlap F1 between two captions (1.0 = same words)."""
+    ref_words, cand_words = reference.lower().split(), candidate.lower().split()
+    if not ref_words or not cand_words:
+        return float(ref_words == cand_words)
+    common = sum(min(ref_words.count(w), cand_words.count(w)) for w in set(cand_words))
+    if common == 0:
+        return 0.0
+    precision, recall = common / len(cand_words), common / len(ref_words)
+    return 2 * precision * recall / (precision + recall)
+
+
+def timed_captions(processor, model, samples):
+    """Captions each sample one at a time; returns captions and mean latency in ms."""
+    # Warm-up pass so lazy initialisation (and torch.compile) is not billed to the first image
+    blip_processor.caption_with(processor, model, [samples[0][1]])
+    captions, started = [], time.perf_counter()
+    for _, image in samples:
+        captions.append(blip_processor.caption_with(processor, model, [image])[0])
+    return captions, (time.perf_counter() - started) * 1000 / len(samples)
+
+
+def check_backend(backend, sample_dir, limit):
+    """Compares a backend's captions and latency against the fp32 baseline."""
+    samples = load_samples(sample_dir, limit)
+    if not samples:
+        print(f"No sample images found in '{sample_dir}'.")
+        return 1
+
+    print(f"Comparing '{backend}' against fp32 on {len(samples)} images...")
+    if not blip_processor.load_default_model():
+        return 1
+    baseline, baseline_ms = timed_captions(blip_processor.ft_processor, blip_processor.ft_model, samples)
+    processor, model = blip_processor.load_model(backend)
+    candidate, candidate_ms = timed_captions(processor, model, samples)
+
+    exact, f1_total = 0, 0.0
+    for (name, _), ref, cand in zip(samples, baseline, candidate):
+        f1 = word_f1(ref, cand)
+        exact += ref == cand
+        f1_total += f1
+        if ref != cand:
+            print(f"  {name}: fp32='{ref}' | {backend}='{cand}' (F1 {f1:.2f})")
+
+    print("\nResults")
+    print(f"  Exact match:     {exact}/{len(samples)} ({exact / len(samples):.0%})")
+    print(f"  Mean word F1:    {f1_total / len(samples):.3f}")
+    print(f"  fp32 latency:    {baseline_ms:.0f} ms/image")
+    print(f"  {backend} latency: {candidate_ms:.0f} ms/image ({baseline_ms / candidate_ms:.2f}x)")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check a BLIP inference backend against the fp32 baseline.")
+    parser.add_argument("--backend", default="int8", help="Backend to check: int8 or compile")
+    parser.add_argument("--samples", required=True, help="Directory of sample images")
+    parser.add_argument("--limit", type=int, default=50, help="Maximum number of samples")
+    args = parser.parse_args()
+    sys.exit(check_backend(args.backend, args.samples, args.limit))
@@ -0,0 +1,122 @@
+# conditional.py
+"""
+Conditional GET (ETag / If-None-Match) for JSON endpoints that clients poll.
+
+Each decorated endpoint names the collections its payload is built from. When
+every one of them has a version source (a snapshot listener counting changes,
+see register_version_source), the ETag is derived from those versions and a
+matching If-None-Match is answered with 304 before the view runs, so no
+Firestore reads happen. Otherwise the view runs and the ETag is a hash of the
+body, which still saves the transfer. Top-level fields stamped with the
+response time (VOLATILE_FIELDS) are left out of that hash, or it would never
+match.
+
+Listener-fed versions trail a write by the listener's delivery delay (usually
+well under a second), the same staleness bound as the task replica.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import request, make_response
+
+# Distinguishes ETags of different processes and restarts, whose counters overlap
+_PROCESS_TAG = os.urandom(8).hex()
+
+# Generation times added to responses (e.g. 'timestamp': datetime.now()), not data
+VOLATILE_FIELDS = ('timestamp', 'lastUpdated')
+
+_version_sources = {}  # collection -> callable returning a version or None
+_lock = threading.Lock()
+_stats = {'versionHits': 0, 'hashHits': 0, 'versionMisses': 0, 'hashMisses': 0}
+
+
+def register_version_source(collection, source):
+    """`source()` returns a value that changes whenever `collection` changes, or None if it cannot tell."""
+    _version_sources[collection] = source
+
+
+def _versions(collections):
+    versions = []
+    for collection in collections:
+        source = _version_sources.get(collection)
+        version = source() if source else None
+        if version is None:
+            return None
+        versions.append(f'{collection}={version}')
+    return versions
+
+
+def _hash(*parts):
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:32]
+
+
+def _body_hash(response):
+    body = response.get_json(silent=True)
+    if isinstance(body, dict) and any(field in body for field in VOLATILE_FIELDS):
+        stable = {k: v for k, v in body.items() if k not in VOLATILE_FIELDS}
+        return _hash(json.dumps(stable, sort_keys=True, separators=(',', ':')))
+    return _hash(response.get_data(as_text=True))
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def _not_modified(etag):
+    response = make_response('', 304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def conditional(*collections, refresh_seconds=None):
+    """Decorates a GET view whose JSON depends only on `collections` and the query string.
+
+    refresh_seconds: for payloads with time-derived fields (e.g. wait times),
+    the version-based ETag also changes every refresh_seconds.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            versions = _versions(collections)
+            etag = None
+            if versions is not None:
+                parts = [_PROCESS_TAG, request.full_path] + versions
+                if refresh_seconds:
+                    parts.append(str(int(time.time() // refresh_seconds)))
+                etag = 'v-' + _hash(*parts)
+                if request.if_none_match.contains_weak(etag):
+                    _count('versionHits')
+                    return _not_modified(etag)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            if etag is None:
+                etag = 'h-' + _body_hash(response)
+                if request.if_none_match.contains_weak(etag):
+                    _count('hashHits')
+                    return _not_modified(etag)
+                _count('hashMisses')
+            else:
+                _count('versionMisses')
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_stats)
+    served = stats['versionHits'] + stats['hashHits']
+    total = served + stats['versionMisses'] + stats['hashMisses']
+    stats['notModifiedRate'] = round(served / total, 3) if total else 0
+    stats['versionSources'] = {c: source() for c, source in _version_sources.items()}
+    return stats
@@ -0,0 +1,165 @@
+# csv_export.py
+"""
+Streaming CSV exports for admin_server's /admin/export_data.
+
+Rows are produced by generators straight from Firestore streams and written
+with the csv module (proper quoting), optionally gzip-compressed on the fly,
+so memory stays bounded however large the export is.
+"""
+import csv
+import itertools
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from firestore_helpers import fs_filter
+
+# Rows are sent in pieces of about this many bytes
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_date_range(start_param, end_param):
+    """Parses ISO `start`/`end` parameters. A date-only `end` includes that whole day.
+
+    Raises ValueError for malformed dates.
+    """
+    start = datetime.fromisoformat(start_param) if start_param else None
+    end = None
+    if end_param:
+        end = datetime.fromisoformat(end_param)
+        if len(end_param) == 10:
+            end += timedelta(days=1)
+    return start, end
+
+
+def _in_range(query, field, start, end):
+    if start:
+        query = fs_filter(query, field, '>=', start)
+    if end:
+        query = fs_filter(query, field, '<', end)
+    return query
+
+
+def _fmt(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+# ============================================================================
+# ROW GENERATORS (header first)
+# ============================================================================
+
+def task_rows(db, start=None, end=None):
+    yield ['Task ID', 'Student Name', 'Register Number', 'Caption', 'Location', 'Status', 'Assigned To', 'Created At', 'Completed At']
+    fields = ['studentName', 'registerNumber', 'aiCaption', 'location', 'status', 'assignedTo', 'createdAt', 'completedAt']
+    for doc in _in_range(db.collection('tasks'), 'createdAt', start, end).select(fields).stream():
+        task = doc.to_dict()
+        yield [doc.id] + [_fmt(task.get(field)) for field in fields]
+
+
+def _report_counts(db, start, end):
+    """Reports and last report time per student from one grouped pass over tasks."""
+    counts, last = defaultdict(int), {}
+    for doc in _in_range(db.collection('tasks'), 'createdAt', start, end).select(['registerNumber', 'createdAt']).stream():
+        task = doc.to_dict()
+        register_number = task.get('registerNumber')
+        if not register_number:
+            continue
+        counts[register_number] += 1
+        created_at = task.get('createdAt')
+        if created_at and (register_number not in last or created_at > last[register_number]):
+            last[register_number] = created_at
+    return counts, last
+
+
+def student_rows(db, start=None, end=None):
+    """Students with report counts; the date range applies to the reports counted."""
+    yield ['Register Number', 'Name', 'Total Reports', 'Last Report']
+    counts, last = _report_counts(db, start, end)
+    for doc in db.collection('students').select(['name']).stream():
+        yield [doc.id, doc.to_dict().get('name', ''), counts.get(doc.id, 0), _fmt(last.get(doc.id))]
+
+
+def staff_rows(db, start=None, end=None):
+    """Staff with task counts; the date range applies to the tasks counted."""
+    yield ['Staff ID', 'Name', 'Active', 'Created At', 'Last Login', 'Total Tasks', 'Pending Tasks', 'Completed Tasks']
+    counts = defaultdict(lambda: defaultdict(int))
+    for doc in _in_range(db.collection('tasks'), 'createdAt', start, end).select(['assignedTo', 'status']).stream():
+        task = doc.to_dict()
+        if task.get('assignedTo'):
+            counts[task['assignedTo']]['total'] += 1
+            counts[task['assignedTo']][task.get('status')] += 1
+    for doc in db.collection('staff').select(['name', 'active', 'createdAt', 'lastLogin']).stream():
+        staff = doc.to_dict()
+        staff_counts = counts.get(doc.id, {})
+        yield [doc.id, staff.get('name', ''), staff.get('active', True), _fmt(staff.get('createdAt')), _fmt(staff.get('lastLogin')),
+               staff_counts.get('total', 0), staff_counts.get('pending', 0), staff_counts.get('completed', 0)]
+
+
+def notification_rows(db, start=None, end=None):
+    """Every student notification (collection group over notifications/*/user_notifications).
+
+    A date range needs the collection-group timestamp index (fieldOverrides in
+    firestore.indexes.json.example).
+    """
+    yield ['Notification ID', 'Recipient', 'Type', 'Title', 'Message', 'Task ID', 'Sender', 'Read', 'Timestamp']
+    fields = ['type', 'title', 'message', 'taskId', 'sender', 'read', 'timestamp']
+    for doc in _in_range(db.collection_group('user_notifications'), 'timestamp', start, end).select(fields).stream():
+        notification = doc.to_dict()
+        recipient = doc.reference.parent.parent.id
+        yield [doc.id, recipient] + [_fmt(notification.get(field)) for field in fields]
+
+
+ROW_GENERATORS = {
+    'tasks': task_rows,
+    'students': student_rows,
+    'staff': staff_rows,
+    'notifications': notification_rows,
+}
+
+
+def start_rows(rows):
+    """Runs a row generator up to its first data row and returns an iterator over all rows.
+
+    The first page of the export's query is then read before the response starts,
+    so a query error (such as a missing index) becomes an error response instead
+    of a truncated file.
+    """
+    first = list(itertools.islice(rows, 2))
+    return itertools.chain(first, rows)
+
+
+# ============================================================================
+# ENCODING
+# ============================================================================
+
+class _Line:
+    """File-like object whose write() just hands the formatted CSV line back."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows, compress=False, chunk_size=CHUNK_SIZE):
+    """Yields UTF-8 CSV bytes for `rows` in ~chunk_size pieces, gzip-compressed on the fly if requested."""
+    writer = csv.writer(_Line())
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31 = gzip container
+    buffer, size = [], 0
+    for row in rows:
+        line = writer.writerow(row).encode('utf-8')
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            data = b''.join(buffer)
+            buffer, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = b''.join(buffer)
+    if compressor is not None:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
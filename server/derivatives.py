@@ -0,0 +1,224 @@
+# derivatives.py
+"""
+Resized copies of uploaded media, served with ?size= on the media routes:
+
+    thumb / medium  images scaled to fit the box (video: scaled poster frame)
+    poster          a frame from a video, at most POSTER_MAX px
+
+Each exists as JPEG and, when Pillow has WebP support, WebP (picked by the
+Accept header). They are generated by a background worker after uploads and
+regenerated on demand if missing.
+"""
+import os
+import queue
+import threading
+import time
+
+from PIL import Image, ImageOps, features
+
+DERIVATIVES_DIR = os.environ.get('DERIVATIVES_DIR', 'derivatives')
+DERIVATIVE_QUEUE_SIZE = int(os.environ.get('DERIVATIVE_QUEUE_SIZE', 200))
+SIZES = {'thumb': 320, 'medium': 1280}
+POSTER_MAX = 1280
+JPEG_QUALITY = 82
+WEBP_QUALITY = 78
+VIDEO_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv'}
+# Where in a video the poster frame is taken (the first frame is often black)
+POSTER_OFFSET_MS = 1000
+
+WEBP_SUPPORTED = features.check('webp')
+CONTENT_TYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+
+_queue = queue.Queue(maxsize=DERIVATIVE_QUEUE_SIZE)
+_worker = None
+# Striped locks keyed by source path, so concurrent requests generate a file once
+_locks = [threading.Lock() for _ in range(32)]
+_stats_lock = threading.Lock()
+_stats = {'scheduled': 0, 'dropped': 0, 'generated': 0, 'onDemand': 0, 'failed': 0, 'generateMs': 0.0}
+
+
+def _is_video(filename):
+    return filename.rsplit('.', 1)[-1].lower() in VIDEO_EXTENSIONS
+
+
+def all_sizes(filename):
+    return list(SIZES) + (['poster'] if _is_video(filename) else [])
+
+
+def derivative_path(folder, filename, size, fmt):
+    ext = 'jpg' if fmt == 'jpeg' else fmt
+    return os.path.join(DERIVATIVES_DIR, folder, f'{filename}.{size}.{ext}')
+
+
+def negotiate_format(accept_header):
+    """WebP when the client accepts it (browsers, Flutter's image codecs), else JPEG."""
+    if WEBP_SUPPORTED and 'image/webp' in (accept_header or ''):
+        return 'webp'
+    return 'jpeg'
+
+
+def _formats():
+    return ['jpeg', 'webp'] if WEBP_SUPPORTED else ['jpeg']
+
+
+# ============================================================================
+# GENERATION
+# ============================================================================
+
+def _video_frame(source_path):
+    import cv2
+    capture = cv2.VideoCapture(source_path)
+    try:
+        capture.set(cv2.CAP_PROP_POS_MSEC, POSTER_OFFSET_MS)
+        success, frame = capture.read()
+        if not success:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success, frame = capture.read()
+    finally:
+        capture.release()
+    if not success:
+        raise ValueError('no frame could be read')
+    return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+
+def _open_source(source_path, filename):
+    if _is_video(filename):
+        image = _video_frame(source_path)
+        image.thumbnail((POSTER_MAX, POSTER_MAX), Image.LANCZOS)
+        return image
+    image = Image.open(source_path)
+    # JPEG decoders can downscale while decoding; the largest box we need is enough
+    image.draft('RGB', (max(SIZES.values()), max(SIZES.values())))
+    return ImageOps.exif_transpose(image).convert('RGB')
+
+
+def _save(image, path, fmt):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # app.py and admin_server.py both write here; thread idents are only unique per process
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        if fmt == 'webp':
+            image.save(tmp_path, 'WEBP', quality=WEBP_QUALITY, method=4)
+        else:
+            image.save(tmp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _source_lock(source_path):
+    return _locks[hash(source_path) % len(_locks)]
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def _generate(folder, source_path):
+    # Caller holds _source_lock(source_path)
+    filename = os.path.basename(source_path)
+    started = time.perf_counter()
+    image = _open_source(source_path, filename)
+    if _is_video(filename):
+        for fmt in _formats():
+            _save(image, derivative_path(folder, filename, 'poster', fmt), fmt)
+    for size, box in sorted(SIZES.items(), key=lambda item: -item[1]):
+        image = image.copy()
+        image.thumbnail((box, box), Image.LANCZOS)
+        for fmt in _formats():
+            _save(image, derivative_path(folder, filename, size, fmt), fmt)
+    _count('generated')
+    _count('generateMs', (time.perf_counter() - started) * 1000)
+
+
+def _is_fresh(path, source_path):
+    try:
+        return os.path.getmtime(path) >= os.path.getmtime(source_path)
+    except OSError:
+        return False
+
+
+def generate(folder, source_path):
+    """Writes every size and format for one media file (decoded once, largest size first)."""
+    with _source_lock(source_path):
+        _generate(folder, source_path)
+
+
+def get(folder, source_path, size, accept_header=''):
+    """Path and content type of a derivative, generating it now if missing or older than the source.
+
+    Returns None when it cannot be produced (e.g. OpenCV missing for a video poster).
+    """
+    filename = os.path.basename(source_path)
+    if size not in all_sizes(filename):
+        return None
+    fmt = negotiate_format(accept_header)
+    path = derivative_path(folder, filename, size, fmt)
+    if not _is_fresh(path, source_path):
+        with _source_lock(source_path):
+            # Another request may have generated it while we waited
+            if not _is_fresh(path, source_path):
+                try:
+                    _count('onDemand')
+                    _generate(folder, source_path)
+                except Exception as e:
+                    _count('failed')
+                    print(f"⚠️ Could not generate {size} derivative of {source_path}: {e}")
+                    return None
+    return path, CONTENT_TYPES[fmt]
+
+
+def remove(folder, filename):
+    """Deletes the derivatives of a media file that was deleted."""
+    for size in all_sizes(filename):
+        for fmt in CONTENT_TYPES:
+            try:
+                os.remove(derivative_path(folder, filename, size, fmt))
+            except FileNotFoundError:
+                pass
+
+
+# ============================================================================
+# BACKGROUND WORKER
+# ============================================================================
+
+def _worker_loop():
+    while True:
+        folder, source_path = _queue.get()
+        try:
+            generate(folder, source_path)
+        except Exception as e:
+            _count('failed')
+            print(f"⚠️ Derivative generation failed for {source_path}: {e}")
+        finally:
+            _queue.task_done()
+
+
+def start_worker():
+    global _worker
+    if _worker is None:
+        _worker = threading.Thread(target=_worker_loop, name='derivative-worker', daemon=True)
+        _worker.start()
+        print(f"✅ Derivative worker started ({', '.join(_formats())})")
+
+
+def schedule(folder, source_path):
+    """Queues derivative generation without blocking; a full queue just defers it to the first request."""
+    try:
+        _queue.put_nowait((folder, source_path))
+        _count('scheduled')
+    except queue.Full:
+        _count('dropped')
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats, queued=_queue.qsize(), webp=WEBP_SUPPORTED, sizes=SIZES)
+    stats['averageGenerateMs'] = round(stats['generateMs'] / stats['generated'], 1) if stats['generated'] else 0
+    stats['generateMs'] = round(stats['generateMs'], 1)
+    return stats
@@ -0,0 +1,214 @@
+# firestore_helpers.py
+"""
+Query helpers shared by app.py and admin_server.py that paper over differences
+between Firestore SDK versions (and the emulator).
+"""
+import base64
+import json
+import os
+from datetime import datetime
+
+import time
+
+from google.api_core.exceptions import FailedPrecondition
+from google.cloud import firestore as gcfirestore
+from google.cloud.firestore import FieldFilter
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Admin task search: fields matched, and tasks read per request before a short page is returned
+TASK_SEARCH_FIELDS = ('aiCaption', 'studentName', 'registerNumber', 'location')
+SEARCH_SCAN_LIMIT = int(os.environ.get('TASK_SEARCH_SCAN_LIMIT', 2000))
+
+# How long a query shape that hit a missing composite index stays on the fallback path
+MISSING_INDEX_RETRY_SECONDS = 600
+
+_aggregation_warning_shown = False
+_missing_indexes = {}  # index name -> time the index was found missing
+
+
+def fs_filter(query, field, op, value):
+    """Use modern .filter(FieldFilter) if available, else fall back to .where()."""
+    if hasattr(query, 'filter'):
+        try:
+            return query.filter(FieldFilter(field, op, value))
+        except Exception:
+            # In case the installed SDK exposes attribute but not compatible
+            return query.where(field, op, value)
+    return query.where(field, op, value)
+
+
+def fs_count(query):
+    """Counts matching documents with a server-side count() aggregation.
+
+    Falls back to streaming document ids (no fields) when the SDK or the
+    emulator does not support aggregation queries.
+    """
+    global _aggregation_warning_shown
+    if hasattr(query, 'count'):
+        try:
+            results = query.count(alias='count').get()
+            return int(results[0][0].value)
+        except Exception as e:
+            if not _aggregation_warning_shown:
+                print(f"⚠️ Firestore count() aggregation unavailable, counting by streaming: {e}")
+                _aggregation_warning_shown = True
+    return sum(1 for _ in query.select([]).stream())
+
+
+def _sort_key(value):
+    return value.timestamp() if hasattr(value, 'timestamp') else 0
+
+
+def fs_top(query, order_field, limit, index_name, descending=True):
+    """First `limit` documents of `query` ordered by `order_field`, sorted and limited by Firestore.
+
+    Needs a composite index when `query` has equality filters. If the index is
+    missing (FailedPrecondition) the query is streamed and sorted in Python
+    instead, with a warning; `index_name` identifies the index in the log and
+    is retried after MISSING_INDEX_RETRY_SECONDS.
+    """
+    missing_since = _missing_indexes.get(index_name)
+    if missing_since is None or time.time() - missing_since > MISSING_INDEX_RETRY_SECONDS:
+        direction = gcfirestore.Query.DESCENDING if descending else gcfirestore.Query.ASCENDING
+        try:
+            docs = list(query.order_by(order_field, direction=direction).limit(limit).stream())
+            _missing_indexes.pop(index_name, None)
+            return docs
+        except FailedPrecondition as e:
+            _missing_indexes[index_name] = time.time()
+            print(f"⚠️ Missing Firestore index '{index_name}', sorting in Python (see firestore.indexes.json.example): {e}")
+
+    docs = list(query.stream())
+    docs.sort(key=lambda doc: _sort_key(doc.to_dict().get(order_field)), reverse=descending)
+    return docs[:limit]
+
+
+# ============================================================================
+# KEYSET PAGINATION
+# ============================================================================
+
+def encode_cursor(created_at, doc_id):
+    """Opaque page cursor for the last document of a page."""
+    value = created_at.isoformat() if hasattr(created_at, 'isoformat') else created_at
+    raw = json.dumps({'t': value, 'id': doc_id}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns (created_at, doc_id); raises ValueError for a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data['t']), data['id']
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def parse_page_size(limit_param, default=DEFAULT_PAGE_SIZE):
+    """Clamps a `limit=` query parameter to 1..MAX_PAGE_SIZE."""
+    try:
+        limit = int(limit_param) if limit_param else default
+    except ValueError:
+        limit = default
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def parse_fields(fields_param, required=()):
+    """Turns a `fields=a,b,c` query parameter into a select() list (None = all fields)."""
+    if not fields_param:
+        return None
+    fields = [f.strip() for f in fields_param.split(',') if f.strip()]
+    return list(dict.fromkeys(fields + list(required)))
+
+
+def fs_page(query, limit, cursor=None, fields=None, order_field='createdAt'):
+    """One page of `query`, newest first, keyed on (order_field, document id).
+
+    Returns (docs, next_cursor); next_cursor is None on the last page. Documents
+    without `order_field` are not returned, as with any Firestore order_by().
+    """
+    query = query.order_by(order_field, direction=gcfirestore.Query.DESCENDING)
+    query = query.order_by(gcfirestore.FieldPath.document_id(), direction=gcfirestore.Query.DESCENDING)
+    if fields is not None:
+        query = query.select(fields)
+    if cursor:
+        created_at, doc_id = decode_cursor(cursor)
+        query = query.start_after([created_at, doc_id])
+    # One extra document tells us whether another page exists
+    docs = list(query.limit(limit + 1).stream())
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    last = docs[-1]
+    return docs, encode_cursor(last.to_dict().get(order_field), last.id)
+
+
+def fs_page_matching(query, matches, limit, cursor=None, fields=None, order_field='createdAt', max_scan=None):
+    """fs_page() filtered in Python by `matches(data)`, reading `query` in MAX_PAGE_SIZE pages.
+
+    With `max_scan`, stops after reading that many documents and returns the
+    matches so far with a cursor to continue from, so a page may come back short.
+    """
+    found, scanned = [], 0
+    while True:
+        docs, next_cursor = fs_page(query, MAX_PAGE_SIZE, cursor, fields, order_field)
+        for position, doc in enumerate(docs, 1):
+            scanned += 1
+            if matches(doc.to_dict() or {}):
+                found.append(doc)
+                # One match past the page tells us whether another page exists
+                if len(found) > limit:
+                    last = found[limit - 1]
+                    return found[:limit], encode_cursor(last.to_dict().get(order_field), last.id)
+            if max_scan and scanned >= max_scan:
+                more = position < len(docs) or next_cursor is not None
+                return found, encode_cursor(doc.to_dict().get(order_field), doc.id) if more else None
+        if next_cursor is None:
+            return found, None
+        cursor = next_cursor
+
+
+def fs_page_filtered(query, base_query, matches, limit, cursor, index_name, fields=None, order_field='createdAt'):
+    """fs_page() for a filtered query whose composite index may be missing.
+
+    `query` is `base_query` plus equality/in filters, and `matches(data)` applies
+    the same filters in Python. If the index is missing (FailedPrecondition),
+    `base_query` is paged on its single-field index instead and filtered with
+    `matches`, with a warning; `index_name` is retried as in fs_top().
+    """
+    missing_since = _missing_indexes.get(index_name)
+    if missing_since is None or time.time() - missing_since > MISSING_INDEX_RETRY_SECONDS:
+        try:
+            page = fs_page(query, limit, cursor, fields, order_field)
+            _missing_indexes.pop(index_name, None)
+            return page
+        except FailedPrecondition as e:
+            _missing_indexes[index_name] = time.time()
+            print(f"⚠️ Missing Firestore index '{index_name}', filtering in Python (see firestore.indexes.json.example): {e}")
+    return fs_page_matching(base_query, matches, limit, cursor, fields, order_field)
+
+
+def fs_task_page(db, limit, cursor=None, fields=None, status=None, search=None):
+    """One page of the admin task list, newest first: (docs, next_cursor).
+
+    `status` is filtered in Firestore (tasks status + createdAt index). `search`
+    is a case-insensitive substring match on TASK_SEARCH_FIELDS, which Firestore
+    cannot do, so tasks are scanned and matched in Python, at most
+    SEARCH_SCAN_LIMIT per call; such a page may be short and still have a cursor.
+    """
+    tasks = db.collection('tasks')
+    if fields is not None:
+        fields = list(dict.fromkeys(list(fields) + ['status'] + (list(TASK_SEARCH_FIELDS) if search else [])))
+    if search:
+        needle = search.lower()
+
+        def matches(data):
+            return ((not status or data.get('status') == status) and
+                    any(needle in str(data.get(field) or '').lower() for field in TASK_SEARCH_FIELDS))
+
+        return fs_page_matching(tasks, matches, limit, cursor, fields, max_scan=SEARCH_SCAN_LIMIT)
+    if status:
+        tasks = fs_filter(tasks, 'status', '==', status)
+    return fs_page(tasks, limit, cursor, fields)
@@ -0,0 +1,229 @@
+# ingest.py
+"""
+Single-pass upload ingest for /upload/image and /complete_task.
+
+IngestRequest makes werkzeug's multipart parser write file parts straight into
+an IngestFile: a temp file next to the media folders that hashes (sha256) the
+bytes as they arrive, sniffs the real type from the first bytes and aborts the
+upload as soon as a per-type size limit is exceeded. finish() then checks the
+pixel count from the image header and hands the temp file to the media store
+(hash-named blob + hard link, see media_store.py), so an upload is read from
+the socket once and never copied. Nothing but the header is held in memory;
+the caption job later reads the file from disk, which keeps queued jobs small.
+"""
+import hashlib
+import os
+import tempfile
+import time
+import uuid
+
+from flask import Request
+from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+import media_store
+
+MAX_IMAGE_BYTES = int(os.environ.get('INGEST_MAX_IMAGE_MB', 25)) * 1024 * 1024
+MAX_VIDEO_BYTES = int(os.environ.get('INGEST_MAX_VIDEO_MB', 200)) * 1024 * 1024
+MAX_IMAGE_PIXELS = int(os.environ.get('INGEST_MAX_IMAGE_MEGAPIXELS', 50)) * 1000 * 1000
+INCOMING_DIR = os.environ.get('INGEST_TMP_DIR', os.path.join('uploads', '.incoming'))
+# Whole request: the largest file plus room for the form fields
+MAX_CONTENT_LENGTH = max(MAX_IMAGE_BYTES, MAX_VIDEO_BYTES) + 1024 * 1024
+# Routes whose file parts are streamed through IngestFile
+INGEST_PATHS = {'/upload/image', '/complete_task'}
+
+# Pillow refuses to decode anything larger (decompression bomb guard for every decode in the process)
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+SNIFF_BYTES = 16
+IMAGE_KINDS = {'jpeg': 'jpg', 'png': 'png'}
+VIDEO_KINDS = {'mp4': 'mp4', 'mov': 'mov', 'avi': 'avi', 'mkv': 'mkv'}
+# ISO base media files (ftyp box) by major brand. HEIC/AVIF photos use the same
+# container but cannot be decoded here, so they are recognised and rejected.
+MP4_BRANDS = {b'isom', b'iso2', b'iso4', b'iso5', b'iso6', b'mp41', b'mp42', b'avc1', b'M4V ', b'M4VH', b'M4VP',
+              b'3gp4', b'3gp5', b'3gp6', b'3g2a', b'dash', b'MSNV', b'f4v '}
+MOV_BRANDS = {b'qt  '}
+HEIF_BRANDS = {b'heic', b'heix', b'hevc', b'hevx', b'heim', b'heis', b'mif1', b'msf1', b'avif', b'avis'}
+UNSUPPORTED_MESSAGES = {
+    'heif': 'HEIC/AVIF photos are not supported; please upload a JPEG or PNG (set the camera to "Most Compatible")',
+}
+DEFAULT_UNSUPPORTED_MESSAGE = 'File is not a supported image or video (png, jpg, mp4, mov, avi, mkv)'
+
+
+class IngestError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def sniff(head):
+    """Media kind from the first bytes ('jpeg', 'png', 'mp4', 'mov', 'avi', 'mkv'), 'heif', or None."""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in MOV_BRANDS:
+            return 'mov'
+        if brand in MP4_BRANDS:
+            return 'mp4'
+        if brand in HEIF_BRANDS:
+            return 'heif'
+        return None
+    if head.startswith(b'RIFF') and head[8:12] == b'AVI ':
+        return 'avi'
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'mkv'
+    return None
+
+
+def _limit_for(kind):
+    if kind is None:
+        return max(MAX_IMAGE_BYTES, MAX_VIDEO_BYTES)
+    return MAX_IMAGE_BYTES if kind in IMAGE_KINDS else MAX_VIDEO_BYTES
+
+
+class IngestFile:
+    """Writable temp file used as werkzeug's multipart stream; hashes, sniffs and size-checks while writing."""
+
+    def __init__(self, directory=INCOMING_DIR):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+        self.kind = None
+
+    def write(self, data):
+        self.size += len(data)
+        if len(self.head) < SNIFF_BYTES:
+            self.head += bytes(data[:SNIFF_BYTES - len(self.head)])
+            if len(self.head) >= SNIFF_BYTES:
+                self.kind = sniff(self.head)
+                if self.kind not in IMAGE_KINDS and self.kind not in VIDEO_KINDS:
+                    self.discard()
+                    raise UnsupportedMediaType(UNSUPPORTED_MESSAGES.get(self.kind, DEFAULT_UNSUPPORTED_MESSAGE))
+        if self.size > _limit_for(self.kind):
+            self.discard()
+            raise RequestEntityTooLarge(f'File exceeds the {_limit_for(self.kind) // (1024 * 1024)} MB limit')
+        self._sha256.update(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+    def move_to(self, path):
+        self._file.close()
+        media_store.put(self.path, self.sha256, path)
+        self.path = None
+
+    def discard(self):
+        self._file.close()
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+    def close(self):
+        # Called by werkzeug at the end of the request; a part that was not moved into place is deleted
+        self.discard()
+
+    def __getattr__(self, name):
+        # seek/read/tell/flush etc. for FileStorage
+        return getattr(self._file, name)
+
+
+class IngestRequest(Request):
+    """Flask request class that streams file parts of INGEST_PATHS into IngestFile."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.path in INGEST_PATHS:
+            return IngestFile()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+
+class IngestResult:
+    def __init__(self, path, filename, kind, size, sha256):
+        self.path = path
+        self.filename = filename
+        self.kind = kind
+        self.size = size
+        self.sha256 = sha256
+
+    @property
+    def is_video(self):
+        return self.kind in VIDEO_KINDS
+
+
+def _as_ingest_file(file_storage):
+    """The upload as an IngestFile; copies in chunks if the request class did not stream it."""
+    if isinstance(file_storage.stream, IngestFile):
+        return file_storage.stream
+    ingest_file = IngestFile()
+    try:
+        for chunk in iter(lambda: file_storage.stream.read(64 * 1024), b''):
+            ingest_file.write(chunk)
+    except Exception:
+        ingest_file.discard()
+        raise
+    return ingest_file
+
+
+def finish(file_storage, directory, name_prefix=''):
+    """Validates an upload and moves it into `directory` as <prefix><uuid>.<real extension>.
+
+    Raises IngestError (with an HTTP status) for unsupported, oversized or empty files.
+    """
+    try:
+        ingest_file = _as_ingest_file(file_storage)
+    except (RequestEntityTooLarge, UnsupportedMediaType) as e:
+        raise IngestError(e.description, e.code)
+    kind = ingest_file.kind or sniff(ingest_file.head)
+    if kind not in IMAGE_KINDS and kind not in VIDEO_KINDS:
+        ingest_file.discard()
+        if kind in UNSUPPORTED_MESSAGES:
+            raise IngestError(UNSUPPORTED_MESSAGES[kind], 415)
+        raise IngestError('File is empty or not a supported image or video', 415 if ingest_file.size else 400)
+
+    if kind in IMAGE_KINDS:
+        # Header only; no pixels are decoded here
+        try:
+            ingest_file.flush()
+            with Image.open(ingest_file.path) as image:
+                width, height = image.size
+        except Image.DecompressionBombError as e:
+            ingest_file.discard()
+            raise IngestError(str(e), 413)
+        except Exception as e:
+            ingest_file.discard()
+            raise IngestError(f'Unreadable image: {e}', 400)
+        if width * height > MAX_IMAGE_PIXELS:
+            ingest_file.discard()
+            raise IngestError(f'Image is {width}x{height}; at most {MAX_IMAGE_PIXELS // 1000000} megapixels are accepted', 413)
+
+    extension = IMAGE_KINDS.get(kind) or VIDEO_KINDS[kind]
+    filename = f'{name_prefix}{uuid.uuid4()}.{extension}'
+    path = os.path.join(directory, filename)
+    ingest_file.move_to(path)
+    return IngestResult(path, filename, kind, ingest_file.size, ingest_file.sha256)
+
+
+def remove_stale_parts(max_age_seconds=3600):
+    """Deletes temp files left behind by crashed requests."""
+    if not os.path.isdir(INCOMING_DIR):
+        return 0
+    removed = 0
+    cutoff = time.time() - max_age_seconds
+    for entry in os.scandir(INCOMING_DIR):
+        if entry.name.endswith('.part') and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
@@ -0,0 +1,270 @@
+# media_catalog.py
+"""
+SQLite index of the files in uploads/, processed/ and completed/.
+
+Rows are written when media is stored (record) or deleted (remove), and
+reconcile() brings the table in line with the folders using one os.scandir
+pass (at startup, or `python media_catalog.py reconcile`). Per-folder totals
+are kept in a separate table by triggers, so storage totals are a three-row
+read. The file is shared by app.py and admin_server.py (WAL mode).
+
+Ages (gallery "modified", sort, cleanup) come from `added`, the time each
+logical file was written. The inode mtime cannot be used: a deduplicated
+upload is a hard link to an existing blob (media_store.py) and carries the
+mtime of whichever upload first stored those bytes.
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+MEDIA_CATALOG_DB = os.environ.get('MEDIA_CATALOG_DB', os.path.join(CURRENT_SCRIPT_DIR, 'media_catalog.sqlite3'))
+MEDIA_FOLDERS = ('uploads', 'processed', 'completed')
+VIDEO_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv'}
+SORT_COLUMNS = {'modified': 'added', 'size': 'size', 'filename': 'filename'}
+DEFAULT_PAGE_SIZE = 60
+MAX_PAGE_SIZE = 500
+# Bumped when the table layout changes; the catalog is then rebuilt from the folders
+SCHEMA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    folder TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    added REAL NOT NULL,
+    type TEXT NOT NULL,
+    PRIMARY KEY (folder, filename)
+);
+CREATE INDEX IF NOT EXISTS media_added ON media (added);
+CREATE INDEX IF NOT EXISTS media_type_added ON media (type, added);
+CREATE INDEX IF NOT EXISTS media_folder_added ON media (folder, added);
+CREATE TABLE IF NOT EXISTS media_totals (
+    folder TEXT PRIMARY KEY,
+    files INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0
+);
+CREATE TRIGGER IF NOT EXISTS media_insert AFTER INSERT ON media BEGIN
+    INSERT OR IGNORE INTO media_totals (folder) VALUES (NEW.folder);
+    UPDATE media_totals SET files = files + 1, bytes = bytes + NEW.size WHERE folder = NEW.folder;
+END;
+CREATE TRIGGER IF NOT EXISTS media_delete AFTER DELETE ON media BEGIN
+    UPDATE media_totals SET files = files - 1, bytes = bytes - OLD.size WHERE folder = OLD.folder;
+END;
+CREATE TRIGGER IF NOT EXISTS media_update AFTER UPDATE OF size ON media BEGIN
+    UPDATE media_totals SET bytes = bytes - OLD.size + NEW.size WHERE folder = NEW.folder;
+END;
+"""
+
+_lock = threading.Lock()
+_db = None
+
+
+def media_type(filename):
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return 'video' if ext in VIDEO_EXTENSIONS else 'image'
+
+
+def _open_db():
+    # Caller holds _lock
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(MEDIA_CATALOG_DB, check_same_thread=False, timeout=10)
+        _db.execute('PRAGMA journal_mode=WAL')
+        if _db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            _db.executescript('DROP TABLE IF EXISTS media; DROP TABLE IF EXISTS media_totals;')
+            _db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        _db.executescript(_SCHEMA)
+        _db.commit()
+    return _db
+
+
+def _upsert(db, folder, filename, size, mtime, added, replace_added=False):
+    # A row's added time only changes when the logical file is written again (record)
+    db.execute(
+        'INSERT INTO media (folder, filename, size, mtime, added, type) VALUES (?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT (folder, filename) DO UPDATE SET size = excluded.size, mtime = excluded.mtime'
+        + (', added = excluded.added' if replace_added else ''),
+        (folder, filename, size, mtime, added, media_type(filename))
+    )
+
+
+def _discovered_time(stat):
+    # For files reconcile() finds without a record() call. Adding a hard link updates
+    # the inode's ctime, so this is never older than the newest link to the blob.
+    return max(stat.st_mtime, stat.st_ctime)
+
+
+# ============================================================================
+# WRITES
+# ============================================================================
+
+def record(folder, path):
+    """Adds or refreshes the row for a media file that was just written."""
+    try:
+        stat = os.stat(path)
+        with _lock:
+            db = _open_db()
+            _upsert(db, folder, os.path.basename(path), stat.st_size, stat.st_mtime, time.time(), replace_added=True)
+            db.commit()
+    except Exception as e:
+        # The next reconcile() picks the file up
+        print(f"⚠️ Media catalog update failed for {path}: {e}")
+
+
+def remove(folder, filename):
+    try:
+        with _lock:
+            db = _open_db()
+            db.execute('DELETE FROM media WHERE folder = ? AND filename = ?', (folder, filename))
+            db.commit()
+    except Exception as e:
+        print(f"⚠️ Media catalog delete failed for {folder}/{filename}: {e}")
+
+
+def reconcile(folder_paths=None):
+    """Syncs the table with the folders (one os.scandir per folder). Returns (added/updated, removed)."""
+    folder_paths = folder_paths or {folder: folder for folder in MEDIA_FOLDERS}
+    started = time.time()
+    changed = removed = 0
+    for folder, folder_path in folder_paths.items():
+        on_disk = {}
+        if os.path.isdir(folder_path):
+            for entry in os.scandir(folder_path):
+                if entry.is_file() and not entry.name.startswith('.'):
+                    stat = entry.stat()
+                    on_disk[entry.name] = stat
+        with _lock:
+            db = _open_db()
+            known = {row[0]: (row[1], row[2], row[3]) for row in
+                     db.execute('SELECT filename, size, mtime, added FROM media WHERE folder = ?', (folder,))}
+            for filename, stat in on_disk.items():
+                if known.get(filename, ())[:2] != (stat.st_size, stat.st_mtime):
+                    _upsert(db, folder, filename, stat.st_size, stat.st_mtime, _discovered_time(stat))
+                    changed += 1
+            # Rows added after the scan started may belong to files written while it ran
+            stale = [(folder, filename) for filename, (_, _, added) in known.items()
+                     if filename not in on_disk and added < started]
+            db.executemany('DELETE FROM media WHERE folder = ? AND filename = ?', stale)
+            removed += len(stale)
+            db.commit()
+    print(f"🗂️ Media catalog reconciled in {time.time() - started:.1f}s: {changed} added/updated, {removed} removed")
+    return changed, removed
+
+
+def start_reconcile(folder_paths=None):
+    """Runs reconcile() on a background thread so startup is not delayed."""
+    def _target():
+        try:
+            reconcile(folder_paths)
+        except Exception as e:
+            print(f"⚠️ Media catalog reconcile failed: {e}")
+    threading.Thread(target=_target, name='media-catalog-reconcile', daemon=True).start()
+
+
+# ============================================================================
+# READS
+# ============================================================================
+
+def _where(folder=None, kind=None, before=None):
+    clauses, params = [], []
+    if folder:
+        clauses.append('folder = ?')
+        params.append(folder)
+    if kind:
+        clauses.append('type = ?')
+        params.append(kind)
+    if before is not None:
+        clauses.append('added < ?')
+        params.append(before)
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+def page(folder=None, kind=None, sort='modified', descending=True, limit=DEFAULT_PAGE_SIZE, offset=0):
+    """One page of catalog rows as dicts, plus the number of rows matching the filters."""
+    column = SORT_COLUMNS.get(sort, 'mtime')
+    direction = 'DESC' if descending else 'ASC'
+    where, params = _where(folder, kind)
+    with _lock:
+        db = _open_db()
+        rows = db.execute(
+            f'SELECT folder, filename, size, added, type FROM media{where} '
+            f'ORDER BY {column} {direction}, folder {direction}, filename {direction} LIMIT ? OFFSET ?',
+            params + [limit, offset]
+        ).fetchall()
+        if folder and not kind:
+            total = db.execute('SELECT files FROM media_totals WHERE folder = ?', (folder,)).fetchone()
+            total = total[0] if total else 0
+        elif folder or kind:
+            total = db.execute(f'SELECT COUNT(*) FROM media{where}', params).fetchone()[0]
+        else:
+            total = db.execute('SELECT COALESCE(SUM(files), 0) FROM media_totals').fetchone()[0]
+    items = [{
+        'folder': folder_name,
+        'filename': filename,
+        'size': size,
+        'type': kind_name,
+        'extension': filename.rsplit('.', 1)[-1].lower() if '.' in filename else '',
+        'modified': datetime.fromtimestamp(added).isoformat()
+    } for folder_name, filename, size, added, kind_name in rows]
+    return items, total
+
+
+def totals():
+    """{'files', 'bytes', 'byFolder'} from the trigger-maintained totals table."""
+    with _lock:
+        rows = _open_db().execute('SELECT folder, files, bytes FROM media_totals').fetchall()
+    by_folder = {folder: {'files': files, 'bytes': size} for folder, files, size in rows}
+    return {
+        'files': sum(f['files'] for f in by_folder.values()),
+        'bytes': sum(f['bytes'] for f in by_folder.values()),
+        'byFolder': by_folder
+    }
+
+
+def gallery(args, base_url):
+    """Response body for /admin/media_gallery from its query parameters.
+
+    folder, type (image|video), sort (modified|size|filename), order (asc|desc),
+    limit and offset. total is the number of files matching the filters.
+    """
+    folder = args.get('folder') if args.get('folder') in MEDIA_FOLDERS else None
+    kind = args.get('type') if args.get('type') in ('image', 'video') else None
+    try:
+        limit = max(1, min(int(args.get('limit') or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+        offset = max(0, int(args.get('offset') or 0))
+    except ValueError:
+        limit, offset = DEFAULT_PAGE_SIZE, 0
+    items, total = page(folder, kind, args.get('sort', 'modified'), args.get('order', 'desc') != 'asc', limit, offset)
+    for item in items:
+        item['url'] = f"{base_url}/{item['folder']}/{item['filename']}"
+    storage = totals()
+    return {
+        'media': items,
+        'total': total,
+        'totalSize': storage['bytes'],
+        'totalFiles': storage['files'],
+        'nextOffset': offset + len(items) if offset + len(items) < total else None
+    }
+
+
+def older_than(cutoff_timestamp):
+    """(folder, filename) of files written before the cutoff (index range scan on added)."""
+    where, params = _where(before=cutoff_timestamp)
+    with _lock:
+        return _open_db().execute(f'SELECT folder, filename FROM media{where}', params).fetchall()
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'totals'
+    if command == 'reconcile':
+        reconcile()
+    elif command == 'totals':
+        print(totals())
+    else:
+        print('usage: python media_catalog.py reconcile|totals')
+        sys.exit(1)
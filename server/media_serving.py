@@ -0,0 +1,108 @@
+# media_serving.py
+"""
+Serving of the /uploads, /processed and /completed media routes.
+
+Media files never change once written (uuid names, see ingest.py), so they are
+sent with a strong ETag built from the file's inode, size and mtime, and
+`Cache-Control: immutable` with a one-year max-age. Conditional requests and
+byte ranges (Range / If-Range, 206 and 416) are handled by werkzeug's
+send_file(conditional=True), which the video player relies on for seeking.
+
+MEDIA_SENDFILE=x-accel  hand the bytes to nginx with X-Accel-Redirect
+                        (MEDIA_ACCEL_PREFIX must map to an `internal` location
+                        aliasing the server directory)
+MEDIA_SENDFILE=x-sendfile  let Apache/lighttpd send the file (X-Sendfile)
+"""
+import mimetypes
+import os
+import stat as stat_mode
+
+from flask import jsonify, request, send_file, make_response
+
+import derivatives
+
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE', '').lower()
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media').rstrip('/')
+MEDIA_MAX_AGE = 365 * 24 * 3600
+CACHE_CONTROL = f'public, max-age={MEDIA_MAX_AGE}, immutable'
+
+# Types mimetypes may not know on every platform
+_CONTENT_TYPES = {'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp',
+                  'mp4': 'video/mp4', 'mov': 'video/quicktime', 'avi': 'video/x-msvideo', 'mkv': 'video/x-matroska'}
+
+
+def content_type(filename):
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return _CONTENT_TYPES.get(ext) or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def strong_etag(stat):
+    """Identifies the bytes of an immutable file without reading it."""
+    return f'{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}'
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return stat if stat_mode.S_ISREG(stat.st_mode) else None
+
+
+def _cors(response):
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, Range'
+    response.headers['Access-Control-Expose-Headers'] = 'Content-Length, Content-Range, Accept-Ranges, ETag'
+    return response
+
+
+def _send(path, stat, mimetype):
+    etag = strong_etag(stat)
+    if MEDIA_SENDFILE == 'x-accel':
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            # nginx streams the file and answers Range requests itself
+            response = make_response('')
+            response.headers['X-Accel-Redirect'] = f"{MEDIA_ACCEL_PREFIX}/{os.path.relpath(path).replace(os.sep, '/')}"
+            response.headers['Content-Type'] = mimetype
+        response.set_etag(etag)
+    else:
+        # Flask turns this into an X-Sendfile header when USE_X_SENDFILE is set
+        response = send_file(os.path.abspath(path), mimetype=mimetype, conditional=True, etag=etag,
+                             last_modified=stat.st_mtime, max_age=MEDIA_MAX_AGE)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return _cors(response)
+
+
+def send_media(folder_name, folder_path, filename):
+    """Response for /<folder_name>/<filename>, or a resized copy with ?size=thumb|medium|poster."""
+    if filename.startswith('.') or '/' in filename or '\\' in filename:
+        return jsonify({'error': 'File not found'}), 404
+    file_path = os.path.join(folder_path, filename)
+    stat = _stat(file_path)
+    if stat is None:
+        return jsonify({'error': 'File not found'}), 404
+
+    size = request.args.get('size', 'original')
+    if size == 'original':
+        return _send(file_path, stat, content_type(filename))
+
+    if size not in derivatives.all_sizes(filename):
+        return jsonify({'error': f"Unknown size '{size}'", 'sizes': ['original'] + derivatives.all_sizes(filename)}), 400
+    derivative = derivatives.get(folder_name, file_path, size, request.headers.get('Accept', ''))
+    if derivative is None:
+        return jsonify({'error': 'Preview not available'}), 404
+    path, mimetype = derivative
+    response = _send(path, os.stat(path), mimetype)
+    response.headers['Vary'] = 'Accept'
+    return response
+
+
+def configure(app):
+    """Applies MEDIA_SENDFILE to the Flask app."""
+    if MEDIA_SENDFILE == 'x-sendfile':
+        app.config['USE_X_SENDFILE'] = True
+    if MEDIA_SENDFILE:
+        print(f"📦 Media bytes are sent by the front proxy ({MEDIA_SENDFILE})")
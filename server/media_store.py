@@ -0,0 +1,194 @@
+# media_store.py
+"""
+Content-addressed storage for uploaded media.
+
+Every file's bytes are kept once as a blob named by its sha256, sharded as
+media_store/ab/cd/abcd....  The files under uploads/, processed/ and completed/
+are hard links to those blobs, so the existing URLs, send_from_directory()
+and folder scans keep working unchanged while identical bytes (re-uploads,
+the processed copy of an upload) share one inode. A blob's link count is its
+reference count; gc() deletes blobs nothing links to any more.
+
+Where hard links are not possible (e.g. the store on another filesystem) files
+are copied instead, with a warning.
+
+A path in the media folders may share its bytes with other files, so it is
+never opened for writing: new content is written to a temp file and renamed
+over it (write_new), which gives the path a new inode of its own.
+
+    python media_store.py migrate   # adopt existing media files, deduplicating them
+    python media_store.py gc        # delete unreferenced blobs
+    python media_store.py stats
+"""
+import hashlib
+import os
+import shutil
+import sys
+import threading
+
+MEDIA_STORE_DIR = os.environ.get('MEDIA_STORE_DIR', 'media_store')
+MEDIA_FOLDERS = ('uploads', 'processed', 'completed')
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_lock = threading.Lock()
+_stats = {'stored': 0, 'deduplicated': 0, 'linked': 0, 'copied': 0}
+_copy_warning_shown = False
+
+
+def blob_path(sha256):
+    return os.path.join(MEDIA_STORE_DIR, sha256[:2], sha256[2:4], sha256)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def write_new(dest_path, write):
+    """Calls write(tmp_path) and renames the result over dest_path; the temp file is removed on failure.
+
+    The temp name keeps dest_path's extension (Pillow picks the format from it)
+    and starts with a dot, so folder scans skip it.
+    """
+    directory, name = os.path.split(dest_path)
+    tmp_path = os.path.join(directory, f'.{os.getpid()}.{threading.get_ident()}.{name}')
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def link(src_path, dest_path):
+    """Gives the bytes of src_path a second name without copying them (copies if hard links are unavailable)."""
+    global _copy_warning_shown
+    try:
+        os.link(src_path, dest_path)
+        _count('linked')
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if not _copy_warning_shown:
+            print(f"⚠️ Hard links unavailable for media ({e}), copying files instead")
+            _copy_warning_shown = True
+        write_new(dest_path, lambda tmp_path: shutil.copyfile(src_path, tmp_path))
+        _count('copied')
+
+
+def put(tmp_path, sha256, dest_path):
+    """Moves a freshly written file into the store and links it as dest_path.
+
+    If a blob with the same hash exists the new bytes are dropped and dest_path
+    links to the existing blob.
+    """
+    blob = blob_path(sha256)
+    try:
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(tmp_path, blob)
+            _count('stored')
+        except FileExistsError:
+            _count('deduplicated')
+        link(blob, dest_path)
+    except OSError as e:
+        # No store available: keep the file as a plain file under its logical name
+        print(f"⚠️ Media store unavailable for {dest_path}: {e}")
+        os.replace(tmp_path, dest_path)
+        return
+    os.remove(tmp_path)
+
+
+def adopt(path):
+    """Brings an existing media file into the store; returns the bytes saved by deduplication."""
+    sha256 = file_sha256(path)
+    blob = blob_path(sha256)
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    try:
+        os.link(path, blob)
+        return 0
+    except FileExistsError:
+        pass
+    if os.path.samefile(path, blob):
+        return 0
+    # Same bytes already stored: swap the file for a link to the blob
+    size = os.path.getsize(path)
+    tmp_path = f'{path}.{os.getpid()}.link'
+    os.link(blob, tmp_path)
+    os.replace(tmp_path, path)
+    return size
+
+
+def _blobs():
+    if not os.path.isdir(MEDIA_STORE_DIR):
+        return
+    for shard in os.scandir(MEDIA_STORE_DIR):
+        if not shard.is_dir():
+            continue
+        for sub in os.scandir(shard.path):
+            if sub.is_dir():
+                yield from (entry for entry in os.scandir(sub.path) if entry.is_file())
+
+
+def gc():
+    """Deletes blobs that no logical file links to; returns (blobs removed, bytes freed)."""
+    removed = freed = 0
+    for entry in _blobs():
+        stat = entry.stat()
+        if stat.st_nlink <= 1:
+            try:
+                os.remove(entry.path)
+                removed += 1
+                freed += stat.st_size
+            except OSError:
+                pass
+    if removed:
+        print(f"🧹 Media store gc: removed {removed} unreferenced blobs ({freed} bytes)")
+    return removed, freed
+
+
+def get_stats():
+    """Counters since startup plus a scan of the blob directory."""
+    blobs = blob_bytes = references = 0
+    for entry in _blobs():
+        stat = entry.stat()
+        blobs += 1
+        blob_bytes += stat.st_size
+        references += stat.st_nlink - 1
+    with _lock:
+        counters = dict(_stats)
+    return dict(counters, blobs=blobs, blobBytes=blob_bytes, references=references, directory=MEDIA_STORE_DIR)
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    if command == 'migrate':
+        adopted = saved = 0
+        for folder in MEDIA_FOLDERS:
+            if not os.path.isdir(folder):
+                continue
+            for entry in os.scandir(folder):
+                if entry.is_file() and not entry.name.startswith('.'):
+                    saved += adopt(entry.path)
+                    adopted += 1
+        print(f"✅ Adopted {adopted} media files, {saved} bytes saved by deduplication")
+    elif command == 'gc':
+        removed, freed = gc()
+        print(f"✅ Removed {removed} blobs, freed {freed} bytes")
+    elif command == 'stats':
+        for key, value in get_stats().items():
+            print(f"{key}: {value}")
+    else:
+        print(__doc__)
+        sys.exit(1)
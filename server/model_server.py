@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Model Server - one long-lived process that owns the BLIP model
+Web workers send caption requests over a local socket, so N workers share
+one model copy and one micro-batching queue (see blip_processor.batcher)
+"""
+
+import io
+import os
+import queue
+import secrets
+import sys
+import threading
+import time
+from multiprocessing.connection import Listener, Client
+
+import blip_processor
+
+# Configuration
+# "unix:/path/to/socket" (Linux/macOS) or "host:port" (works everywhere, including Windows)
+MODEL_SERVER_ADDRESS = os.environ.get('MODEL_SERVER_ADDRESS', '127.0.0.1:6001')
+# Connection authkey (connections carry pickled data, so it must be secret). When not set,
+# the server generates one into MODEL_SERVER_AUTHKEY_FILE (mode 0600) and clients read it there.
+MODEL_SERVER_AUTHKEY = os.environ.get('MODEL_SERVER_AUTHKEY', '')
+MODEL_SERVER_AUTHKEY_FILE = (os.environ.get('MODEL_SERVER_AUTHKEY_FILE')
+                             or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_server.key'))
+# Requests admitted at once; more than this are answered 'busy' straight away
+MAX_PENDING = int(os.environ.get('MODEL_SERVER_MAX_PENDING', 16))
+REQUEST_TIMEOUT = float(os.environ.get('MODEL_SERVER_TIMEOUT', 60))
+BUSY_RETRIES = int(os.environ.get('MODEL_SERVER_BUSY_RETRIES', 3))
+# Images are downscaled before crossing the socket; BLIP resizes to 384px anyway
+IPC_MAX_SIDE = 1024
+
+
+class ModelServerError(blip_processor.ModelNotReadyError):
+    """Caption could not be obtained from the model server (unreachable, busy or timed out)."""
+
+
+def load_authkey(create=False):
+    """The connection authkey from MODEL_SERVER_AUTHKEY or the key file; `create` makes the file if missing."""
+    if MODEL_SERVER_AUTHKEY:
+        return MODEL_SERVER_AUTHKEY.encode()
+    path = MODEL_SERVER_AUTHKEY_FILE
+    if create and not os.path.exists(path):
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass  # Another process created it first
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+            print(f"🔑 Model Server: generated authkey in {path}")
+    if not os.path.isfile(path):
+        raise ModelServerError(f"No model server authkey: set MODEL_SERVER_AUTHKEY or start the model server to create {path}")
+    if os.name == 'posix' and os.stat(path).st_mode & 0o077:
+        raise ModelServerError(f"{path} is readable by other users; run chmod 600 {path}")
+    with open(path) as f:
+        key = f.read().strip()
+    if not key:
+        raise ModelServerError(f"{path} is empty")
+    return key.encode()
+
+
+def parse_address(address):
+    """Turns MODEL_SERVER_ADDRESS into a multiprocessing.connection address and family."""
+    if address.startswith('unix:'):
+        return address[len('unix:'):], 'AF_UNIX'
+    host, _, port = address.rpartition(':')
+    return (host or '127.0.0.1', int(port)), 'AF_INET'
+
+
+def encode_image(image_pil):
+    """JPEG-encodes a (downscaled) copy of the image for the socket."""
+    image = image_pil.convert('RGB')
+    if max(image.size) > IPC_MAX_SIDE:
+        image = image.copy()
+        image.thumbnail((IPC_MAX_SIDE, IPC_MAX_SIDE))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=95)
+    return buffer.getvalue()
+
+
+# ============================================================================
+# SERVER
+# ============================================================================
+
+_admission = threading.BoundedSemaphore(MAX_PENDING)
+_server_stats = {'requests': 0, 'captions': 0, 'busy': 0, 'expired': 0, 'errors': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key):
+    with _stats_lock:
+        _server_stats[key] += 1
+
+
+def _handle_caption(request):
+    if not _admission.acquire(blocking=False):
+        _count('busy')
+        return {'ok': False, 'error': 'busy', 'retryAfter': 0.5}
+    try:
+        if request.get('deadline') and time.time() > request['deadline']:
+            _count('expired')
+            return {'ok': False, 'error': 'expired'}
+        from PIL import Image
+        image = Image.open(io.BytesIO(request['image'])).convert('RGB')
+        caption = blip_processor.generate_caption(image)
+        _count('captions')
+        return {'ok': True, 'caption': caption}
+    except blip_processor.ModelNotReadyError as e:
+        return {'ok': False, 'error': 'not_ready', 'message': str(e)}
+    finally:
+        _admission.release()
+
+
+def _handle_status():
+    with _stats_lock:
+        stats = dict(_server_stats)
+    return {
+        'ok': True,
+        'model': blip_processor.get_model_status(),
+        'batching': blip_processor.get_batch_stats(),
+        'server': stats
+    }
+
+
+def _serve_connection(conn):
+    with conn:
+        while True:
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                return
+            _count('requests')
+            try:
+                if request.get('op') == 'caption':
+                    response = _handle_caption(request)
+                elif request.get('op') == 'status':
+                    response = _handle_status()
+                else:
+                    response = {'ok': False, 'error': 'unknown_op'}
+            except Exception as e:
+                _count('errors')
+                response = {'ok': False, 'error': 'internal', 'message': str(e)}
+            try:
+                conn.send(response)
+            except (EOFError, OSError):
+                # Client gave up (timeout) and closed the connection
+                return
+
+
+def serve(address=MODEL_SERVER_ADDRESS):
+    """Binds the socket, loads the model in the background and serves forever."""
+    authkey = load_authkey(create=True)
+    bind_address, family = parse_address(address)
+    if family == 'AF_UNIX' and os.path.exists(bind_address):
+        os.remove(bind_address)
+    listener = Listener(bind_address, family=family, authkey=authkey)
+    print(f"✅ Model Server listening on {address} (max pending {MAX_PENDING})")
+    blip_processor.start_background_load()
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            # Failed handshake (wrong authkey) or interrupted accept
+            print(f"⚠️ Model Server: rejected connection: {e}")
+            continue
+        threading.Thread(target=_serve_connection, args=(conn,), daemon=True).start()
+
+
+# ============================================================================
+# CLIENT (used by app.py when MODEL_SERVER_ADDRESS is set)
+# ============================================================================
+
+class ModelServerClient:
+    """Talks to the model server. Exposes the same caption API app.py uses from blip_processor."""
+
+    STATUS_TTL = 5  # seconds a readiness answer is reused
+
+    def __init__(self, address=MODEL_SERVER_ADDRESS, timeout=REQUEST_TIMEOUT):
+        self.address = address
+        self.timeout = timeout
+        self._connect_address, self._family = parse_address(address)
+        self._pool = queue.LifoQueue()
+        self._authkey = None
+        self._status = {'ready': False, 'status': 'unknown'}
+        self._status_checked = 0
+
+    def _connect(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            if self._authkey is None:
+                self._authkey = load_authkey()
+            return Client(self._connect_address, family=self._family, authkey=self._authkey)
+
+    def _call(self, request, timeout):
+        try:
+            conn = self._connect()
+        except Exception as e:
+            raise ModelServerError(f"Model server unreachable at {self.address}: {e}")
+        try:
+            conn.send(request)
+            if not conn.poll(timeout):
+                raise ModelServerError(f"Model server did not answer within {timeout}s")
+            response = conn.recv()
+        except ModelServerError:
+            conn.close()
+            raise
+        except Exception as e:
+            conn.close()
+            raise ModelServerError(f"Model server connection failed: {e}")
+        self._pool.put(conn)
+        return response
+
+    def generate_caption(self, image_pil):
+        """Captions one image on the model server, retrying briefly when it reports busy."""
+        request = {'op': 'caption', 'image': encode_image(image_pil), 'deadline': time.time() + self.timeout}
+        for attempt in range(BUSY_RETRIES + 1):
+            response = self._call(request, self.timeout)
+            if response.get('ok'):
+                return response['caption']
+            if response.get('error') == 'busy' and attempt < BUSY_RETRIES:
+                time.sleep(response.get('retryAfter', 0.5) * (attempt + 1))
+                continue
+            raise ModelServerError(f"Model server error: {response.get('error')} {response.get('message', '')}".strip())
+
+    def _refresh_status(self):
+        try:
+            response = self._call({'op': 'status'}, timeout=5)
+            self._status = dict(response['model'], batching=response.get('batching'), server=response.get('server'))
+        except ModelServerError as e:
+            self._status = {'ready': False, 'status': 'unreachable', 'error': str(e)}
+        self._status['remote'] = self.address
+        self._status_checked = time.time()
+        return self._status
+
+    def get_model_status(self):
+        if time.time() - self._status_checked > self.STATUS_TTL:
+            self._refresh_status()
+        return dict(self._status)
+
+    def is_model_ready(self):
+        return bool(self.get_model_status().get('ready'))
+
+    def get_batch_stats(self):
+        return self.get_model_status().get('batching')
+
+    def start_background_load(self, on_loaded=None, poll_interval=2, max_wait=300):
+        """Waits in the background for the server to report ready, then calls `on_loaded(ok)`."""
+        def _wait():
+            deadline = time.time() + max_wait
+            while time.time() < deadline:
+                if self._refresh_status().get('ready'):
+                    break
+                time.sleep(poll_interval)
+            if on_loaded:
+                on_loaded(bool(self._status.get('ready')))
+        threading.Thread(target=_wait, name='model-server-probe', daemon=True).start()
+
+
+if __name__ == '__main__':
+    print("="*60)
+    print("🌱 Garden App - Model Server")
+    print("="*60)
+    try:
+        serve(sys.argv[1] if len(sys.argv) > 1 else MODEL_SERVER_ADDRESS)
+    except ModelServerError as e:
+        print(f"❌ Model Server not started: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n🛑 Model Server stopped")
@@ -0,0 +1,260 @@
+# orphan_tasks.py
+"""
+Orphan tasks: open (not completed, including tasks with no status) tasks with no
+assignee, or assigned to staff that no longer exists or is deactivated. Both
+modes apply this rule (orphan_check).
+
+ORPHAN_TRACKING=scan         /admin/unassigned_tasks runs one pass over open tasks
+ORPHAN_TRACKING=incremental  a listener on `staff` flags tasks (orphaned=True) when a
+                             staff member is deleted or deactivated and clears the
+                             flag when they come back; task writes that set
+                             assignedTo flag or clear the task themselves
+                             (assignment_fields). The admin view is then a single
+                             indexed query on `orphaned`
+"""
+import os
+import threading
+
+from firebase_admin import firestore
+
+import task_stats
+from firestore_helpers import fs_filter
+
+ORPHAN_TRACKING = os.environ.get('ORPHAN_TRACKING', 'scan').lower()
+FIRESTORE_BATCH_LIMIT = 500
+# Firestore accepts at most 30 values in an 'in' filter
+MAX_IN_VALUES = 30
+
+
+def orphan_reason(assigned_to, staff_active=None):
+    if not assigned_to:
+        return 'No assignment'
+    if staff_active is False:
+        return f'Staff {assigned_to} is deactivated'
+    return f'Staff {assigned_to} not found'
+
+
+def orphan_check(assigned_to, staff_active):
+    """Orphan reason for a task assigned to `assigned_to`, or None if the assignee is valid.
+
+    staff_active maps every existing staff id to its `active` flag.
+    """
+    if not assigned_to or assigned_to not in staff_active:
+        return orphan_reason(assigned_to)
+    if not staff_active[assigned_to]:
+        return orphan_reason(assigned_to, False)
+    return None
+
+
+def _open_tasks(db, fields=None):
+    """(task_id, task_data) for every task that is not completed.
+
+    Queries `status in` the open statuses the task counters have seen, plus
+    status null/''/'unknown'. Firestore cannot match a missing field, so the
+    counters' 'unknown' count (missing, null or empty status) is compared with
+    what those queries found, and only if tasks are left over is the whole
+    collection scanned. Without seeded counters the collection is scanned too.
+    """
+    stats = task_stats.read_task_stats(db, rebuild_if_missing=False)
+    if stats is None:
+        yield from _scan_open_tasks(db, fields)
+        return
+    statuses = [status for status, count in stats['byStatus'].items()
+                if count > 0 and status not in ('completed', 'unknown')]
+    queries = [fs_filter(db.collection('tasks'), 'status', 'in', statuses[i:i + MAX_IN_VALUES])
+               for i in range(0, len(statuses), MAX_IN_VALUES)]
+    unknown_queries = [fs_filter(db.collection('tasks'), 'status', 'in', ['', 'unknown']),
+                       fs_filter(db.collection('tasks'), 'status', '==', None)]
+    for query in queries:
+        for doc in (query.select(fields) if fields else query).stream():
+            yield doc.id, doc.to_dict()
+    unknown_found = 0
+    for query in unknown_queries:
+        for doc in (query.select(fields) if fields else query).stream():
+            unknown_found += 1
+            yield doc.id, doc.to_dict()
+    if stats['byStatus'].get('unknown', 0) > unknown_found:
+        # Some tasks have no status field at all
+        for task_id, task_data in _scan_open_tasks(db, ['status'] + list(fields or [])):
+            if 'status' not in task_data:
+                yield task_id, task_data
+
+
+def _scan_open_tasks(db, fields=None):
+    # status != 'completed' in Firestore would also drop tasks without a status field
+    query = db.collection('tasks')
+    if fields:
+        query = query.select(fields)
+    for doc in query.stream():
+        task_data = doc.to_dict()
+        if task_data.get('status') != 'completed':
+            yield doc.id, task_data
+
+
+def staff_active(db):
+    """{staff_id: active} for all staff documents (only the active field is downloaded)."""
+    return {doc.id: doc.to_dict().get('active', True) for doc in db.collection('staff').select(['active']).stream()}
+
+
+def active_staff_ids(staff_active_map):
+    return {staff_id for staff_id, active in staff_active_map.items() if active}
+
+
+def find_orphans(db, tasks=None, staff_active_map=None):
+    """One pass over open tasks with dict lookups.
+
+    `tasks` is an optional iterable of (task_id, task_data), e.g. from the task
+    replica; by default open tasks are queried by status (_open_tasks).
+    Returns ([(task_id, task_data, reason)], ids of active staff).
+    """
+    if staff_active_map is None:
+        staff_active_map = staff_active(db)
+    if tasks is None:
+        tasks = _open_tasks(db)
+    orphans = []
+    for task_id, task_data in tasks:
+        if task_data.get('status') == 'completed':
+            continue
+        reason = orphan_check(task_data.get('assignedTo'), staff_active_map)
+        if reason:
+            orphans.append((task_id, task_data, reason))
+    return orphans, active_staff_ids(staff_active_map)
+
+
+def flagged_orphans(db):
+    """Open tasks carrying the orphaned flag (incremental mode)."""
+    query = fs_filter(db.collection('tasks'), 'orphaned', '==', True)
+    return [(doc.id, doc.to_dict(), doc.to_dict().get('orphanReason', 'Orphaned'))
+            for doc in query.stream() if doc.to_dict().get('status') != 'completed']
+
+
+# ============================================================================
+# INCREMENTAL FLAGGING
+# ============================================================================
+
+def _write_flags(db, refs, updates):
+    for i in range(0, len(refs), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for ref in refs[i:i + FIRESTORE_BATCH_LIMIT]:
+            batch.update(ref, updates)
+        batch.commit()
+    return len(refs)
+
+
+def flag_staff_tasks(db, staff_id, reason):
+    """Marks the open tasks of staff_id as orphaned."""
+    tasks = fs_filter(db.collection('tasks'), 'assignedTo', '==', staff_id).select(['status', 'orphaned']).stream()
+    refs = [doc.reference for doc in tasks if doc.to_dict().get('status') != 'completed' and not doc.to_dict().get('orphaned')]
+    count = _write_flags(db, refs, {'orphaned': True, 'orphanReason': reason, 'orphanedAt': firestore.SERVER_TIMESTAMP})
+    if count:
+        print(f"🧷 Flagged {count} open tasks of {staff_id} as orphaned ({reason})")
+    return count
+
+
+def clear_staff_flags(db, staff_id):
+    """Clears the orphaned flag on tasks of staff_id (staff restored or reactivated)."""
+    query = fs_filter(fs_filter(db.collection('tasks'), 'assignedTo', '==', staff_id), 'orphaned', '==', True)
+    refs = [doc.reference for doc in query.select([]).stream()]
+    count = _write_flags(db, refs, {'orphaned': False, 'orphanReason': firestore.DELETE_FIELD})
+    if count:
+        print(f"🧷 Cleared orphan flag on {count} tasks of {staff_id}")
+    return count
+
+
+def clear_flag_fields():
+    """Fields to merge into a task update that gives it a valid assignee."""
+    return {'orphaned': False, 'orphanReason': firestore.DELETE_FIELD}
+
+
+def assignment_fields(db, assigned_to, new_task=False):
+    """Orphan flag fields for a write that sets assignedTo (flagged if the assignee is invalid).
+
+    new_task: the fields go into a set() of a new document, so nothing is deleted.
+    In scan mode flags are not used and nothing is looked up.
+    """
+    reason = staff_orphan_watcher.check(db, assigned_to) if ORPHAN_TRACKING == 'incremental' else None
+    if reason:
+        return {'orphaned': True, 'orphanReason': reason, 'orphanedAt': firestore.SERVER_TIMESTAMP}
+    if new_task:
+        return {'orphaned': False} if ORPHAN_TRACKING == 'incremental' else {}
+    return clear_flag_fields()
+
+
+def reconcile(db):
+    """Full resync of the flags: one pass over open tasks and one over staff."""
+    active = staff_active(db)
+    should_flag, flagged = {}, set()
+    for task_id, task_data in _open_tasks(db, ['status', 'assignedTo', 'orphaned']):
+        reason = orphan_check(task_data.get('assignedTo'), active)
+        if reason:
+            should_flag[task_id] = reason
+        if task_data.get('orphaned'):
+            flagged.add(task_id)
+
+    tasks = db.collection('tasks')
+    to_flag = [tid for tid in should_flag if tid not in flagged]
+    to_clear = [tid for tid in flagged if tid not in should_flag]
+    ops = [(tid, {'orphaned': True, 'orphanReason': should_flag[tid], 'orphanedAt': firestore.SERVER_TIMESTAMP}) for tid in to_flag]
+    ops += [(tid, clear_flag_fields()) for tid in to_clear]
+    for i in range(0, len(ops), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for task_id, updates in ops[i:i + FIRESTORE_BATCH_LIMIT]:
+            batch.update(tasks.document(task_id), updates)
+        batch.commit()
+    print(f"🧷 Orphan flags reconciled: {len(should_flag)} orphaned ({len(to_flag)} flagged, {len(to_clear)} cleared)")
+
+
+class StaffOrphanWatcher:
+    """Listens to `staff` and flags/clears orphaned tasks on deletes and (de)activations."""
+
+    def __init__(self):
+        self._active = None  # staff_id -> active, filled by the initial snapshot
+        self._watch = None
+        self._db = None
+
+    def start(self, db):
+        self._db = db
+        threading.Thread(target=reconcile, args=(db,), name='orphan-reconcile', daemon=True).start()
+        self._watch = db.collection('staff').on_snapshot(self._on_snapshot)
+        print("👂 Orphan tracking: listening for staff deletes and deactivations")
+
+    def _on_snapshot(self, docs, changes, read_time):
+        if self._active is None:
+            # Initial snapshot; reconcile() handles the current state
+            self._active = {doc.id: doc.to_dict().get('active', True) for doc in docs}
+            return
+        for change in changes:
+            staff_id = change.document.id
+            was_active = self._active.get(staff_id)
+            if change.type.name == 'REMOVED':
+                self._active.pop(staff_id, None)
+                self._run(flag_staff_tasks, staff_id, orphan_reason(staff_id))
+                continue
+            is_active = change.document.to_dict().get('active', True)
+            self._active[staff_id] = is_active
+            if is_active and was_active is not True:
+                self._run(clear_staff_flags, staff_id)
+            elif not is_active and was_active is not False:
+                self._run(flag_staff_tasks, staff_id, orphan_reason(staff_id, False))
+
+    def check(self, db, assigned_to):
+        """orphan_check() against the listener's staff map (a staff read before its first snapshot)."""
+        active_map = self._active
+        if active_map is None:
+            if not assigned_to:
+                return orphan_reason(assigned_to)
+            doc = db.collection('staff').document(assigned_to).get(['active'])
+            active_map = {assigned_to: (doc.to_dict() or {}).get('active', True)} if doc.exists else {}
+        return orphan_check(assigned_to, active_map)
+
+    def _run(self, fn, *args):
+        # Writes happen off the listener thread so snapshot delivery is not blocked
+        def _target():
+            try:
+                fn(self._db, *args)
+            except Exception as e:
+                print(f"⚠️ Orphan tracking update failed for {args[0]}: {e}")
+        threading.Thread(target=_target, daemon=True).start()
+
+
+staff_orphan_watcher = StaffOrphanWatcher()
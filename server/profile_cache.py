@@ -0,0 +1,130 @@
+# profile_cache.py
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Profiles are re-read after this many seconds even without an invalidation
+# (bounds staleness for writes made by other processes or the Firebase console)
+PROFILE_CACHE_TTL = float(os.environ.get('PROFILE_CACHE_TTL_SECONDS', 60))
+PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', 2000))
+# Keep the cache coherent across processes with Firestore snapshot listeners
+PROFILE_CACHE_LISTENERS = os.environ.get('PROFILE_CACHE_LISTENERS', 'false').lower() == 'true'
+
+COLLECTIONS = ('staff', 'students')
+
+
+class ProfileCache:
+    """Read-through TTL + LRU cache for `staff` and `students` profile documents.
+
+    Missing documents are cached too (as None), since the login endpoints check
+    the other collection on every call. Entries are dropped on our own writes
+    via invalidate() and, optionally, by snapshot listeners. A read that was in
+    flight when its key was invalidated is returned but not cached.
+    """
+
+    def __init__(self, ttl=PROFILE_CACHE_TTL, max_size=PROFILE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (collection, doc_id) -> (expires_at, data or None)
+        self._stats = {name: {'hits': 0, 'misses': 0, 'invalidations': 0} for name in COLLECTIONS}
+        self._listeners = {}
+        self._versions = {name: 0 for name in COLLECTIONS}
+        # Bumped by invalidate() / clear(); a fetch only stores if they did not change meanwhile
+        self._generations = {}  # (collection, doc_id) -> n
+        self._clear_generations = {name: 0 for name in COLLECTIONS}
+
+    def get(self, db, collection, doc_id):
+        """Returns a copy of the profile document as a dict, or None if it does not exist."""
+        key = (collection, doc_id)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._stats[collection]['hits'] += 1
+                return dict(entry[1]) if entry[1] is not None else None
+            self._stats[collection]['misses'] += 1
+            generation = (self._generations.get(key, 0), self._clear_generations[collection])
+
+        doc = db.collection(collection).document(doc_id).get()
+        data = doc.to_dict() if doc.exists else None
+        with self._lock:
+            if (self._generations.get(key, 0), self._clear_generations[collection]) != generation:
+                # Invalidated while we were reading; the data may predate that write
+                return dict(data) if data is not None else None
+            self._entries[key] = (now + self.ttl, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return dict(data) if data is not None else None
+
+    def exists(self, db, collection, doc_id):
+        return self.get(db, collection, doc_id) is not None
+
+    def invalidate(self, collection, doc_id):
+        """Drops one cached profile; call after every write to it."""
+        key = (collection, doc_id)
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            if self._entries.pop(key, None) is not None:
+                self._stats[collection]['invalidations'] += 1
+
+    def clear(self, collection=None):
+        with self._lock:
+            for name in self._clear_generations:
+                if collection is None or name == collection:
+                    self._clear_generations[name] += 1
+            for key in [k for k in self._entries if collection is None or k[0] == collection]:
+                del self._entries[key]
+
+    # --- snapshot listeners ---
+
+    def start_listeners(self, db):
+        """Invalidates entries when profiles change in Firestore (any writer, any process)."""
+        for collection in COLLECTIONS:
+            if collection not in self._listeners:
+                self._listeners[collection] = db.collection(collection).on_snapshot(self._on_snapshot(collection))
+        print(f"👂 Profile cache listening for changes on {', '.join(COLLECTIONS)}")
+
+    def _on_snapshot(self, collection):
+        def callback(col_snapshot, changes, read_time):
+            for change in changes:
+                self.invalidate(collection, change.document.id)
+            self._versions[collection] += 1
+        return callback
+
+    def version(self, collection):
+        """Changes with every listener event on `collection`; None when it is not listened to."""
+        watch = self._listeners.get(collection)
+        # Watch has no public health flag; it sets _closed when the stream ends for good
+        if watch is None or getattr(watch, '_closed', False):
+            return None
+        return self._versions[collection]
+
+    def stop_listeners(self):
+        for watch in self._listeners.values():
+            watch.unsubscribe()
+        self._listeners = {}
+
+    def get_stats(self):
+        with self._lock:
+            stats = {}
+            for collection, counters in self._stats.items():
+                lookups = counters['hits'] + counters['misses']
+                stats[collection] = dict(
+                    counters,
+                    size=sum(1 for key in self._entries if key[0] == collection),
+                    hitRate=round(counters['hits'] / lookups, 3) if lookups else 0
+                )
+            return {
+                'collections': stats,
+                'ttlSeconds': self.ttl,
+                'maxSize': self.max_size,
+                'listeners': sorted(self._listeners)
+            }
+
+
+# Shared by all request threads of this process
+profile_cache = ProfileCache()
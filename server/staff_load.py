@@ -0,0 +1,212 @@
+# staff_load.py
+import heapq
+import itertools
+import os
+import threading
+import time
+
+import task_stats
+from firestore_helpers import fs_filter
+
+# Full rebuild interval; catches writes made outside this process (other workers, console edits)
+RESYNC_SECONDS = float(os.environ.get('STAFF_LOAD_RESYNC_SECONDS', 300))
+
+
+class StaffLoadIndex:
+    """In-memory pending-task counters per staff member with a min-heap for assignment.
+
+    Ordering matches the original full-scan strategy: fewest pending tasks first,
+    then staff with an FCM token. Heap entries are invalidated lazily, so every
+    update and every assignment is O(log n).
+    """
+
+    def __init__(self, resync_seconds=RESYNC_SECONDS):
+        self.resync_seconds = resync_seconds
+        self._lock = threading.Lock()
+        self._counts = {}     # staff_id -> pending task count
+        self._has_token = {}  # staff_id -> bool
+        self._heap = []
+        self._seq = itertools.count()
+        self._loaded_at = 0
+        # Serializes rebuilds; counter changes made while one reads Firestore are
+        # journaled and replayed onto the new counts so they are not lost
+        self._load_lock = threading.Lock()
+        self._journal = None  # staff_id -> count delta since the running load() started
+
+    # --- building ---
+
+    def _push(self, staff_id):
+        heapq.heappush(self._heap, (self._counts[staff_id], not self._has_token[staff_id], next(self._seq), staff_id))
+
+    def _rebuild_heap(self):
+        self._heap = []
+        for staff_id in self._counts:
+            self._push(staff_id)
+
+    def load(self, db):
+        """Rebuilds the index: one staff scan plus the task counters document.
+
+        Falls back to one query over pending tasks while the counters have not been built.
+        """
+        with self._load_lock:
+            self._load(db)
+
+    def _load(self, db):
+        # Caller holds _load_lock
+        started = time.perf_counter()
+        with self._lock:
+            self._journal = {}
+        try:
+            counts, has_token = self._read(db)
+        except Exception:
+            with self._lock:
+                self._journal = None
+            raise
+
+        with self._lock:
+            for staff_id, delta in self._journal.items():
+                if staff_id in counts:
+                    counts[staff_id] = max(0, counts[staff_id] + delta)
+            self._journal = None
+            self._counts, self._has_token = counts, has_token
+            self._rebuild_heap()
+            self._loaded_at = time.time()
+        print(f"📋 Staff load index built: {len(counts)} staff in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def _read(self, db):
+        counts, has_token = {}, {}
+        for staff_doc in db.collection('staff').stream():
+            counts[staff_doc.id] = 0
+            has_token[staff_doc.id] = 'fcmToken' in staff_doc.to_dict()
+
+        stats = task_stats.read_task_stats(db, rebuild_if_missing=False)
+        if stats is not None:
+            for staff_id in counts:
+                counts[staff_id] = max(0, task_stats.staff_counts(stats, staff_id)['pending'])
+        else:
+            pending = fs_filter(db.collection('tasks'), 'status', '==', 'pending').select(['assignedTo']).stream()
+            for task_doc in pending:
+                staff_id = task_doc.to_dict().get('assignedTo')
+                if staff_id in counts:
+                    counts[staff_id] += 1
+        return counts, has_token
+
+    def _is_stale(self):
+        return not self._loaded_at or time.time() - self._loaded_at > self.resync_seconds
+
+    def ensure_loaded(self, db):
+        if self._is_stale():
+            with self._load_lock:
+                # Another thread may have rebuilt it while we waited
+                if self._is_stale():
+                    self._load(db)
+
+    # --- assignment ---
+
+    def _pop_least_loaded(self):
+        while self._heap:
+            count, no_token, _, staff_id = self._heap[0]
+            if staff_id in self._counts and count == self._counts[staff_id] and no_token == (not self._has_token[staff_id]):
+                return staff_id
+            heapq.heappop(self._heap)  # stale entry
+        return None
+
+    def assign(self, db):
+        """Picks the least-loaded staff member and counts the new pending task against them."""
+        self.ensure_loaded(db)
+        with self._lock:
+            staff_id = self._pop_least_loaded()
+            if staff_id is None:
+                return None
+            load = self._counts[staff_id]
+            self._adjust(staff_id, 1)
+        print(f"📋 Assigning task to {staff_id} (current load: {load} tasks)")
+        return staff_id
+
+    def plan(self, db, task_ids):
+        """Plans assignments for many tasks against one snapshot of staff load.
+
+        Returns {task_id: staff_id}. Nothing is counted until commit_plan() is called
+        after the writes succeed.
+        """
+        self.ensure_loaded(db)
+        with self._lock:
+            heap = [(n, not self._has_token[sid], next(self._seq), sid) for sid, n in self._counts.items()]
+        if not heap:
+            return {}
+        heapq.heapify(heap)
+        plan = {}
+        for task_id in task_ids:
+            count, no_token, _, staff_id = heapq.heappop(heap)
+            plan[task_id] = staff_id
+            heapq.heappush(heap, (count + 1, no_token, next(self._seq), staff_id))
+        return plan
+
+    def commit_plan(self, staff_ids):
+        """Counts committed planned assignments (one entry per assigned task)."""
+        with self._lock:
+            for staff_id in staff_ids:
+                self._adjust(staff_id, 1)
+
+    def peek_loads(self):
+        """Returns (staff_id, pending, has_token) tuples for planning, least loaded first."""
+        with self._lock:
+            return sorted(((sid, n, self._has_token[sid]) for sid, n in self._counts.items()),
+                          key=lambda item: (item[1], not item[2]))
+
+    # --- incremental updates ---
+
+    def _adjust(self, staff_id, delta):
+        # Caller holds _lock
+        if self._journal is not None:
+            self._journal[staff_id] = self._journal.get(staff_id, 0) + delta
+        if staff_id not in self._counts:
+            return
+        self._counts[staff_id] = max(0, self._counts[staff_id] + delta)
+        self._push(staff_id)
+        # Keep the heap from growing without bound with stale entries
+        if len(self._heap) > 4 * len(self._counts) + 16:
+            self._rebuild_heap()
+
+    def task_added(self, staff_id):
+        """A pending task was assigned to staff_id without going through assign()."""
+        with self._lock:
+            self._adjust(staff_id, 1)
+
+    def task_completed(self, staff_id):
+        """A pending task assigned to staff_id was completed (or removed)."""
+        with self._lock:
+            self._adjust(staff_id, -1)
+
+    def task_reassigned(self, old_staff_id, new_staff_id, count=1):
+        """`count` pending tasks moved from old_staff_id to new_staff_id."""
+        if old_staff_id == new_staff_id:
+            return
+        with self._lock:
+            self._adjust(old_staff_id, -count)
+            self._adjust(new_staff_id, count)
+
+    def staff_updated(self, staff_id, has_token=None):
+        """Adds a new staff member or records a token change."""
+        with self._lock:
+            if not self._loaded_at:
+                return  # picked up by the first load
+            if staff_id not in self._counts:
+                self._counts[staff_id] = 0
+                self._has_token[staff_id] = bool(has_token)
+            elif has_token is not None:
+                self._has_token[staff_id] = has_token
+            self._push(staff_id)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'staff': len(self._counts),
+                'pending': sum(self._counts.values()),
+                'heapEntries': len(self._heap),
+                'loadedAt': self._loaded_at
+            }
+
+
+# Shared by all request threads of this process
+staff_load_index = StaffLoadIndex()
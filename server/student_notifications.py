@@ -0,0 +1,144 @@
+# student_notifications.py
+"""
+Student notification history: notifications/{register_number}/user_notifications.
+
+The parent notifications/{register_number} document carries an unread counter
+(COUNTER_FIELD), updated in the same commit as every notification write that
+changes it, so the app's badge refresh is one document read. Only the types
+the list shows by default (DEFAULT_TYPES) are counted, so the badge never
+includes notes the student cannot see. Histories written before the counter
+existed are counted once (count() aggregation) on first read.
+"""
+from datetime import timezone
+
+from firebase_admin import firestore
+
+import bulk_writes
+from firestore_helpers import fs_filter, fs_count, fs_page_filtered
+
+NOTIFICATION_TYPES = ('task_completed', 'test_notification', 'thank_you')
+# Shown when no type is requested; thank-you notes duplicate the task_completed entry
+DEFAULT_TYPES = ('task_completed', 'test_notification')
+# Unread DEFAULT_TYPES notifications (renamed from unreadCount, which also counted thank-you notes)
+COUNTER_FIELD = 'unreadListedCount'
+# Firestore accepts at most 30 values in an 'in' filter
+MAX_TYPES = 30
+DEFAULT_LIMIT = 50
+
+
+def _parent(db, register_number):
+    return db.collection('notifications').document(register_number)
+
+
+def _collection(db, register_number):
+    return _parent(db, register_number).collection('user_notifications')
+
+
+# ============================================================================
+# WRITES
+# ============================================================================
+
+def add(db, register_number, notification_data):
+    """Saves a notification and bumps COUNTER_FIELD (unreadListedCount) in one transaction."""
+    parent = _parent(db, register_number)
+    ref = _collection(db, register_number).document()
+
+    @firestore.transactional
+    def _add(transaction):
+        counted = COUNTER_FIELD in (parent.get([COUNTER_FIELD], transaction=transaction).to_dict() or {})
+        transaction.set(ref, notification_data)
+        # Until the counter is seeded, unread_count() derives it from the documents
+        if counted and not notification_data.get('read') and notification_data.get('type') in DEFAULT_TYPES:
+            transaction.set(parent, {COUNTER_FIELD: firestore.Increment(1)}, merge=True)
+
+    _add(db.transaction())
+    return ref
+
+
+def mark_read(db, register_number, notification_ids=None):
+    """Marks the given notifications (all unread ones if None) as read; returns how many changed."""
+    collection = _collection(db, register_number)
+    if notification_ids is None:
+        unread = [(doc.reference, (doc.to_dict() or {}).get('type')) for doc in
+                  fs_filter(collection, 'read', '==', False).select(['type']).stream()]
+    else:
+        existing = bulk_writes.get_many(db, [collection.document(n) for n in dict.fromkeys(notification_ids)], ['read', 'type'])
+        unread = [(collection.document(n), data.get('type')) for n, data in existing.items()
+                  if data is not None and not data.get('read')]
+    if not unread:
+        return 0
+
+    parent = _parent(db, register_number)
+    counted = COUNTER_FIELD in (parent.get([COUNTER_FIELD]).to_dict() or {})
+
+    def add_counter(batch, items):
+        listed = sum(1 for _, kind in items if kind in DEFAULT_TYPES)
+        if counted and listed:
+            batch.set(parent, {COUNTER_FIELD: firestore.Increment(-listed)}, merge=True)
+
+    result = bulk_writes.run_batched(
+        db, unread,
+        lambda batch, item: batch.update(item[0], {'read': True, 'readAt': firestore.SERVER_TIMESTAMP}),
+        add_counter, reserved_writes=1
+    )
+    return len(result['succeeded'])
+
+
+# ============================================================================
+# READS
+# ============================================================================
+
+def unread_count(db, register_number):
+    """Unread DEFAULT_TYPES notifications from the counter; seeds the counter on first use."""
+    parent = _parent(db, register_number)
+    data = parent.get([COUNTER_FIELD]).to_dict() or {}
+    if COUNTER_FIELD in data:
+        return max(0, int(data[COUNTER_FIELD]))
+    query = fs_filter(_collection(db, register_number), 'read', '==', False)
+    count = fs_count(fs_filter(query, 'type', 'in', list(DEFAULT_TYPES)))
+    parent.set({COUNTER_FIELD: count}, merge=True)
+    return count
+
+
+def parse_types(type_param):
+    """`type=a,b` -> list of types (DEFAULT_TYPES when omitted). Raises ValueError when too many."""
+    if not type_param:
+        return list(DEFAULT_TYPES)
+    types = list(dict.fromkeys(t.strip() for t in type_param.split(',') if t.strip()))
+    if len(types) > MAX_TYPES:
+        raise ValueError(f'At most {MAX_TYPES} types can be requested')
+    return types or list(DEFAULT_TYPES)
+
+
+def _iso_utc(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat() + 'Z'
+
+
+def list_page(db, register_number, types=None, unread_only=False, limit=DEFAULT_LIMIT, cursor=None):
+    """One page of notifications, newest first, filtered in Firestore.
+
+    Falls back to filtering in Python while the composite indexes are missing.
+    Returns (notifications, next_cursor). Raises ValueError for a bad cursor.
+    """
+    types = list(types or DEFAULT_TYPES)
+    collection = _collection(db, register_number)
+    query = fs_filter(collection, 'type', 'in', types)
+    if unread_only:
+        query = fs_filter(query, 'read', '==', False)
+
+    def matches(data):
+        return data.get('type') in types and not (unread_only and data.get('read') is not False)
+
+    index_name = 'user_notifications(read, type, timestamp desc)' if unread_only else 'user_notifications(type, timestamp desc)'
+    docs, next_cursor = fs_page_filtered(query, collection, matches, limit, cursor, index_name, order_field='timestamp')
+    notifications = []
+    for doc in docs:
+        notification = doc.to_dict()
+        notification.setdefault('id', doc.id)
+        notification['notificationId'] = doc.id
+        if hasattr(notification.get('timestamp'), 'isoformat'):
+            notification['timestamp'] = _iso_utc(notification['timestamp'])
+        notifications.append(notification)
+    return notifications, next_cursor
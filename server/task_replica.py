@@ -0,0 +1,222 @@
+# task_replica.py
+import os
+import threading
+import time
+from collections import defaultdict
+
+# In-memory copy of the `tasks` collection fed by a Firestore snapshot listener.
+# query()/unassigned() return None when the replica cannot be trusted; callers
+# then query Firestore directly.
+TASK_REPLICA_ENABLED = os.environ.get('TASK_REPLICA_ENABLED', 'true').lower() == 'true'
+# How long data may still be served after the listener dropped (resync in progress)
+MAX_STALENESS_SECONDS = float(os.environ.get('TASK_REPLICA_MAX_STALENESS_SECONDS', 30))
+# Memory ceiling: above this many documents the replica switches itself off
+MAX_DOCS = int(os.environ.get('TASK_REPLICA_MAX_DOCS', 50000))
+CHECK_INTERVAL_SECONDS = 5
+
+
+class TaskReplica:
+    """Local replica of `tasks` with secondary indexes by status, assignee and registerNumber.
+
+    Unassigned tasks are indexed under assignee None.
+    """
+
+    def __init__(self, max_staleness=MAX_STALENESS_SECONDS, max_docs=MAX_DOCS):
+        self.max_staleness = max_staleness
+        self.max_docs = max_docs
+        self._lock = threading.Lock()
+        self._docs = {}
+        self._by_status = defaultdict(set)
+        self._by_assignee = defaultdict(set)
+        self._by_register = defaultdict(set)
+        self._db = None
+        self._watch = None
+        self._generation = 0
+        self._state = 'stopped'   # stopped -> syncing -> live; disabled when over MAX_DOCS
+        self._live_since = 0
+        self._down_since = None
+        self._last_event_at = 0
+        self._last_read_time = None
+        self._stats = {'events': 0, 'changes': 0, 'resyncs': 0, 'listenerDrops': 0}
+
+    # --- index maintenance (caller holds the lock) ---
+
+    def _index(self, doc_id, data, sign):
+        keys = ((self._by_status, data.get('status')),
+                (self._by_assignee, data.get('assignedTo') or None),
+                (self._by_register, data.get('registerNumber')))
+        for index, key in keys:
+            if sign > 0:
+                index[key].add(doc_id)
+            else:
+                index[key].discard(doc_id)
+                if not index[key]:
+                    del index[key]
+
+    def _put(self, doc_id, data):
+        old = self._docs.get(doc_id)
+        if old is not None:
+            self._index(doc_id, old, -1)
+        self._docs[doc_id] = data
+        self._index(doc_id, data, +1)
+
+    def _remove(self, doc_id):
+        old = self._docs.pop(doc_id, None)
+        if old is not None:
+            self._index(doc_id, old, -1)
+
+    def _reset(self):
+        self._docs = {}
+        self._by_status = defaultdict(set)
+        self._by_assignee = defaultdict(set)
+        self._by_register = defaultdict(set)
+
+    # --- listener ---
+
+    def start(self, db):
+        """Starts the listener and a supervisor thread that resyncs when it drops."""
+        self._db = db
+        self._subscribe()
+        threading.Thread(target=self._supervise, name='task-replica-supervisor', daemon=True).start()
+
+    def _subscribe(self):
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            if self._state != 'disabled':
+                self._state = 'syncing'
+        self._watch = self._db.collection('tasks').on_snapshot(self._on_snapshot(generation))
+
+    def _on_snapshot(self, generation):
+        first = [True]
+
+        def callback(docs, changes, read_time):
+            with self._lock:
+                if generation != self._generation or self._state == 'disabled':
+                    return
+                if first[0]:
+                    # Initial snapshot of a (re)subscription: replace everything
+                    first[0] = False
+                    self._reset()
+                    for doc in docs:
+                        self._put(doc.id, doc.to_dict())
+                else:
+                    for change in changes:
+                        if change.type.name == 'REMOVED':
+                            self._remove(change.document.id)
+                        else:
+                            self._put(change.document.id, change.document.to_dict())
+                    self._stats['changes'] += len(changes)
+                self._stats['events'] += 1
+                self._last_event_at = time.time()
+                self._last_read_time = read_time
+                if len(self._docs) > self.max_docs:
+                    self._disable()
+                    return
+                if self._state == 'syncing':
+                    self._state = 'live'
+                    self._live_since = time.time()
+                    self._down_since = None
+                    print(f"🪞 Task replica live: {len(self._docs)} tasks")
+        return callback
+
+    def _disable(self):
+        print(f"⚠️ Task replica exceeded {self.max_docs} documents, switching to direct Firestore reads")
+        self._state = 'disabled'
+        self._reset()
+        threading.Thread(target=self._close_watch, daemon=True).start()
+
+    def _close_watch(self):
+        watch, self._watch = self._watch, None
+        if watch is not None:
+            try:
+                watch.unsubscribe()
+            except Exception:
+                pass
+
+    def _listener_closed(self):
+        # Watch has no public health flag; it sets _closed when the stream ends for good
+        return self._watch is None or getattr(self._watch, '_closed', False)
+
+    def _supervise(self):
+        while self._state != 'disabled':
+            time.sleep(CHECK_INTERVAL_SECONDS)
+            if self._state == 'disabled' or not self._listener_closed():
+                continue
+            with self._lock:
+                self._stats['listenerDrops'] += 1
+                if self._down_since is None:
+                    self._down_since = time.time()
+            print("⚠️ Task replica listener dropped, resyncing")
+            try:
+                self._close_watch()
+                self._subscribe()
+                self._stats['resyncs'] += 1
+            except Exception as e:
+                print(f"⚠️ Task replica resync failed, retrying: {e}")
+
+    # --- reads ---
+
+    def is_usable(self):
+        """True while data can be served: live, or within the staleness bound of a drop."""
+        if self._state == 'live' and self._down_since is None:
+            return True
+        if self._down_since is not None and self._live_since:
+            return time.time() - self._down_since <= self.max_staleness
+        return False
+
+    def version(self):
+        """Changes with every listener event; None unless the listener is live (see conditional.py)."""
+        if self._state != 'live' or self._down_since is not None or self._listener_closed():
+            return None
+        return f"{self._generation}.{self._stats['events']}"
+
+    def query(self, status=None, assignee=None, register_number=None):
+        """Returns [(task_id, task_data copy)] matching all given filters, or None if the replica is not usable.
+
+        Pass assignee=None for "any assignee"; use unassigned() for tasks without one.
+        """
+        if not self.is_usable():
+            return None
+        with self._lock:
+            candidates = None
+            for index, key in ((self._by_status, status), (self._by_assignee, assignee), (self._by_register, register_number)):
+                if key is None:
+                    continue
+                ids = index.get(key, set())
+                candidates = ids if candidates is None else candidates & ids
+            if candidates is None:
+                candidates = self._docs.keys()
+            return [(doc_id, dict(self._docs[doc_id])) for doc_id in candidates]
+
+    def unassigned(self):
+        """Tasks with no assignee, or None if the replica is not usable."""
+        if not self.is_usable():
+            return None
+        with self._lock:
+            return [(doc_id, dict(self._docs[doc_id])) for doc_id in self._by_assignee.get(None, ())]
+
+    def get_stats(self):
+        with self._lock:
+            now = time.time()
+            read_time = self._last_read_time
+            # Delay between Firestore's read time and the event reaching this process
+            lag = self._last_event_at - read_time.timestamp() if hasattr(read_time, 'timestamp') else None
+            return dict(
+                self._stats,
+                state=self._state,
+                usable=self.is_usable(),
+                documents=len(self._docs),
+                maxDocuments=self.max_docs,
+                statuses={status: len(ids) for status, ids in self._by_status.items()},
+                assignees=len(self._by_assignee),
+                students=len(self._by_register),
+                lastEventAgeSeconds=round(now - self._last_event_at, 1) if self._last_event_at else None,
+                lagSeconds=round(lag, 3) if lag is not None else None,
+                downForSeconds=round(now - self._down_since, 1) if self._down_since else None,
+                maxStalenessSeconds=self.max_staleness
+            )
+
+
+# Shared by all request threads of this process
+task_replica = TaskReplica()
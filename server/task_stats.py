@@ -0,0 +1,273 @@
+# task_stats.py
+"""
+Materialized task counters so admin endpoints read O(1) documents instead of the whole
+`tasks` collection.
+
+stats/tasks                  total, byStatus{status}, byAssignee{staff}{total, <status>},
+                             responseMinutesTotal/responseCount (for average response time)
+student_stats/{registerNumber}  name, totalReports, lastActive
+
+Every task write goes through a StatsDelta applied in the same batch or transaction
+as the task write itself, so counters and tasks commit together. Writes whose
+counter change depends on the task's current state read that state in the same
+transaction (update_task, bulk_writes.run_transactional).
+
+The counters are seeded by rebuild(), which stamps rebuiltAt. Until a process
+has seen that stamp (ensure_seeded, run at server startup) it leaves the
+counters alone, so increments never create a partial stats document that
+would then pass for a seeded one.
+"""
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+STATS_COLLECTION = 'stats'
+TASK_STATS_DOC = 'tasks'
+STUDENT_STATS_COLLECTION = 'student_stats'
+SEED_MARKER = 'rebuiltAt'
+
+_seed_lock = threading.Lock()
+_seeded = False
+
+
+def _status(task):
+    return (task or {}).get('status') or 'unknown'
+
+
+class StatsDelta:
+    """Accumulates counter changes for one batch/transaction of task writes."""
+
+    def __init__(self):
+        self.total = 0
+        self.by_status = defaultdict(int)
+        self.by_assignee = defaultdict(lambda: defaultdict(int))
+        self.students = {}  # registerNumber -> {'delta': n, 'name': str}
+        self.response_minutes = 0.0
+        self.response_count = 0
+
+    def _bump(self, task, sign):
+        status = _status(task)
+        self.total += sign
+        self.by_status[status] += sign
+        assignee = task.get('assignedTo')
+        if assignee:
+            self.by_assignee[assignee]['total'] += sign
+            self.by_assignee[assignee][status] += sign
+
+    def add(self, before, after):
+        """Records one task write. `before` is None for a create, `after` is None for a delete.
+
+        `after` only needs the fields that changed on top of `before`.
+        """
+        if before is not None:
+            self._bump(before, -1)
+        if after is not None:
+            merged = dict(before or {}, **after)
+            self._bump(merged, +1)
+            if _status(merged) == 'completed' and _status(before) != 'completed':
+                created_at = (before or {}).get('createdAt')
+                if hasattr(created_at, 'timestamp'):
+                    self.response_minutes += (time.time() - created_at.timestamp()) / 60
+                    self.response_count += 1
+
+        if before is None and after is not None and after.get('registerNumber'):
+            self._student(after.get('registerNumber'), 1, after.get('studentName'))
+        elif after is None and before is not None and before.get('registerNumber'):
+            self._student(before.get('registerNumber'), -1)
+
+    def _student(self, register_number, delta, name=None):
+        entry = self.students.setdefault(register_number, {'delta': 0, 'name': None})
+        entry['delta'] += delta
+        if name:
+            entry['name'] = name
+
+    def apply(self, writer, db):
+        """Adds the counter writes to a WriteBatch or Transaction (one write per stats document)."""
+        if not _seeded and not _seed_marker_present(db):
+            # rebuild() counts this write from the tasks collection when it seeds the counters
+            return
+        update = {}
+        if self.total:
+            update['total'] = firestore.Increment(self.total)
+        statuses = {s: firestore.Increment(n) for s, n in self.by_status.items() if n}
+        if statuses:
+            update['byStatus'] = statuses
+        assignees = {}
+        for staff_id, counts in self.by_assignee.items():
+            changed = {k: firestore.Increment(n) for k, n in counts.items() if n}
+            if changed:
+                assignees[staff_id] = changed
+        if assignees:
+            update['byAssignee'] = assignees
+        if self.response_count:
+            update['responseMinutesTotal'] = firestore.Increment(self.response_minutes)
+            update['responseCount'] = firestore.Increment(self.response_count)
+        if update:
+            update['updatedAt'] = firestore.SERVER_TIMESTAMP
+            writer.set(db.collection(STATS_COLLECTION).document(TASK_STATS_DOC), update, merge=True)
+
+        for register_number, entry in self.students.items():
+            student_update = {'registerNumber': register_number}
+            if entry['delta']:
+                student_update['totalReports'] = firestore.Increment(entry['delta'])
+            if entry['delta'] > 0:
+                student_update['lastActive'] = firestore.SERVER_TIMESTAMP
+            if entry['name']:
+                student_update['name'] = entry['name']
+            writer.set(db.collection(STUDENT_STATS_COLLECTION).document(register_number), student_update, merge=True)
+
+
+def record(writer, db, before, after):
+    """Shortcut for a single task write."""
+    delta = StatsDelta()
+    delta.add(before, after)
+    delta.apply(writer, db)
+
+
+def update_task(db, task_ref, updates):
+    """Transactionally applies `updates` to a task and its counters.
+
+    `updates` may also be a function of the current task data that returns the updates.
+    Returns the task data as it was before the update, or None if the task does not exist.
+    """
+    transaction = db.transaction()
+
+    @firestore.transactional
+    def _update(transaction):
+        snapshot = task_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        before = snapshot.to_dict()
+        changes = updates(before) if callable(updates) else updates
+        transaction.update(task_ref, changes)
+        record(transaction, db, before, changes)
+        return before
+
+    return _update(transaction)
+
+
+def _seed_marker_present(db):
+    global _seeded
+    doc = db.collection(STATS_COLLECTION).document(TASK_STATS_DOC).get()
+    if doc.exists and (doc.to_dict() or {}).get(SEED_MARKER):
+        _seeded = True
+    return _seeded
+
+
+def ensure_seeded(db):
+    """Rebuilds the counters unless a previous rebuild() stamped them; then enables apply().
+
+    Run at startup before requests are served: one document read when already seeded.
+    """
+    with _seed_lock:
+        if not _seeded and not _seed_marker_present(db):
+            print("📊 Task stats not seeded yet, rebuilding from the tasks collection...")
+            rebuild(db)
+
+
+# ============================================================================
+# READS
+# ============================================================================
+
+def read_task_stats(db, rebuild_if_missing=True):
+    """Returns the stats/tasks document, seeding it from the tasks collection once if needed.
+
+    With rebuild_if_missing=False, returns None while the counters are not seeded.
+    """
+    if rebuild_if_missing:
+        ensure_seeded(db)
+    doc = db.collection(STATS_COLLECTION).document(TASK_STATS_DOC).get()
+    stats = doc.to_dict() if doc.exists else None
+    if not (stats and stats.get(SEED_MARKER)):
+        if not rebuild_if_missing:
+            return None
+        stats = rebuild(db)
+    stats.setdefault('total', 0)
+    stats.setdefault('byStatus', {})
+    stats.setdefault('byAssignee', {})
+    return stats
+
+
+def staff_counts(stats, staff_id):
+    """Per-staff {'total', 'pending', 'completed'} from a stats document."""
+    counts = stats.get('byAssignee', {}).get(staff_id, {})
+    return {
+        'total': counts.get('total', 0),
+        'pending': counts.get('pending', 0),
+        'completed': counts.get('completed', 0)
+    }
+
+
+def average_response_minutes(stats):
+    count = stats.get('responseCount', 0)
+    return stats.get('responseMinutesTotal', 0) / count if count else 0
+
+
+def read_student_stats(db):
+    """All per-student counters (one document per student who has reported)."""
+    return [doc.to_dict() for doc in db.collection(STUDENT_STATS_COLLECTION).stream() if doc.to_dict().get('totalReports', 0) > 0]
+
+
+# ============================================================================
+# REBUILD (backfill / repair)
+# ============================================================================
+
+def rebuild(db):
+    """Recomputes all counters with one pass over the tasks collection and overwrites them.
+
+    Runs as one transaction that reads the stats document first. Every counter
+    update also writes that document, so batches committed while the rebuild
+    runs wait for it and then apply their increments on top of the new totals
+    instead of being overwritten by them.
+    """
+    global _seeded
+    started = time.perf_counter()
+    stats_ref = db.collection(STATS_COLLECTION).document(TASK_STATS_DOC)
+    fields = ['status', 'assignedTo', 'registerNumber', 'studentName', 'createdAt', 'completedAt']
+
+    @firestore.transactional
+    def _rebuild(transaction):
+        stats_ref.get(transaction=transaction)
+        delta = StatsDelta()
+        students = {}
+        for doc in db.collection('tasks').select(fields).stream(transaction=transaction):
+            task = doc.to_dict()
+            delta._bump(task, +1)
+            created_at, completed_at = task.get('createdAt'), task.get('completedAt')
+            if _status(task) == 'completed' and hasattr(created_at, 'timestamp') and hasattr(completed_at, 'timestamp'):
+                delta.response_minutes += (completed_at.timestamp() - created_at.timestamp()) / 60
+                delta.response_count += 1
+            register_number = task.get('registerNumber')
+            if register_number:
+                student = students.setdefault(register_number, {'registerNumber': register_number, 'name': task.get('studentName') or 'Unknown', 'totalReports': 0, 'lastActive': None})
+                student['totalReports'] += 1
+                if created_at and (student['lastActive'] is None or created_at > student['lastActive']):
+                    student['lastActive'] = created_at
+                    student['name'] = task.get('studentName') or student['name']
+
+        # Stale student docs from deleted tasks are zeroed rather than left behind
+        for doc in db.collection(STUDENT_STATS_COLLECTION).select(['registerNumber']).stream(transaction=transaction):
+            students.setdefault(doc.id, {'registerNumber': doc.id, 'totalReports': 0})
+
+        stats = {
+            'total': delta.total,
+            'byStatus': dict(delta.by_status),
+            'byAssignee': {sid: dict(counts) for sid, counts in delta.by_assignee.items()},
+            'responseMinutesTotal': delta.response_minutes,
+            'responseCount': delta.response_count,
+            SEED_MARKER: datetime.now(timezone.utc),
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        }
+        transaction.set(stats_ref, stats)
+        for register_number, student in students.items():
+            transaction.set(db.collection(STUDENT_STATS_COLLECTION).document(register_number), student, merge=True)
+        stats.pop('updatedAt')
+        return stats, len(students)
+
+    stats, student_count = _rebuild(db.transaction())
+    _seeded = True
+    print(f"📊 Task stats rebuilt: {stats['total']} tasks, {student_count} students in {time.perf_counter() - started:.1f}s")
+    return stats